@@ -7,12 +7,14 @@ from .mytools import (
     call_data_retrieval_agent,
     call_html_report_agent,
     call_table_explorer_agent,
+    find_similar_analysis,
 )
 from .sub_agent.data_analyzer_agent import data_analyzer_agent
 from .sub_agent.data_retrieval_agent import data_retrieval_agent
 from .sub_agent.html_report_agent import html_report_agent
 from .sub_agent.table_explorer_agent import table_explorer
 from .tools.mcptoolset import postgres_toolset
+from .utils.rate_limit import before_model_rate_limit
 
 root_agent = LlmAgent(
     name="auto_analytics_agent",
@@ -21,12 +23,17 @@ root_agent = LlmAgent(
     instruction=(
         "あなたは自動データ分析エージェントです。ステップ1から5を実行して、データ分析を実施します\n"
         "**分析の流れ:**\n"
-        "**1. ユーザーのリクエスト理解: ユーザーのリクエストを理解する\n"
+        "**1. ユーザーのリクエスト理解 / Tool `find_similar_analysis`**: ユーザーのリクエストを理解し、toolで類似した過去の分析を確認する\n"
+        "   - `match.question`がユーザーのリクエストと同じ意図の場合のみ再利用する\n"
+        "   - actionが`reuse_report`の場合: 既存レポートのURLを提示して終了する\n"
+        "   - actionが`reuse_sql`の場合: ステップ2を省略し、`match.sql`を`call_data_retrieval_agent`に渡してステップ3から実行する\n"
         # "**2. SQLクエリ生成、実行、エラー修正 / Agent `data_retrieval_agent`**: データを取得に利用\n"
         # "**3. データ分析と洞察抽出 / Tool `data_analyzer_agent`**: `data_retrieval_agent`で取得したデータでデータ分析をする\n"
         # "**4: レポート生成 / Agent `html_report_agent`**: HTML形式のレポートを作成に利用\n\n"
         "**2. テーブル探索とスキーマ・サンプル確認 / Tool `call_table_explorer_agent`**: ユーザーのリクエストを理解し、toolで分析対象のテーブルを表示\n"
         "**3. 加工と集計 / Tool `call_data_retrieval_agent`**: call_table_explorer_agentでテーブルを特定したら、toolでデータを表示\n"
+        "   - 集計の切り口を探索する段階では `approximate=True` でサンプルからの近似値（信頼区間付き）を高速に取得できる\n"
+        "   - ステップ5の前には必ず `approximate=False` で最終的なクエリを実行し、正確な結果を取得する\n"
         "**4. データ分析と洞察抽出 / Tool `call_data_analyzer_agent`**: call_data_retrieval_agentを実行したら、toolで分析結果を表示\n"
         "**5: レポート生成 / Tool `call_html_report_agent`**: toolでHTML形式のレポートの作成結果を表示\n"
     ),
@@ -37,9 +44,11 @@ root_agent = LlmAgent(
     # ],
     tools=[
         # postgres_toolset,
+        find_similar_analysis,
         call_data_retrieval_agent,
         call_table_explorer_agent,
         call_html_report_agent,
         call_data_analyzer_agent,
     ],
+    before_model_callback=before_model_rate_limit,
 )
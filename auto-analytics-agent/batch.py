@@ -0,0 +1,288 @@
+"""
+ヘッドレスのバッチ分析ランナー
+
+質問ファイル（1行1質問のテキスト、または {"id", "question"} のJSON Lines）を読み込み、
+root_agent のセッションを上限付きのワーカープールで並行実行する。
+
+使用例:
+    python -m auto-analytics-agent.batch questions.txt --workers 4 --gemini-rpm 60
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import statistics
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import google.genai.types as types
+from google.adk.artifacts import InMemoryArtifactService
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+
+from .agent import root_agent
+from .utils.rate_limit import configure_db_concurrency, configure_gemini_rate_limit
+
+APP_NAME = "auto_analytics_batch"
+USER_ID = "batch"
+
+# root_agent のツール呼び出しとパイプラインのステージの対応
+STAGE_BY_TOOL = {
+    "find_similar_analysis": "similarity_lookup",
+    "call_table_explorer_agent": "table_explorer",
+    "call_data_retrieval_agent": "data_retrieval",
+    "call_data_analyzer_agent": "data_analyzer",
+    "call_html_report_agent": "html_report",
+}
+
+
+def load_questions(path: Path) -> List[Dict[str, str]]:
+    """
+    質問ファイルを読み込む
+
+    IDが指定されていない質問には、行番号と質問文から安定したIDを割り当てる。
+    """
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if path.suffix == ".jsonl":
+                item = json.loads(line)
+                question = item["question"]
+                question_id = str(item.get("id") or "")
+            else:
+                question = line
+                question_id = ""
+            if not question_id:
+                digest = hashlib.sha1(question.encode("utf-8")).hexdigest()[:10]
+                question_id = f"{line_number}-{digest}"
+            questions.append({"id": question_id, "question": question})
+    return questions
+
+
+class Checkpoint:
+    """完了した質問をJSON Linesで記録し、再実行時に再開できるようにする"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.completed: Dict[str, Dict[str, Any]] = {}
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # クラッシュ時に途中まで書かれた行は無視する
+                        continue
+                    if record.get("status") == "succeeded":
+                        self.completed[record["id"]] = record
+
+    def record(self, record: Dict[str, Any]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+        if record["status"] == "succeeded":
+            self.completed[record["id"]] = record
+
+
+def create_runner() -> Runner:
+    """root_agent をメモリ上のセッションで実行するRunnerを作成する"""
+    return Runner(
+        app_name=APP_NAME,
+        agent=root_agent,
+        artifact_service=InMemoryArtifactService(),
+        session_service=InMemorySessionService(),
+    )
+
+
+async def run_question(
+    runner: Runner,
+    item: Dict[str, str],
+    on_stage: Optional[Callable[[str], None]] = None,
+) -> Dict[str, Any]:
+    """
+    1つの質問を新しいセッションで実行する
+
+    Args:
+        runner: 実行に使用するRunner
+        item: {"id", "question"} の辞書
+        on_stage: パイプラインのステージ開始時に呼ばれるコールバック
+    """
+    started = time.monotonic()
+    session = await runner.session_service.create_session(
+        app_name=APP_NAME, user_id=USER_ID
+    )
+    session_id = session.id
+    content = types.Content(
+        role="user", parts=[types.Part.from_text(text=item["question"])]
+    )
+
+    final_text = ""
+    async for event in runner.run_async(
+        user_id=USER_ID, session_id=session_id, new_message=content
+    ):
+        if on_stage is not None:
+            for call in event.get_function_calls():
+                if call.name in STAGE_BY_TOOL:
+                    on_stage(STAGE_BY_TOOL[call.name])
+        if event.is_final_response() and event.content and event.content.parts:
+            final_text = "\n".join(p.text for p in event.content.parts if p.text)
+
+    session = await runner.session_service.get_session(
+        app_name=APP_NAME, user_id=USER_ID, session_id=session_id
+    )
+    last_report = (session.state.get("last_report") if session else None) or {}
+    # 終了したセッションはメモリから解放する
+    await runner.session_service.delete_session(
+        app_name=APP_NAME, user_id=USER_ID, session_id=session_id
+    )
+    return {
+        "report_filename": last_report.get("filename"),
+        "response": final_text,
+        "latency_sec": round(time.monotonic() - started, 3),
+    }
+
+
+async def run_batch(
+    questions: List[Dict[str, str]],
+    checkpoint: Checkpoint,
+    workers: int,
+) -> List[Dict[str, Any]]:
+    """未完了の質問をワーカープールで実行し、今回の実行結果を返す"""
+    runner = create_runner()
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in questions:
+        if item["id"] not in checkpoint.completed:
+            queue.put_nowait(item)
+    results: List[Dict[str, Any]] = []
+
+    async def worker(worker_id: int) -> None:
+        while True:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            record: Dict[str, Any] = {"id": item["id"], "question": item["question"]}
+            started = time.monotonic()
+            try:
+                record.update(await run_question(runner, item))
+                record["status"] = "succeeded"
+            except Exception as e:
+                record["status"] = "failed"
+                record["error"] = str(e)
+                record["latency_sec"] = round(time.monotonic() - started, 3)
+            record["finished_at"] = datetime.now().isoformat()
+            checkpoint.record(record)
+            results.append(record)
+            print(
+                f"[worker {worker_id}] {record['status']}: {item['id']} "
+                f"({record['latency_sec']}s)",
+                flush=True,
+            )
+
+    await asyncio.gather(*(worker(i) for i in range(max(1, workers))))
+    return results
+
+
+def summarize(
+    results: List[Dict[str, Any]], skipped: int, elapsed_sec: float
+) -> Dict[str, Any]:
+    """スループットと質問ごとのレイテンシを集計する"""
+    latencies = sorted(
+        r["latency_sec"] for r in results if r["status"] == "succeeded"
+    )
+    succeeded = len(latencies)
+
+    def percentile(p: float) -> Optional[float]:
+        if not latencies:
+            return None
+        index = int(round(p * (len(latencies) - 1)))
+        return latencies[min(len(latencies) - 1, index)]
+
+    return {
+        "processed": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "skipped": skipped,
+        "elapsed_sec": round(elapsed_sec, 3),
+        "throughput_per_min": (
+            round(succeeded / elapsed_sec * 60, 2) if elapsed_sec > 0 else None
+        ),
+        "latency_sec": {
+            "mean": round(statistics.mean(latencies), 3) if latencies else None,
+            "p50": percentile(0.5),
+            "p90": percentile(0.9),
+            "p99": percentile(0.99),
+            "max": latencies[-1] if latencies else None,
+        },
+        "questions": [
+            {
+                "id": r["id"],
+                "status": r["status"],
+                "latency_sec": r["latency_sec"],
+                "report_filename": r.get("report_filename"),
+                "error": r.get("error"),
+            }
+            for r in results
+        ],
+    }
+
+
+def main() -> None:
+    """バッチ分析のエントリーポイント"""
+    parser = argparse.ArgumentParser(description="Auto Analytics batch runner")
+    parser.add_argument("questions", help="質問ファイル（.txt または .jsonl）")
+    parser.add_argument(
+        "--workers", type=int, default=4, help="並行実行するセッション数"
+    )
+    parser.add_argument(
+        "--gemini-rpm", type=float, help="Gemini APIの毎分リクエスト上限"
+    )
+    parser.add_argument("--gemini-burst", type=int, help="Gemini APIのバースト許容数")
+    parser.add_argument(
+        "--db-concurrency", type=int, help="DBを使用するステージの同時実行数"
+    )
+    parser.add_argument(
+        "--checkpoint",
+        help="チェックポイントファイル（既定: <questions>.checkpoint.jsonl）",
+    )
+    parser.add_argument("--summary", help="サマリーを書き出すJSONファイル")
+    args = parser.parse_args()
+
+    questions_path = Path(args.questions)
+    checkpoint_path = Path(
+        args.checkpoint or questions_path.with_suffix(".checkpoint.jsonl")
+    )
+
+    if args.gemini_rpm:
+        configure_gemini_rate_limit(args.gemini_rpm, args.gemini_burst)
+    if args.db_concurrency:
+        configure_db_concurrency(args.db_concurrency)
+
+    questions = load_questions(questions_path)
+    checkpoint = Checkpoint(checkpoint_path)
+    skipped = sum(1 for q in questions if q["id"] in checkpoint.completed)
+    print(
+        f"🚀 {len(questions)} questions ({skipped} already completed), "
+        f"{args.workers} workers",
+        flush=True,
+    )
+
+    started = time.monotonic()
+    results = asyncio.run(run_batch(questions, checkpoint, args.workers))
+    summary = summarize(results, skipped, time.monotonic() - started)
+
+    overview = {k: v for k, v in summary.items() if k != "questions"}
+    print(json.dumps(overview, ensure_ascii=False, indent=2))
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
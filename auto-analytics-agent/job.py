@@ -0,0 +1,54 @@
+"""
+単一の分析ジョブを実行するエントリーポイント
+
+FastAPIサーバーのジョブワーカーからサブプロセスとして起動される。
+進捗と結果は標準出力に1行1件のJSONとして出力する:
+
+    {"type": "stage", "stage": "table_explorer"}
+    {"type": "result", "report_filename": "...", "response": "...", "latency_sec": 1.2}
+    {"type": "error", "error": "..."}
+
+使用例:
+    python -m auto-analytics-agent.job "店舗別の月次売上推移を分析して"
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from typing import Any, Dict
+
+from .batch import create_runner, run_question
+
+
+def _emit(message: Dict[str, Any]) -> None:
+    sys.stdout.write(json.dumps(message, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+
+def main() -> None:
+    """分析ジョブのエントリーポイント"""
+    parser = argparse.ArgumentParser(description="Auto Analytics single job runner")
+    parser.add_argument("question", help="分析リクエスト")
+    parser.add_argument("--id", default="job", help="ジョブID")
+    args = parser.parse_args()
+
+    def on_stage(stage: str) -> None:
+        _emit({"type": "stage", "stage": stage})
+
+    try:
+        result = asyncio.run(
+            run_question(
+                create_runner(),
+                {"id": args.id, "question": args.question},
+                on_stage=on_stage,
+            )
+        )
+    except Exception as e:
+        _emit({"type": "error", "error": str(e)})
+        sys.exit(1)
+    _emit({"type": "result", **result})
+
+
+if __name__ == "__main__":
+    main()
@@ -8,19 +8,46 @@ from .sub_agent.data_analyzer_agent import data_analyzer_agent
 from .sub_agent.data_retrieval_agent import data_retrieval_agent
 from .sub_agent.html_report_agent import html_report_agent
 from .sub_agent.table_explorer_agent import table_explorer
+from .utils.analysis_index import analysis_index, find_reusable_analysis
+from .utils.approximate_query import APPROXIMATE_MODE_KEY, APPROXIMATE_USED_KEY
+from .utils.context_compaction import compact_stage_output
+from .utils.query_log import EXECUTED_QUERIES_KEY, executed_queries
+from .utils.rate_limit import db_slot
 
 
 async def call_data_retrieval_agent(
     question: str,
     tool_context: ToolContext,
+    approximate: bool = False,
 ) -> Dict[str, Any]:
-    """Tool to call data retrieval agent."""
+    """Tool to call data retrieval agent.
+
+    Set approximate to True for exploratory queries: aggregates are estimated
+    from a sample of the fact tables and returned with confidence intervals.
+    """
     agent_tool = AgentTool(agent=data_retrieval_agent)
-    data_retrieval_output = await agent_tool.run_async(
-        args={"request": question}, tool_context=tool_context
+    # 近似モードはこの呼び出しの間だけ有効にする
+    tool_context.state[APPROXIMATE_MODE_KEY] = approximate
+    tool_context.state[APPROXIMATE_USED_KEY] = False
+    # この呼び出しで実行されたクエリだけを記録する
+    tool_context.state[EXECUTED_QUERIES_KEY] = []
+    try:
+        # DBを使用するステージの同時実行数を制限する
+        async with db_slot():
+            data_retrieval_output = await agent_tool.run_async(
+                args={"request": question}, tool_context=tool_context
+            )
+    finally:
+        tool_context.state[APPROXIMATE_MODE_KEY] = False
+    # SQLは出力から抽出せず、execute-query で実行したものをそのまま記録する
+    sql = [
+        query["sql"]
+        for query in executed_queries(tool_context.state, include_approximate=approximate)
+    ]
+    # 出力全体はartifactに退避し、stateと以降のプロンプトには予算内のサマリーのみを残す
+    return await compact_stage_output(
+        "data_retrieval", data_retrieval_output, tool_context, sql=sql
     )
-    tool_context.state["data_retrieval_output"] = data_retrieval_output
-    return data_retrieval_output
 
 
 async def call_table_explorer_agent(
@@ -30,24 +57,44 @@ async def call_table_explorer_agent(
     """Tool to call table explorer agent."""
     agent_tool = AgentTool(agent=table_explorer)
 
-    table_explorer_output = await agent_tool.run_async(
-        args={"request": question}, tool_context=tool_context
-    )
-    tool_context.state["table_explorer_output"] = table_explorer_output
-    return table_explorer_output
+    # DBを使用するステージの同時実行数を制限する
+    async with db_slot():
+        table_explorer_output = await agent_tool.run_async(
+            args={"request": question}, tool_context=tool_context
+        )
+    # 出力全体はartifactに退避し、stateと以降のプロンプトには予算内のサマリーのみを残す
+    return await compact_stage_output("table_explorer", table_explorer_output, tool_context)
 
 
 async def call_html_report_agent(
     question: str, tool_context: ToolContext
 ) -> Dict[str, Any]:
     """Tool to call HTML report generator agent."""
+    # 最終レポートは正確なクエリ結果からのみ作成する
+    if tool_context.state.get(APPROXIMATE_USED_KEY):
+        return (
+            "直前のデータ取得は近似モード（サンプルからの推定値）でした。"
+            "レポートを作成する前に approximate=False で call_data_retrieval_agent を"
+            "再実行し、正確な結果を取得してください。"
+        )
     agent_tool = AgentTool(agent=html_report_agent)
+    # 前回の呼び出しで生成したレポートを今回の結果として扱わない
+    tool_context.state["last_report"] = None
 
     html_report_output = await agent_tool.run_async(
         args={"request": question}, tool_context=tool_context
     )
-    tool_context.state["html_report_output"] = html_report_output
-    return html_report_output
+    # 出力全体はartifactに退避し、stateと以降のプロンプトには予算内のサマリーのみを残す
+    summary = await compact_stage_output("html_report", html_report_output, tool_context)
+    _record_analysis(tool_context)
+    # レポートのURLは抜粋から切り落とされないよう別に返す
+    report = tool_context.state.get("last_report") or {}
+    if report.get("filename"):
+        summary = {
+            **summary,
+            "report_url": f"http://localhost:9000/reports/{report['filename']}",
+        }
+    return summary
 
 
 async def call_data_analyzer_agent(
@@ -60,5 +107,47 @@ async def call_data_analyzer_agent(
     data_analyzer_output = await agent_tool.run_async(
         args={"request": question}, tool_context=tool_context
     )
-    tool_context.state["data_analyzer_output"] = data_analyzer_output
-    return data_analyzer_output
+    # 出力全体はartifactに退避し、stateと以降のプロンプトには予算内のサマリーのみを残す
+    return await compact_stage_output("data_analyzer", data_analyzer_output, tool_context)
+
+
+async def find_similar_analysis(
+    question: str,
+    tool_context: ToolContext,
+) -> Dict[str, Any]:
+    """Tool to find a previous analysis similar to the question."""
+    tool_context.state["analysis_question"] = question
+    result = find_reusable_analysis(question)
+    match = result["match"]
+    if result["action"] == "reuse_report":
+        result["message"] = (
+            f"類似した分析レポートが http://localhost:9000/reports/"
+            f"{match['report_filename']} で表示可能です。"
+        )
+    elif result["action"] == "reuse_sql":
+        result["message"] = (
+            "類似した過去の分析のSQLを再利用できます。"
+            "テーブル探索を省略し、このSQLを call_data_retrieval_agent に渡してください。"
+        )
+    else:
+        result["message"] = "類似した過去の分析はありません。"
+    return result
+
+
+def _record_analysis(tool_context: ToolContext) -> None:
+    """生成したレポートと使用したSQL・テーブルを類似検索インデックスに記録する"""
+    report = tool_context.state.get("last_report") or {}
+    question = tool_context.state.get("analysis_question")
+    if not report.get("filename") or not question:
+        return
+    retrieval = tool_context.state.get("data_retrieval_output") or {}
+    explorer = tool_context.state.get("table_explorer_output") or {}
+    tables = list(
+        dict.fromkeys(retrieval.get("tables", []) + explorer.get("tables", []))
+    )
+    analysis_index.add(
+        question=question,
+        sql=retrieval.get("sql", []),
+        tables=tables,
+        report_filename=report["filename"],
+    )
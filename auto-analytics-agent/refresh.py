@@ -0,0 +1,63 @@
+"""
+保存済みレポートの差分更新
+
+レポート作成時に記録したSQLだけを再実行し、LLMを呼び出さずにレポートを再生成する。
+結果は1レポートにつき1行のJSONとして標準出力に出力する。
+
+使用例:
+    python -m auto-analytics-agent.refresh analysis_report_20250101_120000_1a2b3c4d.html
+    python -m auto-analytics-agent.refresh --all --full
+"""
+
+import argparse
+import json
+import sys
+
+from .utils.analysis_index import REPORTS_DIR
+from .utils.report_refresh import refresh_report
+
+
+def main() -> None:
+    """レポート更新のエントリーポイント"""
+    parser = argparse.ArgumentParser(description="Auto Analytics report refresher")
+    parser.add_argument("reports", nargs="*", help="更新するレポートのファイル名")
+    parser.add_argument(
+        "--all", action="store_true", help="SQLが記録されたすべてのレポートを更新する"
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="差分ではなく全件を再実行する（過去データの修正を反映する）",
+    )
+    args = parser.parse_args()
+
+    filenames = list(args.reports)
+    if args.all:
+        filenames += [
+            path.with_suffix(".html").name
+            for path in sorted(REPORTS_DIR.glob("*.json"))
+            if path.with_suffix(".html").exists()
+        ]
+    if not filenames:
+        parser.error("report filename or --all is required")
+
+    failed = False
+    for filename in dict.fromkeys(filenames):
+        try:
+            result = refresh_report(filename, full=args.full)
+            print(json.dumps({"status": "succeeded", **result}, ensure_ascii=False), flush=True)
+        except Exception as e:
+            failed = True
+            print(
+                json.dumps(
+                    {"status": "failed", "report_filename": filename, "error": str(e)},
+                    ensure_ascii=False,
+                ),
+                flush=True,
+            )
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
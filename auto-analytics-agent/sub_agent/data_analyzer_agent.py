@@ -1,7 +1,9 @@
 from google.adk.agents import Agent, BaseAgent, LlmAgent, LoopAgent, SequentialAgent
 from google.adk.code_executors import VertexAiCodeExecutor
+from google.adk.tools import load_artifacts
 
 from ..tools.mcptoolset import postgres_toolset
+from ..utils.rate_limit import before_model_rate_limit
 
 data_analyzer_agent = LlmAgent(
     name="data_analyzer",
@@ -10,7 +12,11 @@ data_analyzer_agent = LlmAgent(
     instruction=(
         "あなたはデータ分析のストーリーテラーです。\n"
         "実行されたクエリの結果データから、興味深い洞察を発見して物語として語ってください。\n\n"
-        "また、グラフや図を使って、データの傾向やパターンを視覚的に表現してください。\n"
+        "また、グラフや図を使って、データの傾向やパターンを視覚的に表現してください。\n\n"
+        "**結果データの読み込み:**\n"
+        "stateの data_retrieval_result は予算内に切り詰めた抜粋です。分析の前に必ず load_artifacts で\n"
+        "データ取得の出力全体（data_retrieval_output.txt）と、各クエリの全行（query_result_*.json）を読み込んでください。\n"
+        "テーブル情報が必要な場合は table_explorer_output.txt も読み込めます。\n\n"
         "**あなたの分析ストーリー:**\n"
         "1. 受け取った結果データを詳しく調べ、数字の意味を理解\n"
         "2. データに隠された興味深いパターンや傾向を発見\n"
@@ -20,7 +26,7 @@ data_analyzer_agent = LlmAgent(
         "- **データが語る物語**: 数字の背後にある意味\n"
         "- **実践的な価値**: 結果をどう活用できるか\n"
         "- **具体的な提案**: 次に取るべき行動\n"
-        "- **信頼性の評価**: 結果の確からしさ\n\n"
+        "- **信頼性の評価**: 結果の確からしさ（近似値の場合は信頼区間を併記する）\n\n"
         "**レポートスタイル:**\n"
         "分析結果を物語のように報告してください。例：\n"
         "「データ分析の結果、興味深い発見がありました。\n"
@@ -30,5 +36,7 @@ data_analyzer_agent = LlmAgent(
         "さらに詳しく調べたい場合は、△△の分析も行ってみてはいかがでしょうか。」\n\n"
         "親しみやすく、実用的な分析レポートを作成してください。"
     ),
+    tools=[load_artifacts],
+    before_model_callback=before_model_rate_limit,
     output_key="analysis_results",
 )
@@ -1,6 +1,10 @@
 from google.adk.agents import Agent, BaseAgent, LlmAgent, LoopAgent, SequentialAgent
 
 from ..tools.mcptoolset import postgres_toolset
+from ..utils.approximate_query import approximate_query_callback
+from ..utils.query_log import record_query_callback, record_result_callback
+from ..utils.query_router import route_query_callback
+from ..utils.rate_limit import before_model_rate_limit
 
 data_retrieval_agent = LlmAgent(
     name="data_retrieval_agent",
@@ -20,7 +24,20 @@ data_retrieval_agent = LlmAgent(
         " - `sql`: SQLクエリ\n"
         " - `sql_results`: クエリ結果\n"
         " - `nl_results`: 結果に関する自然言語の説明\n\n"
+        "**近似モードの結果**\n"
+        " - 探索用の近似モードでは、集計はサンプルから推定した値になる\n"
+        " - `<列名>_ci_low` / `<列名>_ci_high` は推定値の信頼区間（既定95%）、`sample_rows` は集計に使用した行数（サンプル行と、サンプル更新後に追加された行）\n"
+        " - 近似モードの場合は `nl_results` に近似値であることと信頼区間を明記する\n\n"
         ""
     ),
+    before_model_callback=before_model_rate_limit,
+    # 書き換え前のSQLを記録してから、ロールアップで正確に答えられるクエリは
+    # 近似せずにロールアップを使用する
+    before_tool_callback=[
+        record_query_callback,
+        route_query_callback,
+        approximate_query_callback,
+    ],
+    after_tool_callback=record_result_callback,
     output_key="data_retrieval_result",
 )
@@ -1,13 +1,21 @@
+import asyncio
 import json
+import logging
 from datetime import datetime
 from typing import Any, Dict, Optional
 
-import google.genai.types as types
 import markdown
 from google.adk.agents import Agent, BaseAgent, LlmAgent
 from google.adk.tools import ToolContext, load_artifacts
 
 from ..utils.gemini import gemini
+from ..utils.query_log import executed_queries, load_query_results
+from ..utils.rate_limit import before_model_rate_limit
+from ..utils.report_refresh import save_report_spec
+from ..utils.report_renderer import render_report
+from ..utils.report_store import report_reference_part, save_report
+
+logger = logging.getLogger(__name__)
 
 
 def _process_data_to_markdown(data: Any) -> str:
@@ -45,12 +53,14 @@ def _convert_dict_to_markdown(data: Dict[str, Any]) -> str:
         return f"```json\n" f"{json.dumps(data, ensure_ascii=False, indent=2)}\n```"
 
 
-def create_html_report(
+async def create_html_report(
     workflow_data: Dict[str, Any], report_title: str, tool_context: ToolContext
 ) -> Dict[str, Any]:
     """
     ワークフローデータからHTMLレポートを生成し、ADK artifactとして保存する
 
+    HTMLはレポートディレクトリに一度だけ書き込み、artifactにはその参照を保存する。
+
     Args:
         workflow_data: ワークフロー全体の結果データ
         report_title: レポートのタイトル
@@ -60,8 +70,6 @@ def create_html_report(
         成功/失敗の情報を含む辞書
     """
     try:
-        # タイムスタンプの生成
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         generation_time = datetime.now().strftime("%Y年%m月%d日 %H:%M:%S")
 
         # データの抽出と整形
@@ -79,129 +87,59 @@ def create_html_report(
         analysis_results_raw = workflow_data.get("analysis_results", "")
         analysis_results = _process_data_to_markdown(analysis_results_raw)
 
-        # HTMLコンテンツの生成
-        html_content = f"""
-<!DOCTYPE html>
-<html lang="ja">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{report_title}</title>
-    <style>
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI',
-                         Roboto, sans-serif;
-            line-height: 1.6;
-            color: #333;
-            max-width: 1200px;
-            margin: 0 auto;
-            padding: 20px;
-            background-color: #f5f5f5;
-        }}
-        .container {{
-            background-color: white;
-            padding: 30px;
-            border-radius: 8px;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-        }}
-        h1 {{
-            color: #2c3e50;
-            border-bottom: 3px solid #3498db;
-            padding-bottom: 10px;
-        }}
-        h2 {{
-            color: #34495e;
-            margin-top: 30px;
-        }}
-        .info-box {{
-            background-color: #ecf0f1;
-            padding: 15px;
-            border-radius: 5px;
-            margin: 20px 0;
-        }}
-        .sql-box {{
-            background-color: #2c3e50;
-            color: #ecf0f1;
-            padding: 15px;
-            border-radius: 5px;
-            font-family: 'Courier New', monospace;
-            overflow-x: auto;
-        }}
-        table {{
-            width: 100%;
-            border-collapse: collapse;
-            margin: 20px 0;
-        }}
-        th, td {{
-            padding: 12px;
-            text-align: left;
-            border-bottom: 1px solid #ddd;
-        }}
-        th {{
-            background-color: #3498db;
-            color: white;
-            font-weight: bold;
-        }}
-        tr:hover {{
-            background-color: #f5f5f5;
-        }}
-        .analysis-section {{
-            background-color: #e8f5e9;
-            padding: 20px;
-            border-radius: 5px;
-            margin: 20px 0;
-        }}
-        .timestamp {{
-            color: #7f8c8d;
-            font-size: 0.9em;
-            text-align: right;
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>{report_title}</h1>
-        <p class="timestamp">生成日時: {generation_time}</p>
-        
-        <div class="info-box">
-            <h2>📋 分析リクエスト</h2>
-            <p>{interpreted_request}</p>
-        </div>
-        
-        <div class="info-box">
-            <h2>📊 テーブル情報</h2
-            <p>{table_explorer_info}</p>
-        </div>
-
-        <div class="info-box">
-            <h2>📊 データ取得結果</h2>
-            {data_retrieval_result}
-        </div>        
-        <div class="analysis-section">
-            <h2>🔍 分析結果</h2>
-            {analysis_results}
-        </div>
-    </div>
-</body>
-</html>
-        """
-
-        filename = f"/workspace/reports/analysis_report_{timestamp}.html"
-
-        with open(filename, "w", encoding="utf-8") as f:
-            f.write(html_content)
-
-        # ADK Partオブジェクトを作成（文字列から直接作成）
-        html_part = types.Part.from_text(text=html_content)
-
-        # artifactとして保存
-        tool_context.save_artifact(filename, html_part)
+        # HTMLコンテンツの生成（共通CSSは /static から参照する）
+        html_content = render_report(
+            report_title=report_title,
+            generation_time=generation_time,
+            request_summary=interpreted_request,
+            schema_info=table_explorer_info,
+            data_result=data_retrieval_result,
+            insights=analysis_results,
+        )
+
+        # 一時ファイルに書き込んでから置き換えるため、表示サーバーに書きかけのレポートは見えない
+        report_path = await save_report(html_content)
+        filename = str(report_path)
+        report_filename = report_path.name
+
+        # 実行したSQLと取得した結果を記録し、LLMなしで再生成できるようにする
+        queries = await load_query_results(
+            tool_context, executed_queries(tool_context.state)
+        )
+        await asyncio.to_thread(
+            save_report_spec,
+            report_filename=report_filename,
+            report_title=report_title,
+            generation_time=generation_time,
+            sections={
+                "request_summary": interpreted_request,
+                "schema_info": table_explorer_info,
+                "data_result": data_retrieval_result,
+                "insights": analysis_results,
+            },
+            queries=queries,
+        )
+
+        # artifactには保存済みファイルへの参照のみを保存する
+        try:
+            await tool_context.save_artifact(
+                report_filename, report_reference_part(report_path)
+            )
+        except ValueError:
+            # artifactサービスが未設定の場合もレポートファイルは保存済み
+            logger.warning("Artifact service unavailable; %s not registered", report_filename)
+
+        # 類似リクエストの再利用のため、生成したレポートを親セッションに伝える
+        tool_context.state["last_report"] = {
+            "filename": report_filename,
+            "report_title": report_title,
+        }
 
         return {
             "success": True,
             "message": (
                 f"HTMLレポートが http://localhost:9000/reports/"
-                f"{filename.split('/')[-1]} で表示可能です。"
+                f"{report_filename} で表示可能です。"
             ),
             "filename": filename,
             "report_title": report_title,
@@ -257,16 +195,20 @@ html_report_agent = Agent(
     instruction=(
         "あなたはデータ分析の結果をHTMLレポートとしてまとめる専門家です。create_html_reportを必ず実行してください。\n"
         "**実行順序:**\n"
-        "**1. これまでの分析結果を集約するためのworkflow_data辞書を作成してください。**\n"
+        "**1. load_artifacts で各ステージの出力全体を読み込んでください。**\n"
+        "stateの table_explorer_info・data_retrieval_result・analysis_results は切り詰めた抜粋のため、\n"
+        "table_explorer_output.txt・data_retrieval_output.txt・data_analyzer_output.txt の内容を使用してください。\n"
+        "**2. これまでの分析結果を集約するためのworkflow_data辞書を作成してください。**\n"
         "{\n"
         "    'interpreted_request': 'ユーザーのリクエストをここに記述',\n"
         "    'table_explorer_info': 'table_explorer_info',\n"
         "    'data_retrieval_result': 'data_retrieval_result',\n"
         "    'analysis_results': 'analysis_results'\n"
         "}\n\n"
-        "**2. create_html_report(workflow_data, report_title)を実行して、HTMLレポートを作成**\n"
-        "**3. 'artifact.message'に含まれるURLをユーザーに報告**\n\n"
+        "**3. create_html_report(workflow_data, report_title)を実行して、HTMLレポートを作成**\n"
+        "**4. 'artifact.message'に含まれるURLをユーザーに報告**\n\n"
         "データが不足している場合は空文字列や空辞書を使用してもツールを必ず実行してください。"
     ),
+    before_model_callback=before_model_rate_limit,
     output_key="html_report_info",
 )
@@ -1,6 +1,7 @@
 from google.adk.agents import Agent, BaseAgent, LlmAgent, LoopAgent, SequentialAgent
 
 from ..tools.mcptoolset import postgres_toolset
+from ..utils.rate_limit import before_model_rate_limit
 
 table_explorer = LlmAgent(
     name="table_explorer",
@@ -45,5 +46,6 @@ table_explorer = LlmAgent(
         "value4  | value5  | value6\n"
         "...\n\n"
     ),
+    before_model_callback=before_model_rate_limit,
     output_key="table_explorer_info",
 )
@@ -0,0 +1,254 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+REPORTS_DIR = Path(os.environ.get("REPORTS_DIR", "/workspace/reports"))
+INDEX_PATH = Path(
+    os.environ.get("ANALYSIS_INDEX_PATH", REPORTS_DIR / ".analysis_index.jsonl")
+)
+
+# 類似度のしきい値（0〜1）
+REPORT_REUSE_THRESHOLD = float(os.environ.get("REPORT_REUSE_THRESHOLD", "0.85"))
+SQL_REUSE_THRESHOLD = float(os.environ.get("SQL_REUSE_THRESHOLD", "0.7"))
+# 既存レポートを再利用できる鮮度（時間）
+REPORT_MAX_AGE_HOURS = float(os.environ.get("REPORT_MAX_AGE_HOURS", "24"))
+
+NGRAM_SIZES = (1, 2, 3)
+
+_NOISE_RE = re.compile(r"[\s\W_]+", re.UNICODE)
+
+# 数値・日付（期間や順位、件数など単位付きの数値を含む）
+_NUMERIC_TOKEN_RE = re.compile(
+    r"\d+(?:\.\d+)?\s*(?:年度|年|ヶ月|か月|カ月|月|週間|週|日|時|四半期|%|位|件|人|円|歳|代)?"
+)
+# 相対的な期間の表現
+PERIOD_TERMS = (
+    "今日", "昨日", "今週", "先週", "今月", "先月", "前月", "今年", "昨年", "去年", "前年",
+    "今期", "前期", "上期", "下期", "直近", "年間", "月次", "週次", "日次", "年次",
+)
+# 分析対象の指標（n-gramの類似度では差が小さくなるため完全一致を要求する）
+MEASURE_TERMS = (
+    "売上", "販売", "在庫", "利益", "粗利", "単価", "数量", "点数", "件数", "客数",
+    "来店", "購入", "返品", "割引", "ポイント", "会員", "顧客", "商品", "カテゴリ", "店舗",
+)
+# 並び順・増減の向き（「上位10商品」と「下位10商品」は1文字違いでも結果が逆になる）
+DIRECTION_TERMS = (
+    "上位", "下位", "トップ", "ワースト", "最大", "最小", "最高", "最低", "高い", "低い",
+    "多い", "少ない", "増加", "減少", "昇順", "降順",
+)
+
+
+def _normalize(text: str) -> str:
+    """全角・半角や大文字小文字、空白・記号の違いを吸収する"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return _NOISE_RE.sub("", text)
+
+
+def char_ngrams(text: str) -> Counter:
+    """文字n-gramの出現回数を数える"""
+    normalized = _normalize(text)
+    grams: Counter = Counter()
+    for n in NGRAM_SIZES:
+        if len(normalized) < n:
+            continue
+        grams.update(normalized[i : i + n] for i in range(len(normalized) - n + 1))
+    if not grams and normalized:
+        grams[normalized] = 1
+    return grams
+
+
+def question_constraints(text: str) -> Dict[str, frozenset]:
+    """
+    再利用の前に完全一致を要求する要素（数値・日付、期間、指標、並び順の向き）を抽出する
+
+    「2024年1月の売上」と「2024年3月の売上」、「売上推移」と「在庫推移」、
+    「売上上位10商品」と「売上下位10商品」のように
+    文字n-gramの類似度は高くても結果が異なるリクエストを区別する。
+    """
+    normalized = unicodedata.normalize("NFKC", text).lower()
+    return {
+        "numbers": frozenset(
+            re.sub(r"\s+", "", m.group(0)) for m in _NUMERIC_TOKEN_RE.finditer(normalized)
+        ),
+        "periods": frozenset(term for term in PERIOD_TERMS if term in normalized),
+        "measures": frozenset(term for term in MEASURE_TERMS if term in normalized),
+        "directions": frozenset(term for term in DIRECTION_TERMS if term in normalized),
+    }
+
+
+class AnalysisIndex:
+    """
+    過去の分析リクエストのローカル類似検索インデックス
+
+    リクエスト文の文字n-gramをTF-IDFでベクトル化し、コサイン類似度で検索する。
+    エントリはJSON Lines形式で追記保存し、外部サービスには依存しない。
+    """
+
+    def __init__(self, path: Path = INDEX_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._entries: List[Dict[str, Any]] = []
+        self._grams: List[Counter] = []
+        self._idf: Dict[str, float] = {}
+        self._vectors: List[Dict[str, float]] = []
+        self._loaded_mtime: Optional[float] = None
+
+    def _reload_if_changed(self) -> None:
+        # 他プロセスが追記した場合も検知できるようにmtimeで判定する
+        try:
+            mtime = self.path.stat().st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._loaded_mtime:
+            return
+
+        entries = []
+        if mtime is not None:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        logger.warning("Skipping corrupt analysis index line")
+        self._entries = entries
+        self._grams = [char_ngrams(e.get("question", "")) for e in entries]
+        self._rebuild_vectors()
+        self._loaded_mtime = mtime
+
+    def _rebuild_vectors(self) -> None:
+        document_count = len(self._grams)
+        df: Counter = Counter()
+        for grams in self._grams:
+            df.update(grams.keys())
+        self._idf = {
+            gram: math.log((1 + document_count) / (1 + count)) + 1.0
+            for gram, count in df.items()
+        }
+        self._vectors = [self._vectorize(grams) for grams in self._grams]
+
+    def _vectorize(self, grams: Counter) -> Dict[str, float]:
+        # 未知のn-gramには最大のidfを与える
+        default_idf = math.log(1 + len(self._grams)) + 1.0
+        vector = {
+            gram: count * self._idf.get(gram, default_idf)
+            for gram, count in grams.items()
+        }
+        norm = math.sqrt(sum(v * v for v in vector.values()))
+        if norm:
+            vector = {gram: v / norm for gram, v in vector.items()}
+        return vector
+
+    def add(
+        self,
+        question: str,
+        sql: Optional[List[str]] = None,
+        tables: Optional[List[str]] = None,
+        report_filename: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        分析結果をインデックスに追加する
+
+        Args:
+            question: ユーザーの分析リクエスト
+            sql: 実行したSQLクエリ
+            tables: 使用したテーブル
+            report_filename: 生成したレポートのファイル名
+
+        Returns:
+            追加したエントリ
+        """
+        entry = {
+            "question": question,
+            "sql": list(sql or []),
+            "tables": list(tables or []),
+            "report_filename": report_filename,
+            "created_at": datetime.now().isoformat(),
+        }
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._loaded_mtime = None
+        return entry
+
+    def search(self, question: str, top_k: int = 3) -> List[Dict[str, Any]]:
+        """
+        類似した過去の分析を検索する
+
+        Args:
+            question: 新しい分析リクエスト
+            top_k: 返す件数
+
+        Returns:
+            類似度（score）の高い順に並んだエントリのリスト
+        """
+        with self._lock:
+            self._reload_if_changed()
+            if not self._entries:
+                return []
+            query = self._vectorize(char_ngrams(question))
+            scored = []
+            for entry, vector in zip(self._entries, self._vectors):
+                score = sum(w * vector.get(gram, 0.0) for gram, w in query.items())
+                scored.append((score, entry))
+
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [dict(entry, score=round(score, 4)) for score, entry in scored[:top_k]]
+
+
+def is_report_fresh(entry: Dict[str, Any], reports_dir: Path = REPORTS_DIR) -> bool:
+    """レポートファイルが存在し、再利用できる鮮度かを判定する"""
+    filename = entry.get("report_filename")
+    if not filename or not (reports_dir / filename).exists():
+        return False
+    try:
+        created_at = datetime.fromisoformat(entry["created_at"])
+    except (KeyError, ValueError):
+        return False
+    return datetime.now() - created_at <= timedelta(hours=REPORT_MAX_AGE_HOURS)
+
+
+def find_reusable_analysis(
+    question: str, index: Optional["AnalysisIndex"] = None
+) -> Dict[str, Any]:
+    """
+    新しいリクエストに対して再利用できる過去の分析を判定する
+
+    類似度がしきい値以上で、かつ数値・日付・期間・指標がすべて一致する候補のみを再利用する。
+
+    Returns:
+        action が "reuse_report"（既存レポートをそのまま提示）、
+        "reuse_sql"（SQLを再利用してデータ取得から実行）、
+        "none"（通常どおり探索から実行）のいずれかの辞書
+    """
+    index = index or analysis_index
+    constraints = question_constraints(question)
+    # 数値・日付・期間・指標が一致しない候補は類似度にかかわらず再利用しない
+    candidates = [
+        candidate
+        for candidate in index.search(question, top_k=5)
+        if question_constraints(candidate.get("question", "")) == constraints
+    ]
+    for candidate in candidates:
+        if candidate["score"] >= REPORT_REUSE_THRESHOLD and is_report_fresh(candidate):
+            return {"action": "reuse_report", "match": candidate}
+    for candidate in candidates:
+        if candidate["score"] >= SQL_REUSE_THRESHOLD and candidate.get("sql"):
+            return {"action": "reuse_sql", "match": candidate}
+    return {"action": "none", "match": candidates[0] if candidates else None}
+
+
+analysis_index = AnalysisIndex()
@@ -0,0 +1,280 @@
+import logging
+import os
+import re
+import statistics
+from typing import Any, Dict, List, Optional, Tuple
+
+from .query_router import _IDENT, _STRING_RE, _NotRoutable, _split_clauses
+
+logger = logging.getLogger(__name__)
+
+# サンプルの取得元
+#   sample: scripts/samples.sql で保持しているサンプルテーブル（既定）
+#   tablesample: 元テーブルに対する TABLESAMPLE BERNOULLI
+APPROXIMATE_SAMPLE_SOURCE = os.environ.get("APPROXIMATE_SAMPLE_SOURCE", "sample").lower()
+APPROXIMATE_TABLESAMPLE_PERCENT = float(os.environ.get("APPROXIMATE_TABLESAMPLE_PERCENT", "1"))
+APPROXIMATE_CONFIDENCE = float(os.environ.get("APPROXIMATE_CONFIDENCE", "0.95"))
+
+# call_data_retrieval_agent が近似モードを有効にする state のキー
+APPROXIMATE_MODE_KEY = "approximate_query"
+# 近似クエリが実行された（結果が近似値を含む）ことを示す state のキー
+APPROXIMATE_USED_KEY = "data_retrieval_approximate"
+
+# サンプリング対象のファクトテーブル（優先順）と近似クエリの集計対象のビュー
+SAMPLED_TABLES: Dict[str, str] = {
+    "transaction_items": "sampled_transaction_items",
+    "transactions": "sampled_transactions",
+}
+
+# 外部結合はサンプルにない行を NULL で補い、抽出率で補正できないため正確なクエリのまま実行する
+_UNSUPPORTED_RE = re.compile(
+    r"\b(with|union|intersect|except|distinct|over|filter|within|lateral|tablesample"
+    r"|left|right|full|cross|natural)\b"
+    r"|\(\s*select\b|--|/\*",
+    re.IGNORECASE,
+)
+_AGGREGATE_START_RE = re.compile(r"\b(sum|count|avg)\s*\(", re.IGNORECASE)
+# 抽出率で補正できない集計関数（含まれる場合は正確なクエリのまま実行する）
+_OTHER_AGGREGATE_RE = re.compile(
+    r"\b(min|max|\w+_agg|stddev\w*|var\w*|percentile_\w+|mode|every|bool_\w+)\s*\(",
+    re.IGNORECASE,
+)
+_TABLE_REF_RE = re.compile(
+    rf"(?P<lead>^|,|\bjoin)(?P<space>\s*)(?P<table>{_IDENT})\b"
+    rf"(?P<alias>\s+(?:as\s+)?(?!(?:on|join|inner|left|right|full|cross|natural|where)\b){_IDENT})?",
+    re.IGNORECASE,
+)
+
+
+def _z_score(confidence: float) -> float:
+    return round(statistics.NormalDist().inv_cdf(0.5 + confidence / 2), 4)
+
+
+def _split_top_level(text: str) -> List[str]:
+    """括弧の外のカンマで分割する"""
+    items, depth, start = [], 0, 0
+    for i, char in enumerate(text):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            items.append(text[start:i])
+            start = i + 1
+    items.append(text[start:])
+    return items
+
+
+def _find_aggregates(text: str) -> List[Tuple[int, int, str, str]]:
+    """SUM/COUNT/AVG の呼び出しを (開始, 終了, 関数名, 引数) のリストで返す"""
+    aggregates = []
+    for match in _AGGREGATE_START_RE.finditer(text):
+        depth = 1
+        for end in range(match.end(), len(text)):
+            if text[end] == "(":
+                depth += 1
+            elif text[end] == ")":
+                depth -= 1
+                if depth == 0:
+                    break
+        else:
+            raise _NotRoutable("unbalanced parentheses")
+        argument = text[match.end():end].strip()
+        if _AGGREGATE_START_RE.search(argument):
+            raise _NotRoutable("nested aggregate")
+        aggregates.append((match.start(), end + 1, match.group(1).lower(), argument))
+    return aggregates
+
+
+def _included(argument: str, w: str) -> str:
+    """COUNT/AVG の対象行（引数が NULL でない行）の重み"""
+    if argument == "*":
+        return w
+    return f"CASE WHEN ({argument}) IS NOT NULL THEN {w} END"
+
+
+def _estimate(function: str, argument: str, w: str) -> str:
+    """サンプル上の集計を、行ごとの重み w（抽出確率の逆数）で母集団の推定値に補正する式"""
+    if function == "sum":
+        return f"SUM(({argument}) * {w})"
+    if function == "count":
+        return f"COALESCE(ROUND(SUM({_included(argument, w)})), 0)"
+    # 平均は重み付きの比推定（全数で数える行と抽出した行が混在するため）
+    return f"(SUM(({argument}) * {w}) / NULLIF(SUM({_included(argument, w)}), 0))"
+
+
+def _margin(function: str, argument: str, w: str, z: float) -> str:
+    """
+    推定値の誤差幅（z × 標準誤差）の式
+
+    抽出確率 π = 1 / w のポアソン抽出の Horvitz-Thompson 推定量の分散:
+      SUM:   Σ w(w - 1) x²
+      COUNT: Σ w(w - 1)
+      AVG:   Σ w(w - 1) (x - 平均)² / N²（線形化）
+    全数で数える行（w = 1）は分散に寄与しない。
+    """
+    variance_weight = f"{w} * ({w} - 1)"
+    if function == "sum":
+        return (
+            f"({z} * SQRT(COALESCE(SUM({variance_weight} * ({argument}) * ({argument})), 0)))"
+        )
+    if function == "count":
+        return f"({z} * SQRT(COALESCE(SUM({_included(argument, variance_weight)}), 0)))"
+    mean = _estimate(function, argument, w)
+    squares = f"SUM({variance_weight} * ({argument}) * ({argument}))"
+    linear = f"SUM({variance_weight} * ({argument}))"
+    count = f"SUM({_included(argument, variance_weight)})"
+    return (
+        f"({z} * SQRT(GREATEST(0, {squares} - 2 * {mean} * {linear} + {mean} * {mean} * {count}))"
+        f" / NULLIF(SUM({_included(argument, w)}), 0))"
+    )
+
+
+def _scale_aggregates(text: str, w: str) -> Tuple[str, int]:
+    """句の中の SUM/COUNT/AVG を推定値に置き換える"""
+    aggregates = _find_aggregates(text)
+    for start, end, function, argument in reversed(aggregates):
+        text = text[:start] + _estimate(function, argument, w) + text[end:]
+    return text, len(aggregates)
+
+
+def _rewrite_from(from_clause: str) -> Tuple[str, str, str]:
+    """FROM句のファクトテーブルをサンプルに置き換え、(FROM句, 対象テーブル, 行の重みの式) を返す"""
+    references = [m for m in _TABLE_REF_RE.finditer(from_clause)]
+    tables = [m.group("table").lower() for m in references]
+    target = next((table for table in SAMPLED_TABLES if table in tables), None)
+    if target is None:
+        raise _NotRoutable("no sampled fact table")
+    if tables.count(target) != 1:
+        raise _NotRoutable("fact table referenced more than once")
+    match = next(m for m in references if m.group("table").lower() == target)
+    alias = (match.group("alias") or "").strip() or target
+    alias = re.sub(r"^as\s+", "", alias, flags=re.IGNORECASE)
+
+    if APPROXIMATE_SAMPLE_SOURCE == "tablesample":
+        percent = APPROXIMATE_TABLESAMPLE_PERCENT
+        source = f"{target} AS {alias} TABLESAMPLE BERNOULLI ({percent}) REPEATABLE (42)"
+        w = repr(100 / percent)
+    else:
+        # サンプル取り込み後に追加された行も含むビュー（重みはDB側の抽出率から計算される）
+        source = f"{SAMPLED_TABLES[target]} AS {alias}"
+        w = f"{alias}.sample_weight"
+
+    rewritten = (
+        from_clause[: match.start()]
+        + f"{match.group('lead')}{match.group('space')}{source}"
+        + from_clause[match.end():]
+    )
+    return rewritten, target, w
+
+
+def approximate_query(sql: str, confidence: float = APPROXIMATE_CONFIDENCE) -> Optional[str]:
+    """
+    集計クエリをファクトテーブルのサンプル上で実行する近似クエリに書き換える
+
+    SUM/COUNT/AVG は抽出率で補正した推定値に置き換え、SELECT句の集計列ごとに
+    信頼区間の列（<列名>_ci_low / <列名>_ci_high）と、グループごとの
+    集計行数（sample_rows）を末尾に追加する。サンプルの更新後に追加された行は
+    元テーブルから全数で集計するため、サンプルが古くても推定は偏らない。
+    抽出率で補正できない集計（MIN/MAX、DISTINCT など）を含む場合は None を返す。
+
+    Args:
+        sql: data_retrieval_agent が生成したSQL
+        confidence: 信頼区間の信頼水準
+
+    Returns:
+        書き換えたSQL、または近似できない場合は None
+    """
+    try:
+        return _approximate(sql, confidence)
+    except _NotRoutable as e:
+        logger.debug("Query not approximated: %s", e)
+        return None
+
+
+def _approximate(sql: str, confidence: float) -> str:
+    sql = sql.strip().rstrip(";").strip()
+    strings: List[str] = []
+
+    def mask(m: re.Match) -> str:
+        strings.append(m.group(0))
+        return f"\x00{len(strings) - 1}\x00"
+
+    masked = _STRING_RE.sub(mask, sql)
+    if ";" in masked or '"' in masked or _UNSUPPORTED_RE.search(masked):
+        raise _NotRoutable("unsupported syntax")
+    if _OTHER_AGGREGATE_RE.search(masked):
+        raise _NotRoutable("aggregate cannot be scaled")
+
+    clauses = _split_clauses(masked)
+    if "from" not in clauses:
+        raise _NotRoutable("missing FROM")
+    from_clause, target, w = _rewrite_from(clauses["from"])
+    z = _z_score(confidence)
+
+    # SELECT句: 集計のみの列には信頼区間の列を追加する
+    items = []
+    bounds = []
+    aggregates = 0
+    for item in _split_top_level(clauses["select"]):
+        item = item.strip()
+        found = _find_aggregates(item)
+        aggregates += len(found)
+        if len(found) == 1 and found[0][0] == 0:
+            start, end, function, argument = found[0]
+            alias_match = re.fullmatch(rf"\s*(?:as\s+)?({_IDENT})", item[end:], re.IGNORECASE)
+            if alias_match or not item[end:].strip():
+                name = alias_match.group(1) if alias_match else function
+                estimate = _estimate(function, argument, w)
+                margin = _margin(function, argument, w, z)
+                low = f"{estimate} - {margin}"
+                if function == "count":
+                    low = f"GREATEST(0, {low})"
+                items.append(f"{estimate} AS {name}")
+                bounds.append(f"{low} AS {name}_ci_low")
+                bounds.append(f"{estimate} + {margin} AS {name}_ci_high")
+                continue
+        items.append(_scale_aggregates(item, w)[0])
+    if aggregates == 0:
+        raise _NotRoutable("not an aggregate query")
+    items.extend(bounds)
+    items.append("COUNT(*) AS sample_rows")
+
+    parts = [f"SELECT {', '.join(items)}", f"FROM {from_clause}"]
+    for keyword in ("where", "group by", "having", "order by", "limit", "offset"):
+        if keyword in clauses:
+            text = clauses[keyword]
+            if keyword in ("having", "order by"):
+                text = _scale_aggregates(text, w)[0]
+            parts.append(f"{keyword.upper()} {text}")
+
+    approximated = "\n".join(parts)
+    return re.sub(r"\x00(\d+)\x00", lambda m: strings[int(m.group(1))], approximated)
+
+
+def approximate_query_callback(tool, args: Dict[str, Any], tool_context) -> None:
+    """
+    before_tool_callback として、近似モードの間だけ execute-query をサンプル上で実行する
+
+    近似モードは call_data_retrieval_agent の approximate 引数で有効になる。
+    ロールアップに振り替え済みのクエリ（正確かつ高速）はそのまま実行する。
+    """
+    if getattr(tool, "name", None) != "execute-query":
+        return None
+    if not tool_context.state.get(APPROXIMATE_MODE_KEY):
+        return None
+    query = args.get("query")
+    if not isinstance(query, str):
+        return None
+    approximated = approximate_query(query)
+    if approximated is None:
+        return None
+    args["query"] = approximated
+    history = list(tool_context.state.get("approximate_queries") or [])
+    history.append(
+        {"original": query, "approximate": approximated, "confidence": APPROXIMATE_CONFIDENCE}
+    )
+    tool_context.state["approximate_queries"] = history[-10:]
+    tool_context.state[APPROXIMATE_USED_KEY] = True
+    logger.info("Running exploratory query on sample")
+    return None
@@ -0,0 +1,321 @@
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+import google.genai.types as types
+from google.adk.tools import ToolContext
+
+logger = logging.getLogger(__name__)
+
+# ステージごとのstateに残すサマリーのトークン上限
+# 環境変数 CONTEXT_BUDGET_<STAGE>（例: CONTEXT_BUDGET_DATA_RETRIEVAL=1200）で上書きできる
+DEFAULT_STAGE_TOKEN_BUDGETS: Dict[str, int] = {
+    "table_explorer": 400,
+    "data_retrieval": 800,
+    "data_analyzer": 800,
+    "html_report": 200,
+}
+
+# サブエージェントの output_key としてstateに書き込まれるキー
+STAGE_OUTPUT_KEYS: Dict[str, str] = {
+    "table_explorer": "table_explorer_info",
+    "data_retrieval": "data_retrieval_result",
+    "data_analyzer": "analysis_results",
+    "html_report": "html_report_info",
+}
+
+METRICS_STATE_KEY = "context_compaction_metrics"
+
+_SQL_BLOCK_RE = re.compile(r"```sql\s*(.*?)```", re.IGNORECASE | re.DOTALL)
+_SQL_START_RE = re.compile(r"\b(?:WITH|SELECT)\b", re.IGNORECASE)
+# SQLの終わり: 文末・コードやJSON文字列の区切り・空行・次のマークダウン要素
+_SQL_END_RE = re.compile(
+    r";|`|\"|\\n|\n\s*\n|\n\s*(?:\*\*|#|[-*•]\s|\d+\.\s)|\n[^\x00-\x7f]"
+)
+_SQL_FROM_RE = re.compile(r"\bFROM\b", re.IGNORECASE)
+_SQL_KEYS = ("sql", "query", "queries")
+_TABLE_RE = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_][\w.]*)", re.IGNORECASE)
+_BACKTICK_IDENT_RE = re.compile(r"`([a-z_][a-z0-9_]*)`")
+_NUMBER_RE = re.compile(r"\d[\d,]*(?:\.\d+)?\s*(?:%|円|件|人|個|倍)?")
+_MARKDOWN_ROW_RE = re.compile(r"^\s*\|?.+\|.+$")
+_MARKDOWN_SEPARATOR_RE = re.compile(r"^\s*\|?\s*:?-{3,}")
+
+# 累積メトリクス（プロセス全体）
+_metrics: Dict[str, Dict[str, int]] = {}
+
+
+def stage_token_budget(stage: str) -> int:
+    """ステージのトークン予算を取得する"""
+    env_value = os.environ.get(f"CONTEXT_BUDGET_{stage.upper()}")
+    if env_value:
+        try:
+            return max(int(env_value), 0)
+        except ValueError:
+            logger.warning("Invalid CONTEXT_BUDGET_%s: %s", stage.upper(), env_value)
+    return DEFAULT_STAGE_TOKEN_BUDGETS.get(stage, 500)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    トークン数を概算する
+
+    ASCII文字は約4文字で1トークン、日本語などの非ASCII文字は1文字1トークンとして数える。
+    """
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def _to_text(output: Any) -> str:
+    if isinstance(output, str):
+        return output
+    return json.dumps(output, ensure_ascii=False, default=str)
+
+
+def _truncate_to_tokens(text: str, budget: int) -> str:
+    if budget <= 0:
+        return ""
+    if estimate_tokens(text) <= budget:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) + 1 <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + "…"
+
+
+def _sql_values(output: Any) -> List[str]:
+    """辞書形式の出力から sql / query フィールドの値を取り出す"""
+    queries: List[str] = []
+    if isinstance(output, dict):
+        for key, value in output.items():
+            if key.lower() in _SQL_KEYS and isinstance(value, str):
+                queries.append(value)
+            elif key.lower() in _SQL_KEYS and isinstance(value, list):
+                queries.extend(v for v in value if isinstance(v, str))
+            else:
+                queries.extend(_sql_values(value))
+    elif isinstance(output, list):
+        for value in output:
+            queries.extend(_sql_values(value))
+    return queries
+
+
+def extract_sql(text: str, output: Any = None) -> List[str]:
+    """
+    出力からSQLクエリを抽出する（実行したSQLが記録されていない場合の補助）
+
+    辞書形式の出力は sql / query フィールド、テキストは ```sql ブロックを優先し、
+    どちらもない場合は SELECT / WITH から文の終わりまでを取り出す。
+    """
+    queries = [q.strip() for q in _sql_values(output) if _SQL_FROM_RE.search(q)]
+    if not queries:
+        queries = [q.strip() for q in _SQL_BLOCK_RE.findall(text) if q.strip()]
+    if not queries:
+        position = 0
+        while True:
+            start = _SQL_START_RE.search(text, position)
+            if start is None:
+                break
+            end = _SQL_END_RE.search(text, start.end())
+            stop = end.start() if end else len(text)
+            candidate = text[start.start() : stop].strip()
+            if _SQL_FROM_RE.search(candidate):
+                queries.append(candidate)
+            position = max(stop, start.end())
+    # 重複を除いて順序を維持
+    return list(dict.fromkeys(q.rstrip(";").strip() for q in queries))
+
+
+def extract_tables(text: str, sql: Optional[List[str]] = None) -> List[str]:
+    """SQLやテキスト中のテーブル名を抽出する"""
+    tables: List[str] = []
+    for query in sql or extract_sql(text):
+        tables.extend(t.lower() for t in _TABLE_RE.findall(query))
+    tables.extend(_BACKTICK_IDENT_RE.findall(text))
+    return list(dict.fromkeys(tables))
+
+
+def extract_result_shape(output: Any, text: str) -> Dict[str, Any]:
+    """結果の形状（行数・列）を推定する"""
+    if isinstance(output, dict):
+        for key in ("sql_results", "data", "rows"):
+            rows = output.get(key)
+            if isinstance(rows, list):
+                columns = list(rows[0].keys()) if rows and isinstance(rows[0], dict) else []
+                return {"rows": len(rows), "columns": columns}
+
+    lines = text.splitlines()
+    for i, line in enumerate(lines[:-1]):
+        if _MARKDOWN_ROW_RE.match(line) and _MARKDOWN_SEPARATOR_RE.match(lines[i + 1]):
+            columns = [c.strip() for c in line.strip().strip("|").split("|")]
+            rows = 0
+            for row in lines[i + 2 :]:
+                if not _MARKDOWN_ROW_RE.match(row):
+                    break
+                rows += 1
+            return {"rows": rows, "columns": columns}
+    return {}
+
+
+def extract_key_figures(text: str, limit: int = 10) -> List[str]:
+    """数値を含む行を重要な数値として抽出する"""
+    figures = []
+    in_code_block = False
+    for line in text.splitlines():
+        if line.strip().startswith("```"):
+            in_code_block = not in_code_block
+            continue
+        line = line.strip(" \t-*•#|")
+        if (
+            in_code_block
+            or not line
+            or len(line) > 200
+            or _MARKDOWN_SEPARATOR_RE.match(line)
+        ):
+            continue
+        if _NUMBER_RE.search(line):
+            figures.append(line)
+        if len(figures) >= limit:
+            break
+    return figures
+
+
+def summarize_output(
+    stage: str, output: Any, budget: int, sql: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """
+    サブエージェントの出力から予算内の構造化サマリーを作成する
+
+    SQLは再利用・レポート更新でそのまま実行されるため、予算を超える場合も切り詰めない。
+
+    Args:
+        stage: パイプラインのステージ名
+        output: サブエージェントの出力
+        budget: サマリーのトークン上限
+        sql: 実際に実行したSQL（省略時は出力から抽出する）
+
+    Returns:
+        テーブル・SQL・結果形状・主要数値・抜粋を含む辞書
+    """
+    text = _to_text(output)
+    sql = list(sql) if sql is not None else extract_sql(text, output)
+    summary: Dict[str, Any] = {
+        "stage": stage,
+        "tables": extract_tables(text, sql),
+        "sql": sql,
+        "result_shape": extract_result_shape(output, text),
+        "key_figures": extract_key_figures(text),
+        "excerpt": "",
+    }
+
+    def size(s: Dict[str, Any]) -> int:
+        return estimate_tokens(json.dumps(s, ensure_ascii=False))
+
+    # 予算を超える場合は優先度の低い項目から削る
+    while size(summary) > budget and len(summary["key_figures"]) > 0:
+        summary["key_figures"].pop()
+    while size(summary) > budget and len(summary["tables"]) > 0:
+        summary["tables"].pop()
+
+    # 残りの予算を先頭部分の抜粋に使う（JSONエスケープ分は超過量だけ縮める）
+    summary["excerpt"] = _truncate_to_tokens(text, budget - size(summary))
+    while summary["excerpt"] and size(summary) > budget:
+        summary["excerpt"] = _truncate_to_tokens(
+            summary["excerpt"],
+            estimate_tokens(summary["excerpt"]) - (size(summary) - budget),
+        )
+    return summary
+
+
+def _accumulate(
+    store: Dict[str, Dict[str, int]], stage: str, delta: Dict[str, int]
+) -> None:
+    totals = dict(store.get(stage, {}))
+    for key, value in delta.items():
+        totals[key] = totals.get(key, 0) + value
+    totals["calls"] = totals.get("calls", 0) + 1
+    store[stage] = totals
+
+
+def _record_metrics(
+    tool_context: ToolContext, stage: str, original: str, compacted: str
+) -> Dict[str, int]:
+    delta = {
+        "bytes_original": len(original.encode("utf-8")),
+        "bytes_compacted": len(compacted.encode("utf-8")),
+        "tokens_original": estimate_tokens(original),
+        "tokens_compacted": estimate_tokens(compacted),
+    }
+    delta["bytes_saved"] = delta["bytes_original"] - delta["bytes_compacted"]
+    delta["tokens_saved"] = delta["tokens_original"] - delta["tokens_compacted"]
+
+    _accumulate(_metrics, stage, delta)
+    session_metrics = dict(tool_context.state.get(METRICS_STATE_KEY) or {})
+    _accumulate(session_metrics, stage, delta)
+    tool_context.state[METRICS_STATE_KEY] = session_metrics
+
+    logger.info(
+        "Compacted %s output: %d -> %d bytes, %d -> %d tokens",
+        stage,
+        delta["bytes_original"],
+        delta["bytes_compacted"],
+        delta["tokens_original"],
+        delta["tokens_compacted"],
+    )
+    return delta
+
+
+def get_compaction_metrics() -> Dict[str, Dict[str, int]]:
+    """プロセス全体の累積メトリクスを取得する"""
+    return {stage: dict(values) for stage, values in _metrics.items()}
+
+
+async def compact_stage_output(
+    stage: str, output: Any, tool_context: ToolContext, sql: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """
+    ステージの出力全体をartifactに退避し、stateには予算内のサマリーのみを残す
+
+    Args:
+        stage: パイプラインのステージ名（例: "data_retrieval"）
+        output: サブエージェントの出力
+        tool_context: ADKのToolContext
+        sql: 実際に実行したSQL（省略時は出力から抽出する）
+
+    Returns:
+        stateに保存したサマリー（ツールの戻り値としてもこのサマリーを返す）
+    """
+    text = _to_text(output)
+    artifact_name = f"{stage}_output.txt"
+    reference_tokens = estimate_tokens(
+        json.dumps({"artifact": {"filename": artifact_name, "version": 0}})
+    )
+    summary = summarize_output(
+        stage, output, stage_token_budget(stage) - reference_tokens, sql=sql
+    )
+
+    # 出力全体はartifactとして保存し、必要なときに load_artifacts で参照する
+    try:
+        version = await tool_context.save_artifact(
+            artifact_name, types.Part.from_text(text=text)
+        )
+        summary["artifact"] = {"filename": artifact_name, "version": version}
+    except ValueError:
+        # artifactサービスが未設定の場合はサマリーのみ保持する
+        logger.warning("Artifact service unavailable; %s output not stored", stage)
+        summary["artifact"] = None
+
+    tool_context.state[f"{stage}_output"] = summary
+    output_key = STAGE_OUTPUT_KEYS.get(stage)
+    if output_key and output_key in tool_context.state:
+        tool_context.state[output_key] = summary
+
+    _record_metrics(
+        tool_context, stage, text, json.dumps(summary, ensure_ascii=False)
+    )
+    return summary
@@ -4,6 +4,8 @@ import os
 from google import genai
 from google.genai import types
 
+from .rate_limit import acquire_gemini_blocking
+
 
 def gemini(contents, model, max_output_tokens):
     """
@@ -12,6 +14,7 @@ def gemini(contents, model, max_output_tokens):
     client = genai.Client(api_key=os.environ.get("GOOGLE_API_KEY"))
     for i in range(5):
         try:
+            acquire_gemini_blocking()
             response = client.models.generate_content(
                 model=model,
                 contents=contents,
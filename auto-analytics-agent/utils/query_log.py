@@ -0,0 +1,186 @@
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import google.genai.types as types
+
+logger = logging.getLogger(__name__)
+
+# data_retrieval_agent が execute-query で実行したクエリを記録する state のキー
+EXECUTED_QUERIES_KEY = "executed_queries"
+
+# 記録する結果の最大行数（超える場合は行を保存せず、レポート更新時に再取得する）
+MAX_RECORDED_ROWS = 10000
+
+# 結果の行はstateに置かず（サブエージェントのセッションへコピーされるため）artifactに保存する
+RESULT_ARTIFACT_PREFIX = "query_result_"
+
+
+def record_query_callback(tool, args: Dict[str, Any], tool_context) -> None:
+    """
+    before_tool_callback として、LLMが生成したSQLをロールアップや近似への書き換え前に記録する
+
+    before_tool_callback のリストの先頭に置く。
+    """
+    if getattr(tool, "name", None) != "execute-query":
+        return None
+    query = args.get("query")
+    if not isinstance(query, str):
+        return None
+    queries = list(tool_context.state.get(EXECUTED_QUERIES_KEY) or [])
+    queries.append(
+        {"id": tool_context.function_call_id, "sql": query.strip(), "status": "pending"}
+    )
+    tool_context.state[EXECUTED_QUERIES_KEY] = queries
+    return None
+
+
+async def record_result_callback(
+    tool, args: Dict[str, Any], tool_context, tool_response: Any
+) -> None:
+    """
+    after_tool_callback として、実行結果（成否・列・行）を記録する
+
+    列と行はartifactに保存し、stateにはartifactへの参照と行数のみを残す。
+    """
+    if getattr(tool, "name", None) != "execute-query":
+        return None
+    queries = tool_context.state.get(EXECUTED_QUERIES_KEY) or []
+    index = _pending_index(queries, tool_context.function_call_id)
+    if index is None:
+        return None
+    entry = dict(queries[index])
+    # 近似モードでサンプル上に書き換えられたクエリ
+    approximated = {
+        h.get("approximate") for h in tool_context.state.get("approximate_queries") or []
+    }
+    entry["approximate"] = args.get("query") in approximated
+    parsed = _parse_result(tool_response)
+    if parsed is None:
+        entry["status"] = "error"
+    else:
+        entry["status"] = "ok"
+        columns, rows = parsed
+        if rows is not None and len(rows) <= MAX_RECORDED_ROWS:
+            entry["row_count"] = len(rows)
+            entry["result_artifact"] = await _save_result(tool_context, columns, rows)
+    # artifactの保存中に他のクエリが記録されている場合があるため読み直す
+    queries = list(tool_context.state.get(EXECUTED_QUERIES_KEY) or [])
+    index = _pending_index(queries, entry["id"])
+    if index is None:
+        return None
+    queries[index] = entry
+    tool_context.state[EXECUTED_QUERIES_KEY] = queries
+    return None
+
+
+def _pending_index(queries: List[Dict[str, Any]], call_id: Optional[str]) -> Optional[int]:
+    """結果が未記録のクエリのうち、指定した呼び出しのものの位置を返す"""
+    return next(
+        (
+            i for i in range(len(queries) - 1, -1, -1)
+            if queries[i]["id"] == call_id and queries[i]["status"] == "pending"
+        ),
+        None,
+    )
+
+
+async def _save_result(
+    tool_context, columns: List[str], rows: List[List[Any]]
+) -> Optional[Dict[str, Any]]:
+    """実行結果の列と行をJSONのartifactとして保存し、その参照を返す"""
+    filename = f"{RESULT_ARTIFACT_PREFIX}{tool_context.function_call_id}.json"
+    text = json.dumps({"columns": columns, "rows": rows}, ensure_ascii=False, default=str)
+    try:
+        version = await tool_context.save_artifact(filename, types.Part.from_text(text=text))
+    except ValueError:
+        # artifactサービスが未設定の場合は行を保存しない（レポート更新時に再取得する）
+        logger.warning("Artifact service unavailable; rows of %s not stored", filename)
+        return None
+    return {"filename": filename, "version": version}
+
+
+def _parse_result(response: Any) -> Optional[Tuple[List[str], Optional[List[List[Any]]]]]:
+    """
+    MCPの実行結果を (列, 行) に変換する
+
+    エラーの場合は None、行を解釈できない場合は行を None とする。
+    """
+    if isinstance(response, dict) and "result" in response and len(response) == 1:
+        response = response["result"]
+    if isinstance(response, dict):
+        content = response.get("content")
+        is_error = response.get("isError") or response.get("is_error")
+    else:
+        content = getattr(response, "content", None)
+        is_error = getattr(response, "isError", False)
+    if is_error:
+        return None
+    if content is None:
+        return [], None
+
+    records: List[Any] = []
+    for item in content:
+        text = item.get("text") if isinstance(item, dict) else getattr(item, "text", None)
+        if text is None:
+            return [], None
+        try:
+            value = json.loads(text)
+        except ValueError:
+            # JSONでない応答はエラーメッセージとして扱う
+            return None
+        if isinstance(value, list):
+            records.extend(value)
+        else:
+            records.append(value)
+    if not all(isinstance(record, dict) for record in records):
+        return [], None
+
+    columns: List[str] = []
+    for record in records:
+        columns.extend(key for key in record if key not in columns)
+    rows = [[record.get(column) for column in columns] for record in records]
+    return columns, rows
+
+
+def executed_queries(state, include_approximate: bool = False) -> List[Dict[str, Any]]:
+    """正常に実行されたクエリ（既定では近似クエリを除く）を実行順に返す"""
+    queries = []
+    seen = set()
+    for query in state.get(EXECUTED_QUERIES_KEY) or []:
+        if query.get("status") != "ok":
+            continue
+        if query.get("approximate") and not include_approximate:
+            continue
+        # 同じSQLを再実行した場合は最後の結果を使う
+        if query["sql"] in seen:
+            queries = [q for q in queries if q["sql"] != query["sql"]]
+        seen.add(query["sql"])
+        queries.append(query)
+    return queries
+
+
+async def load_query_results(tool_context, queries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    executed_queries の各クエリに、artifactに保存した列と行（columns / rows）を読み込んで返す
+
+    artifactを読み込めないクエリは行なしのまま返す。
+    """
+    loaded = []
+    for query in queries:
+        query = dict(query)
+        reference = query.pop("result_artifact", None)
+        if reference:
+            try:
+                part = await tool_context.load_artifact(
+                    reference["filename"], version=reference.get("version")
+                )
+            except ValueError:
+                part = None
+            if part is not None and part.text:
+                result = json.loads(part.text)
+                query["columns"], query["rows"] = result["columns"], result["rows"]
+            else:
+                logger.warning("Query result %s not found", reference["filename"])
+        loaded.append(query)
+    return loaded
@@ -0,0 +1,513 @@
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ロールアップへのルーティングを無効にする場合は ROLLUP_ROUTING=false
+ROLLUP_ROUTING_ENABLED = os.environ.get("ROLLUP_ROUTING", "true").lower() not in ("0", "false", "no")
+
+# scripts/init-db.sql のスキーマ（修飾なしのカラム名を解決するために使用）
+SCHEMA: Dict[str, set] = {
+    "members": {
+        "member_id", "member_code", "name", "name_kana", "email", "phone",
+        "postal_code", "address", "birth_date", "gender", "member_rank", "points",
+        "total_spent", "registration_date", "last_visit_date", "status",
+        "created_at", "updated_at",
+    },
+    "stores": {
+        "store_id", "store_code", "store_name", "postal_code", "address", "phone",
+        "manager_name", "opening_hours", "status", "created_at",
+    },
+    "products": {
+        "product_id", "product_code", "product_name", "category", "subcategory",
+        "unit_price", "cost_price", "supplier", "description", "is_taxable",
+        "tax_rate", "status", "created_at", "updated_at",
+    },
+    "transactions": {
+        "transaction_id", "transaction_code", "store_id", "member_id",
+        "transaction_date", "cashier_name", "subtotal", "tax_amount",
+        "discount_amount", "points_used", "points_earned", "total_amount",
+        "payment_method", "receipt_number", "status", "created_at",
+    },
+    "transaction_items": {
+        "item_id", "transaction_id", "product_id", "quantity", "unit_price",
+        "discount_rate", "discount_amount", "subtotal", "created_at",
+    },
+}
+
+# 元のクエリと同じ結果・型を返す式
+#   COUNT: 0件でも0を返す bigint（SUM では NULL・numeric になる）
+#   INTEGER列のSUM: bigint（ロールアップの BIGINT 列の SUM は numeric になる）
+_ITEM_MEASURES = {
+    ("sum", "transaction_items.subtotal"): "SUM({r}.sales_amount)",
+    ("sum", "transaction_items.quantity"): "SUM({r}.item_quantity)::bigint",
+    ("sum", "transaction_items.discount_amount"): "SUM({r}.discount_amount)",
+    ("count", "*"): "COALESCE(SUM({r}.item_count), 0)::bigint",
+    ("count", "transaction_items.item_id"): "COALESCE(SUM({r}.item_count), 0)::bigint",
+    ("avg", "transaction_items.subtotal"): (
+        "(SUM({r}.sales_amount) / NULLIF(SUM({r}.item_count), 0))"
+    ),
+    ("avg", "transaction_items.quantity"): (
+        "(SUM({r}.item_quantity)::numeric / NULLIF(SUM({r}.item_count), 0))"
+    ),
+}
+
+_TRANSACTION_MEASURES = {
+    ("sum", "transactions.total_amount"): "SUM({r}.total_amount)",
+    ("sum", "transactions.subtotal"): "SUM({r}.subtotal_amount)",
+    ("sum", "transactions.tax_amount"): "SUM({r}.tax_amount)",
+    ("sum", "transactions.discount_amount"): "SUM({r}.discount_amount)",
+    ("sum", "transactions.points_used"): "SUM({r}.points_used)::bigint",
+    ("sum", "transactions.points_earned"): "SUM({r}.points_earned)::bigint",
+    ("count", "*"): "COALESCE(SUM({r}.transaction_count), 0)::bigint",
+    ("count", "transactions.transaction_id"): "COALESCE(SUM({r}.transaction_count), 0)::bigint",
+    ("avg", "transactions.total_amount"): (
+        "(SUM({r}.total_amount) / NULLIF(SUM({r}.transaction_count), 0))"
+    ),
+    ("avg", "transactions.subtotal"): (
+        "(SUM({r}.subtotal_amount) / NULLIF(SUM({r}.transaction_count), 0))"
+    ),
+}
+
+_TRANSACTION_DIMENSIONS = {
+    "transactions.store_id": "store_id",
+    "transactions.status": "status",
+}
+
+# ルーティング先のビュー（scripts/rollups.sql）
+# tables: 元クエリのファクト側テーブル集合と完全一致した場合のみ対象とする
+ROLLUPS: List[Dict[str, Any]] = [
+    {
+        "view": "sales_daily_store_category",
+        "tables": {"transaction_items", "transactions", "products"},
+        "joins": {
+            frozenset({"transaction_items.transaction_id", "transactions.transaction_id"}),
+            frozenset({"transaction_items.product_id", "products.product_id"}),
+        },
+        "dimensions": {**_TRANSACTION_DIMENSIONS, "products.category": "category"},
+        "measures": _ITEM_MEASURES,
+        "filters": [],
+    },
+    {
+        "view": "sales_daily_member_rank",
+        "tables": {"transactions", "members"},
+        "joins": {frozenset({"transactions.member_id", "members.member_id"})},
+        "dimensions": {**_TRANSACTION_DIMENSIONS, "members.member_rank": "member_rank"},
+        "measures": _TRANSACTION_MEASURES,
+        # 内部結合では非会員の取引が除外される（会員ランクが NULL の会員は含まれる）
+        "filters": ["{r}.is_member"],
+    },
+    {
+        "view": "sales_daily_member_rank",
+        "tables": {"transactions"},
+        "joins": set(),
+        "dimensions": dict(_TRANSACTION_DIMENSIONS),
+        "measures": _TRANSACTION_MEASURES,
+        "filters": [],
+    },
+]
+
+DATE_COLUMN = "transactions.transaction_date"
+# 店舗マスタはロールアップの store_id に結合し直して属性を参照できる
+DIMENSION_TABLE_JOIN = frozenset({"transactions.store_id", "stores.store_id"})
+
+_CLAUSE_KEYWORDS = ["select", "from", "where", "group by", "having", "order by", "limit", "offset"]
+_CLAUSE_RE = re.compile(
+    r"\b(select|from|where|group\s+by|having|order\s+by|limit|offset)\b", re.IGNORECASE
+)
+_UNSUPPORTED_RE = re.compile(
+    r"\b(with|union|intersect|except|over|distinct|filter|lateral|window|within)\b"
+    r"|\(\s*select\b|--|/\*|\bleft\b|\bright\b|\bfull\b|\bcross\b|\busing\b|\bnatural\b",
+    re.IGNORECASE,
+)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_AGGREGATE_RE = re.compile(
+    r"\b(sum|count|avg)\s*\(\s*(\*|[a-z_]\w*(?:\.[a-z_]\w*)?)\s*\)", re.IGNORECASE
+)
+_ANY_AGGREGATE_RE = re.compile(
+    r"\b(sum|count|avg|min|max|\w+_agg|stddev\w*|var\w*|percentile_\w+|mode|every|bool_\w+)\s*\(",
+    re.IGNORECASE,
+)
+_IDENT = r"[a-z_]\w*"
+_REF = rf"(?:{_IDENT}\.)?{_IDENT}"
+_JOIN_RE = re.compile(
+    rf"^\s*(?:inner\s+)?join\s+({_IDENT})(?:\s+(?:as\s+)?(?!on\b)({_IDENT}))?"
+    rf"\s+on\s+({_REF})\s*=\s*({_REF})\s*(?=(?:inner\s+)?join\b|$)",
+    re.IGNORECASE,
+)
+_BASE_TABLE_RE = re.compile(
+    rf"^\s*({_IDENT})(?:\s+(?:as\s+)?(?!(?:inner|join)\b)({_IDENT}))?", re.IGNORECASE
+)
+_SQL_WORDS = {
+    "and", "or", "not", "as", "asc", "desc", "nulls", "first", "last", "is", "null",
+    "in", "like", "ilike", "case", "when", "then", "else", "end", "true", "false",
+    "date", "interval", "numeric", "integer", "int", "bigint", "text", "varchar",
+    "decimal", "float", "real", "double", "precision", "timestamp", "cast",
+    "current_date",
+}
+_DATE_PARTS = {"year", "quarter", "month", "week", "day", "dow", "isodow", "doy", "isoyear"}
+_TRUNC_UNITS = {"day", "week", "month", "quarter", "year"}
+_TIME_FORMAT_RE = re.compile(r"HH|MI|SS|MS|US|AM|PM|A\.M\.|P\.M\.", re.IGNORECASE)
+_DATE_LITERAL_RE = re.compile(r"^'\d{4}-\d{2}-\d{2}'$")
+# 日付比較の前後が論理演算子・括弧・句の端であること
+_OPERAND_START_RE = re.compile(r"(?:^|\(|\b(?:and|or|not|when)\b)\s*$", re.IGNORECASE)
+_OPERAND_END_RE = re.compile(r"\s*(?:$|\)|\b(?:and|or|then)\b)", re.IGNORECASE)
+
+
+class _NotRoutable(Exception):
+    """ロールアップで同じ結果を返せないクエリ"""
+
+
+def _split_clauses(sql: str) -> Dict[str, str]:
+    """トップレベル（括弧の外）のキーワードでSELECT文を句に分割する"""
+    positions: List[Tuple[int, int, str]] = []
+    for match in _CLAUSE_RE.finditer(sql):
+        depth = sql.count("(", 0, match.start()) - sql.count(")", 0, match.start())
+        if depth == 0:
+            keyword = re.sub(r"\s+", " ", match.group(1).lower())
+            positions.append((match.start(), match.end(), keyword))
+
+    if not positions or positions[0][2] != "select" or sql[: positions[0][0]].strip():
+        raise _NotRoutable("not a SELECT statement")
+    order = [p[2] for p in positions]
+    if len(set(order)) != len(order) or order != sorted(order, key=_CLAUSE_KEYWORDS.index):
+        raise _NotRoutable("unexpected clause order")
+
+    clauses = {}
+    for i, (_, end, keyword) in enumerate(positions):
+        stop = positions[i + 1][0] if i + 1 < len(positions) else len(sql)
+        clauses[keyword] = sql[end:stop].strip()
+    return clauses
+
+
+def _parse_from(from_clause: str) -> Tuple[Dict[str, str], List[Tuple[str, str]], str]:
+    """FROM句を解析し、別名→テーブル名と結合条件を返す"""
+    match = _BASE_TABLE_RE.match(from_clause)
+    if not match:
+        raise _NotRoutable("unsupported FROM clause")
+    aliases = {}
+    base_table, base_alias = match.group(1).lower(), (match.group(2) or match.group(1)).lower()
+    aliases[base_alias] = base_table
+    conditions = []
+    rest = from_clause[match.end():]
+    while rest.strip():
+        join = _JOIN_RE.match(rest)
+        if not join:
+            raise _NotRoutable("unsupported join")
+        table = join.group(1).lower()
+        alias = (join.group(2) or table).lower()
+        if alias in aliases:
+            raise _NotRoutable("duplicate alias")
+        aliases[alias] = table
+        conditions.append((join.group(3).lower(), join.group(4).lower()))
+        rest = rest[join.end():]
+    if any(table not in SCHEMA for table in aliases.values()):
+        raise _NotRoutable("unknown table")
+    return aliases, conditions, base_alias
+
+
+class _Resolver:
+    """クエリ内のカラム参照を「テーブル名.カラム名」に解決する"""
+
+    def __init__(self, aliases: Dict[str, str], output_aliases: set):
+        self.aliases = aliases
+        self.output_aliases = output_aliases
+
+    def resolve(self, ref: str) -> Optional[str]:
+        ref = ref.lower()
+        if "." in ref:
+            alias, column = ref.split(".", 1)
+            table = self.aliases.get(alias)
+            if table is None or column not in SCHEMA[table]:
+                raise _NotRoutable(f"unknown column {ref}")
+            return f"{table}.{column}"
+        tables = [t for t in set(self.aliases.values()) if ref in SCHEMA[t]]
+        if len(tables) == 1:
+            return f"{tables[0]}.{ref}"
+        if len(tables) > 1:
+            raise _NotRoutable(f"ambiguous column {ref}")
+        return None
+
+
+def _rewrite(
+    text: str,
+    resolver: _Resolver,
+    rollup: Dict[str, Any],
+    r: str,
+    stores_alias: Optional[str],
+    strings: List[str],
+) -> Tuple[str, int]:
+    """句の中の集計関数・日付式・カラム参照をロールアップ側に書き換える"""
+    placeholders: List[str] = []
+
+    def hold(expression: str) -> str:
+        placeholders.append(expression)
+        return f"\x01{len(placeholders) - 1}\x01"
+
+    def literal(token: str) -> str:
+        return strings[int(token.strip("\x00"))]
+
+    # 1. 集計関数
+    aggregates = 0
+
+    def replace_aggregate(m: re.Match) -> str:
+        nonlocal aggregates
+        argument = m.group(2)
+        column = "*" if argument == "*" else resolver.resolve(argument)
+        expression = rollup["measures"].get((m.group(1).lower(), column))
+        if expression is None:
+            raise _NotRoutable(f"unsupported aggregate {m.group(0)}")
+        aggregates += 1
+        return hold(expression.format(r=r))
+
+    text = _AGGREGATE_RE.sub(replace_aggregate, text)
+    if _ANY_AGGREGATE_RE.search(text):
+        raise _NotRoutable("unsupported aggregate")
+
+    # 2. 日付の粒度が日単位以上の式
+    def is_date(ref: str) -> bool:
+        return resolver.resolve(ref) == DATE_COLUMN
+
+    def replace_date(m: re.Match, template: str) -> str:
+        if not is_date(m.group("ref")):
+            return m.group(0)
+        return hold(template.format(r=r, **m.groupdict()))
+
+    def replace_trunc(m: re.Match) -> str:
+        if not is_date(m.group("ref")):
+            return m.group(0)
+        if literal(m.group("unit")).strip("'").lower() not in _TRUNC_UNITS:
+            raise _NotRoutable("sub-day date_trunc")
+        # date型のままでは timestamptz になるため元の列と同じ timestamp に揃える
+        return hold(f"date_trunc({m.group('unit')}, {r}.sales_date::timestamp)")
+
+    def replace_to_char(m: re.Match) -> str:
+        if not is_date(m.group("ref")):
+            return m.group(0)
+        if _TIME_FORMAT_RE.search(literal(m.group("fmt"))):
+            raise _NotRoutable("time-of-day format")
+        return hold(f"to_char({r}.sales_date, {m.group('fmt')})")
+
+    def replace_extract(m: re.Match) -> str:
+        if not is_date(m.group("ref")):
+            return m.group(0)
+        if m.group("part").lower() not in _DATE_PARTS:
+            raise _NotRoutable("time-of-day extract")
+        return hold(f"EXTRACT({m.group('part')} FROM {r}.sales_date)")
+
+    def replace_comparison(m: re.Match) -> str:
+        if not is_date(m.group("ref")):
+            return m.group(0)
+        # 時刻を含まない日付との >= / < 比較だけが日次集計で同じ結果になる
+        if not _DATE_LITERAL_RE.match(literal(m.group("lit"))):
+            raise _NotRoutable("timestamp comparison")
+        # 比較の両辺が列と日付リテラルだけの場合に限る（'2024-01-01' + INTERVAL などは時刻を含む）
+        before, after = m.string[: m.start()], m.string[m.end():]
+        if not (_OPERAND_START_RE.search(before) and _OPERAND_END_RE.match(after)):
+            raise _NotRoutable("date arithmetic in comparison")
+        return hold(f"{r}.sales_date {m.group('op')} {m.group('date') or ''}{m.group('lit')}")
+
+    lit = r"\x00\d+\x00"
+    ref = rf"(?P<ref>{_REF})"
+    text = re.sub(
+        rf"\bdate_trunc\s*\(\s*(?P<unit>{lit})\s*,\s*{ref}\s*\)", replace_trunc, text, flags=re.I
+    )
+    text = re.sub(
+        rf"\bto_char\s*\(\s*{ref}\s*,\s*(?P<fmt>{lit})\s*\)", replace_to_char, text, flags=re.I
+    )
+    text = re.sub(
+        rf"\bextract\s*\(\s*(?P<part>{_IDENT})\s+from\s+{ref}\s*\)", replace_extract, text, flags=re.I
+    )
+    text = re.sub(
+        rf"\bdate\s*\(\s*{ref}\s*\)", lambda m: replace_date(m, "{r}.sales_date"), text, flags=re.I
+    )
+    text = re.sub(
+        rf"\bcast\s*\(\s*{ref}\s+as\s+date\s*\)",
+        lambda m: replace_date(m, "{r}.sales_date"),
+        text,
+        flags=re.I,
+    )
+    text = re.sub(
+        rf"(?<![\w.]){ref}\s*::\s*date\b", lambda m: replace_date(m, "{r}.sales_date"), text, flags=re.I
+    )
+    text = re.sub(
+        rf"(?<![\w.]){ref}\s*(?P<op>>=|<)\s*(?P<date>date\s+)?(?P<lit>{lit})",
+        replace_comparison,
+        text,
+        flags=re.I,
+    )
+
+    # 3. 残りのカラム参照（ディメンションのみ許可）
+    def replace_reference(m: re.Match) -> str:
+        token = m.group("ref")
+        # 関数名・キーワード・出力列の別名（AS の後）はそのまま残す
+        if m.group("call") or m.group("alias") or token.lower() in _SQL_WORDS:
+            return m.group(0)
+        column = resolver.resolve(token)
+        if column is None:
+            if token.lower() in resolver.output_aliases:
+                return token
+            raise _NotRoutable(f"unknown identifier {token}")
+        if column in rollup["dimensions"]:
+            return f"{r}.{rollup['dimensions'][column]}"
+        if column.startswith("stores.") and stores_alias:
+            return f"{stores_alias}.{column.split('.', 1)[1]}"
+        raise _NotRoutable(f"column {column} is not a rollup dimension")
+
+    text = re.sub(
+        rf"(?P<alias>\bas\s+)?(?<![\w.:\x00\x01])(?P<ref>{_REF})(?![\w\x00\x01])(?P<call>\s*\()?",
+        replace_reference,
+        text,
+        flags=re.I,
+    )
+    # 型キャスト（::numeric など）はそのまま残す
+    text = re.sub(r"\x01(\d+)\x01", lambda m: placeholders[int(m.group(1))], text)
+    return text, aggregates
+
+
+def _output_aliases(select_clause: str) -> set:
+    """SELECT句の出力列の別名（AS の有無を問わない）を取得する"""
+    items, depth, start = [], 0, 0
+    for i, char in enumerate(select_clause):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            items.append(select_clause[start:i])
+            start = i + 1
+    items.append(select_clause[start:])
+
+    aliases = set()
+    for item in items:
+        match = re.search(rf"[\s)\x00](?:as\s+)?({_IDENT})\s*$", item.strip(), re.I)
+        if match and match.group(1).lower() not in _SQL_WORDS:
+            aliases.add(match.group(1).lower())
+    return aliases
+
+
+def route_query(sql: str) -> Optional[str]:
+    """
+    集計クエリをロールアップビューで実行できる場合に書き換える
+
+    transactions / transaction_items を日付・店舗・商品カテゴリ・会員ランク・ステータスで
+    集計する単純なSELECT文のみを対象とし、同じ結果を保証できない場合は None を返す。
+
+    Args:
+        sql: data_retrieval_agent が生成したSQL
+
+    Returns:
+        書き換えたSQL、またはルーティングできない場合は None
+    """
+    try:
+        return _route(sql)
+    except _NotRoutable as e:
+        logger.debug("Query not routed to rollup: %s", e)
+        return None
+
+
+def _route(sql: str) -> str:
+    sql = sql.strip().rstrip(";").strip()
+    strings: List[str] = []
+
+    def mask(m: re.Match) -> str:
+        strings.append(m.group(0))
+        return f"\x00{len(strings) - 1}\x00"
+
+    masked = _STRING_RE.sub(mask, sql)
+    if ";" in masked or '"' in masked or _UNSUPPORTED_RE.search(masked):
+        raise _NotRoutable("unsupported syntax")
+
+    clauses = _split_clauses(masked)
+    if "from" not in clauses:
+        raise _NotRoutable("missing FROM")
+    aliases, conditions, _ = _parse_from(clauses["from"])
+    resolver = _Resolver(aliases, _output_aliases(clauses["select"]))
+
+    # 結合条件を「テーブル名.カラム名」の組で比較する
+    joins = set()
+    for left, right in conditions:
+        left_column, right_column = resolver.resolve(left), resolver.resolve(right)
+        if left_column is None or right_column is None:
+            raise _NotRoutable("unsupported join condition")
+        joins.add(frozenset({left_column, right_column}))
+
+    table_aliases = {table: alias for alias, table in aliases.items()}
+    if len(table_aliases) != len(aliases):
+        raise _NotRoutable("self join")
+    stores_alias = table_aliases.get("stores")
+    fact_tables = set(table_aliases) - {"stores"}
+    if stores_alias:
+        if DIMENSION_TABLE_JOIN not in joins:
+            raise _NotRoutable("stores must be joined on store_id")
+        joins.discard(DIMENSION_TABLE_JOIN)
+
+    for rollup in ROLLUPS:
+        if rollup["tables"] == fact_tables and rollup["joins"] == joins:
+            break
+    else:
+        raise _NotRoutable("no matching rollup")
+
+    r = "agg"
+    while r in aliases:
+        r += "_"
+
+    rewritten: Dict[str, str] = {}
+    aggregates = 0
+    for keyword in ("select", "where", "group by", "having", "order by"):
+        if keyword in clauses:
+            rewritten[keyword], count = _rewrite(
+                clauses[keyword],
+                resolver,
+                rollup,
+                r,
+                stores_alias,
+                strings,
+            )
+            aggregates += count
+    if aggregates == 0:
+        raise _NotRoutable("not an aggregate query")
+
+    parts = [f"SELECT {rewritten['select']}", f"FROM {rollup['view']} {r}"]
+    if stores_alias:
+        parts.append(f"JOIN stores {stores_alias} ON {stores_alias}.store_id = {r}.store_id")
+    filters = [f.format(r=r) for f in rollup["filters"]]
+    if "where" in rewritten:
+        filters.insert(0, f"({rewritten['where']})")
+    if filters:
+        parts.append("WHERE " + " AND ".join(filters))
+    for keyword in ("group by", "having", "order by"):
+        if keyword in rewritten:
+            parts.append(f"{keyword.upper()} {rewritten[keyword]}")
+    for keyword in ("limit", "offset"):
+        if keyword in clauses:
+            if not re.fullmatch(r"\d+", clauses[keyword]):
+                raise _NotRoutable(f"unsupported {keyword}")
+            parts.append(f"{keyword.upper()} {clauses[keyword]}")
+
+    routed = "\n".join(parts)
+    return re.sub(r"\x00(\d+)\x00", lambda m: strings[int(m.group(1))], routed)
+
+
+def route_query_callback(tool, args: Dict[str, Any], tool_context) -> None:
+    """
+    before_tool_callback として execute-query のSQLをロールアップに振り替える
+
+    元のSQLは tool_context.state["rollup_routing"] に記録する。
+    """
+    if not ROLLUP_ROUTING_ENABLED or getattr(tool, "name", None) != "execute-query":
+        return None
+    query = args.get("query")
+    if not isinstance(query, str):
+        return None
+    routed = route_query(query)
+    if routed is None:
+        return None
+    args["query"] = routed
+    history = list(tool_context.state.get("rollup_routing") or [])
+    history.append({"original": query, "routed": routed})
+    tool_context.state["rollup_routing"] = history[-10:]
+    logger.info("Routed aggregate query to rollup view")
+    return None
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+
+class TokenBucket:
+    """
+    スレッドセーフなトークンバケット
+
+    トークンを前借りして待ち時間を予約する方式のため、
+    同時に待機している呼び出しにも到着順に間隔が割り当てられる。
+    """
+
+    def __init__(self, rate_per_minute: float, burst: Optional[int] = None):
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute must be positive")
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst if burst is not None else max(1, int(self.rate)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """トークンを1つ予約し、利用可能になるまでの待ち時間（秒）を返す"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    async def acquire(self) -> None:
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def acquire_blocking(self) -> None:
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+_gemini_limiter: Optional[TokenBucket] = None
+_db_limit: Optional[int] = None
+_db_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def configure_gemini_rate_limit(
+    requests_per_minute: Optional[float], burst: Optional[int] = None
+) -> None:
+    """Gemini API呼び出しの共有レート制限を設定する（Noneで無制限）"""
+    global _gemini_limiter
+    _gemini_limiter = (
+        TokenBucket(requests_per_minute, burst) if requests_per_minute else None
+    )
+
+
+def configure_db_concurrency(max_concurrency: Optional[int]) -> None:
+    """DBを使用するステージの同時実行数を設定する（Noneで無制限）"""
+    global _db_limit, _db_semaphore
+    _db_limit = max_concurrency if max_concurrency and max_concurrency > 0 else None
+    _db_semaphore = None
+
+
+async def before_model_rate_limit(callback_context, llm_request) -> None:
+    """LlmAgentの before_model_callback として使用し、Gemini呼び出しを制限する"""
+    if _gemini_limiter is not None:
+        await _gemini_limiter.acquire()
+    return None
+
+
+def acquire_gemini_blocking() -> None:
+    """同期的なGemini呼び出しの前にレート制限を適用する"""
+    if _gemini_limiter is not None:
+        _gemini_limiter.acquire_blocking()
+
+
+@asynccontextmanager
+async def db_slot() -> AsyncIterator[None]:
+    """DBを使用する処理の同時実行数を制限する"""
+    global _db_semaphore
+    if _db_limit is None:
+        yield
+        return
+    if _db_semaphore is None:
+        # イベントループ内で生成する
+        _db_semaphore = asyncio.Semaphore(_db_limit)
+    async with _db_semaphore:
+        yield
+
+
+configure_gemini_rate_limit(
+    _env_float("GEMINI_RPM"), int(_env_float("GEMINI_BURST") or 0) or None
+)
+configure_db_concurrency(int(_env_float("DB_MAX_CONCURRENCY") or 0) or None)
@@ -0,0 +1,459 @@
+import json
+import logging
+import os
+import re
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from html import escape
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .analysis_index import REPORTS_DIR
+from .report_store import write_text_atomic
+from .approximate_query import _TABLE_REF_RE, _find_aggregates, _split_top_level
+from .query_router import _IDENT, _STRING_RE, _NotRoutable, _split_clauses, route_query
+from .report_renderer import render_report
+
+logger = logging.getLogger(__name__)
+
+# データの鮮度を表すウォーターマーク（この列の最大値）
+WATERMARK_TABLE = "transactions"
+WATERMARK_COLUMN = "transaction_date"
+
+# レポート更新用の仕様ファイル（<レポート名>.json）の形式
+SPEC_VERSION = 1
+
+MAX_DISPLAY_ROWS = 100
+
+_UNSUPPORTED_RE = re.compile(
+    r"\b(with|union|intersect|except|distinct|over|filter|within|lateral|tablesample"
+    r"|left|right|full|cross|natural|having|limit|offset"
+    r"|now|current_date|current_timestamp|localtimestamp|random)\b"
+    r"|\(\s*select\b|--|/\*",
+    re.IGNORECASE,
+)
+_ORDER_ITEM_RE = re.compile(
+    rf"^\s*(\d+|{_IDENT})(?:\s+(asc|desc))?(?:\s+nulls\s+(first|last))?\s*$", re.IGNORECASE
+)
+_NUMERIC_RE = re.compile(r"^-?\d+(?:\.\d+)?$")
+
+
+def _connect():
+    """分析用PostgreSQLに接続する（LLM・MCPサーバーを経由しない）"""
+    import psycopg2
+
+    return psycopg2.connect(
+        host=os.environ.get("DB_HOST", "postgres"),
+        port=int(os.environ.get("DB_PORT", "5432")),
+        dbname=os.environ.get("DB_NAME", "analytics_db"),
+        user=os.environ.get("DB_USER", "analytics_user"),
+        password=os.environ.get("DB_PASSWORD", "analytics_password"),
+    )
+
+
+def spec_path(report_filename: str) -> Path:
+    """レポートに対応する更新用の仕様ファイルのパス"""
+    return REPORTS_DIR / f"{Path(report_filename).stem}.json"
+
+
+def _to_json_value(value: Any) -> Any:
+    # 金額の精度を保つため Decimal は文字列で保存する
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (int, float, str, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def _add(left: Any, right: Any) -> Any:
+    """集計値を加算する（NULL は加算の単位元として扱う）"""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if isinstance(left, int) and isinstance(right, int):
+        return left + right
+    return str(Decimal(str(left)) + Decimal(str(right)))
+
+
+def plan_incremental(sql: str) -> Optional[Dict[str, Any]]:
+    """
+    ウォーターマーク以降のデータだけを集計して既存の結果に合算できるか判定する
+
+    対象は transactions を含む GROUP BY 集計で、SELECT句の集計列がすべて
+    加算可能（SUM / COUNT）かつ GROUP BY の式がすべて出力列に含まれるクエリ
+    （出力列だけで既存の行と差分の行を対応付けられる）。AVG・HAVING・LIMIT・
+    相対日付などを含む場合は None を返し、更新時は全件を再実行する。
+
+    Returns:
+        {"alias": transactions の別名, "measures": 集計列の位置, "order_by": 並び順}
+    """
+    try:
+        return _plan_incremental(sql)
+    except _NotRoutable as e:
+        logger.debug("Query cannot be refreshed incrementally: %s", e)
+        return None
+
+
+def _mask(sql: str) -> Tuple[str, List[str]]:
+    strings: List[str] = []
+
+    def mask(m: re.Match) -> str:
+        strings.append(m.group(0))
+        return f"\x00{len(strings) - 1}\x00"
+
+    return _STRING_RE.sub(mask, sql.strip().rstrip(";").strip()), strings
+
+
+def _plan_incremental(sql: str) -> Dict[str, Any]:
+    masked, _ = _mask(sql)
+    if ";" in masked or '"' in masked or _UNSUPPORTED_RE.search(masked):
+        raise _NotRoutable("unsupported syntax")
+    clauses = _split_clauses(masked)
+    if "from" not in clauses:
+        raise _NotRoutable("missing FROM")
+
+    references = [
+        m for m in _TABLE_REF_RE.finditer(clauses["from"])
+        if m.group("table").lower() == WATERMARK_TABLE
+    ]
+    if len(references) != 1:
+        raise _NotRoutable(f"{WATERMARK_TABLE} must be referenced once")
+    alias = (references[0].group("alias") or "").strip() or WATERMARK_TABLE
+    alias = re.sub(r"^as\s+", "", alias, flags=re.IGNORECASE)
+
+    measures = []
+    select_items = [item.strip() for item in _split_top_level(clauses["select"])]
+    for position, item in enumerate(select_items):
+        found = _find_aggregates(item)
+        if not found:
+            continue
+        start, end, function, _ = found[0]
+        is_single = len(found) == 1 and start == 0 and (
+            not item[end:].strip()
+            or re.fullmatch(rf"\s*(?:as\s+)?{_IDENT}", item[end:], re.IGNORECASE)
+        )
+        if not is_single or function not in ("sum", "count"):
+            raise _NotRoutable("non-additive select item")
+        measures.append(position)
+    if not measures:
+        raise _NotRoutable("not an aggregate query")
+    _check_group_keys(select_items, measures, clauses.get("group by"))
+
+    order_by = []
+    if "order by" in clauses:
+        for item in _split_top_level(clauses["order by"]):
+            match = _ORDER_ITEM_RE.match(item)
+            if not match:
+                raise _NotRoutable("unsupported ORDER BY")
+            order_by.append(
+                {
+                    "column": match.group(1).lower(),
+                    "descending": (match.group(2) or "").lower() == "desc",
+                    "nulls": (match.group(3) or "").lower() or None,
+                }
+            )
+    return {"alias": alias, "measures": measures, "order_by": order_by}
+
+
+def _normalize(expression: str) -> str:
+    return re.sub(r"\s+", " ", expression).strip().lower()
+
+
+def _check_group_keys(
+    select_items: List[str], measures: List[int], group_by: Optional[str]
+) -> None:
+    """GROUP BY の式がすべて集計列以外の出力列に含まれることを確認する"""
+    if group_by is None:
+        return
+    outputs = set()
+    for position, item in enumerate(select_items):
+        if position in measures:
+            continue
+        outputs.add(str(position + 1))
+        outputs.add(_normalize(item))
+        # 別名を除いた式と別名
+        match = re.fullmatch(rf"(.*?)(?:\s+as)?\s+({_IDENT})", item, re.IGNORECASE | re.DOTALL)
+        if match:
+            outputs.add(_normalize(match.group(1)))
+            outputs.add(match.group(2).lower())
+    for key in _split_top_level(group_by):
+        if _normalize(key) not in outputs:
+            raise _NotRoutable("GROUP BY expression missing from output")
+
+
+def incremental_sql(sql: str, alias: str, since: str, until: str) -> str:
+    """ウォーターマークの範囲 (since, until] のデータだけを集計するSQL"""
+    masked, strings = _mask(sql)
+    clauses = _split_clauses(masked)
+    window = (
+        f"{alias}.{WATERMARK_COLUMN} > TIMESTAMP '{since}' "
+        f"AND {alias}.{WATERMARK_COLUMN} <= TIMESTAMP '{until}'"
+    )
+    parts = [f"SELECT {clauses['select']}", f"FROM {clauses['from']}"]
+    if "where" in clauses:
+        parts.append(f"WHERE ({clauses['where']}) AND {window}")
+    else:
+        parts.append(f"WHERE {window}")
+    if "group by" in clauses:
+        parts.append(f"GROUP BY {clauses['group by']}")
+    rewritten = "\n".join(parts)
+    return re.sub(r"\x00(\d+)\x00", lambda m: strings[int(m.group(1))], rewritten)
+
+
+def _sort_rows(rows: List[List[Any]], columns: List[str], order_by: List[Dict[str, Any]]) -> None:
+    """元のクエリの ORDER BY に従って合算後の行を並べ替える"""
+    lowered = [c.lower() for c in columns]
+    for spec in reversed(order_by):
+        column = spec["column"]
+        if column.isdigit():
+            index = int(column) - 1
+        elif column in lowered:
+            index = lowered.index(column)
+        else:
+            # 出力列にない式での並び替えは再現できないため合算順のままにする
+            continue
+        # PostgreSQL の既定: 昇順は NULLS LAST、降順は NULLS FIRST
+        nulls_last = spec["nulls"] == "last" if spec["nulls"] else not spec["descending"]
+
+        def value_key(row: List[Any]) -> Tuple[int, Any]:
+            value = row[index]
+            if isinstance(value, str) and _NUMERIC_RE.match(value):
+                try:
+                    return (0, Decimal(value))
+                except InvalidOperation:
+                    pass
+            if isinstance(value, (int, float)):
+                return (0, Decimal(str(value)))
+            return (1, str(value))
+
+        present = [row for row in rows if row[index] is not None]
+        missing = [row for row in rows if row[index] is None]
+        present.sort(key=value_key, reverse=spec["descending"])
+        rows[:] = present + missing if nulls_last else missing + present
+
+
+def merge_rows(
+    rows: List[List[Any]], delta: List[List[Any]], measures: List[int]
+) -> List[List[Any]]:
+    """
+    集計列以外をキーとして差分の集計値を既存の行に加算する
+
+    既存の行または差分の中でキーが重複する場合（出力列がグループを一意に
+    表していない）は合算できないため ValueError を送出する。
+    """
+    merged: Dict[Tuple[Any, ...], List[Any]] = {}
+    for source in (rows, delta):
+        keys = set()
+        for row in source:
+            key = tuple(value for i, value in enumerate(row) if i not in measures)
+            if key in keys:
+                raise ValueError("rows are not unique by their non-aggregate columns")
+            keys.add(key)
+            if key not in merged:
+                merged[key] = list(row)
+                continue
+            for i in measures:
+                merged[key][i] = _add(merged[key][i], row[i])
+    return list(merged.values())
+
+
+def _execute(cursor, sql: str) -> Tuple[List[str], List[List[Any]]]:
+    cursor.execute(sql)
+    columns = [d[0] for d in cursor.description]
+    rows = [[_to_json_value(v) for v in row] for row in cursor.fetchall()]
+    return columns, rows
+
+
+def _read_snapshot(connection) -> None:
+    """ウォーターマークとクエリ結果を同じスナップショットから読む"""
+    connection.set_session(isolation_level="REPEATABLE READ", readonly=True)
+
+
+def _current_watermark(cursor) -> Optional[str]:
+    cursor.execute(f"SELECT MAX({WATERMARK_COLUMN}) FROM {WATERMARK_TABLE}")
+    value = cursor.fetchone()[0]
+    return value.isoformat(sep=" ") if value is not None else None
+
+
+def _run_full(cursor, sql: str) -> Tuple[List[str], List[List[Any]]]:
+    # 全件の再実行はロールアップで答えられる場合はロールアップを使う
+    return _execute(cursor, route_query(sql) or sql)
+
+
+def _select_statements(sql: List[str]) -> List[str]:
+    """SQLを文単位に分割し、SELECT文のみを返す"""
+    statements = []
+    for text in sql:
+        masked, strings = _mask(text)
+        for statement in masked.split(";"):
+            statement = statement.strip()
+            if re.match(r"select\b", statement, re.IGNORECASE):
+                statements.append(
+                    re.sub(r"\x00(\d+)\x00", lambda m: strings[int(m.group(1))], statement)
+                )
+    return list(dict.fromkeys(statements))
+
+
+def save_report_spec(
+    report_filename: str,
+    report_title: str,
+    generation_time: str,
+    sections: Dict[str, str],
+    queries: List[Dict[str, Any]],
+) -> Dict[str, Any]:
+    """
+    レポートの再生成に必要な情報（SQL・結果）を保存する
+
+    data_retrieval_agent が実行したSQLと取得した結果をそのまま保存し、DBには接続しない。
+    結果と同じ時点のウォーターマークは分からないため記録せず、初回の更新で
+    全件を実行してウォーターマークを記録する（以降の更新は差分で行う）。
+
+    Args:
+        report_filename: レポートのファイル名
+        report_title: レポートのタイトル
+        generation_time: レポートの生成日時
+        sections: テンプレートに渡したHTML（request_summary など）
+        queries: 実行したクエリ（query_log.load_query_results で読み込んだ sql / columns / rows）
+    """
+    recorded = []
+    for query in queries:
+        statements = _select_statements([query["sql"]])
+        # 1つのSELECT文の結果のみ保存する（複数文の結果は文ごとに分けられない）
+        if len(statements) == 1 and "rows" in query:
+            recorded.append(
+                {"sql": statements[0], "columns": query["columns"], "rows": query["rows"]}
+            )
+        else:
+            recorded.extend({"sql": statement} for statement in statements)
+    spec: Dict[str, Any] = {
+        "version": SPEC_VERSION,
+        "report_filename": report_filename,
+        "report_title": report_title,
+        "generation_time": generation_time,
+        "sections": sections,
+        "watermark": None,
+        "refreshed_at": None,
+        "queries": list({query["sql"]: query for query in recorded}.values()),
+    }
+    _write_json(spec_path(report_filename), spec)
+    return spec
+
+
+def refresh_report(report_filename: str, full: bool = False) -> Dict[str, Any]:
+    """
+    保存済みのSQLだけを再実行してレポートを更新する（LLMは呼び出さない）
+
+    加算可能な集計クエリはウォーターマーク以降のデータだけを集計して既存の結果に合算し、
+    それ以外のクエリは全件を再実行する。
+
+    Args:
+        report_filename: 更新するレポートのファイル名
+        full: True の場合はすべてのクエリを全件再実行する（過去データの修正を反映する）
+
+    Returns:
+        更新結果のサマリー
+    """
+    path = spec_path(report_filename)
+    if not path.exists():
+        raise FileNotFoundError(f"No refresh spec for {report_filename}")
+    with open(path, "r", encoding="utf-8") as f:
+        spec = json.load(f)
+    if not spec.get("queries"):
+        raise ValueError(f"{report_filename} has no recorded SQL")
+
+    previous = spec.get("watermark")
+    results = []
+    connection = _connect()
+    try:
+        _read_snapshot(connection)
+        with connection.cursor() as cursor:
+            watermark = _current_watermark(cursor)
+            for query in spec["queries"]:
+                has_rows = "rows" in query and previous is not None and watermark is not None
+                if has_rows and not full and watermark == previous:
+                    results.append({"mode": "unchanged", "rows": len(query["rows"])})
+                    continue
+                plan = None if full else plan_incremental(query["sql"])
+                if plan is None or not has_rows:
+                    query["columns"], query["rows"] = _run_full(cursor, query["sql"])
+                    results.append({"mode": "full", "rows": len(query["rows"])})
+                    continue
+                _, delta = _execute(
+                    cursor, incremental_sql(query["sql"], plan["alias"], previous, watermark)
+                )
+                try:
+                    query["rows"] = merge_rows(query["rows"], delta, plan["measures"])
+                except ValueError as e:
+                    logger.warning("Falling back to a full run: %s", e)
+                    query["columns"], query["rows"] = _run_full(cursor, query["sql"])
+                    results.append({"mode": "full", "rows": len(query["rows"])})
+                    continue
+                if plan["order_by"]:
+                    _sort_rows(query["rows"], query["columns"], plan["order_by"])
+                results.append(
+                    {"mode": "incremental", "rows": len(query["rows"]), "delta_rows": len(delta)}
+                )
+    finally:
+        connection.close()
+
+    spec["watermark"] = watermark
+    spec["refreshed_at"] = datetime.now().strftime("%Y年%m月%d日 %H:%M:%S")
+    html_content = render_refreshed_report(spec)
+    _write_text(REPORTS_DIR / spec["report_filename"], html_content)
+    _write_json(path, spec)
+    return {
+        "report_filename": spec["report_filename"],
+        "previous_watermark": previous,
+        "watermark": watermark,
+        "refreshed_at": spec["refreshed_at"],
+        "queries": results,
+    }
+
+
+def render_result_tables(queries: List[Dict[str, Any]]) -> str:
+    """保存したクエリ結果をHTMLテーブルにする"""
+    html = []
+    for number, query in enumerate(queries, start=1):
+        html.append(f"<h3>クエリ {number}</h3>")
+        html.append(f"<pre><code>{escape(query['sql'])}</code></pre>")
+        rows = query.get("rows") or []
+        if not rows:
+            html.append("<p>クエリ結果がありません</p>")
+            continue
+        html.append("<table>\n<thead>\n<tr>")
+        html.extend(f"<th>{escape(str(column))}</th>" for column in query["columns"])
+        html.append("</tr>\n</thead>\n<tbody>")
+        for row in rows[:MAX_DISPLAY_ROWS]:
+            cells = "".join(f"<td>{escape('' if v is None else str(v))}</td>" for v in row)
+            html.append(f"<tr>{cells}</tr>")
+        html.append("</tbody>\n</table>")
+        if len(rows) > MAX_DISPLAY_ROWS:
+            html.append(f"<p><em>他 {len(rows) - MAX_DISPLAY_ROWS} 件のデータがあります</em></p>")
+    return "\n".join(html)
+
+
+def render_refreshed_report(spec: Dict[str, Any]) -> str:
+    """保存したセクションと最新のクエリ結果からレポートを再レンダリングする"""
+    sections = spec.get("sections", {})
+    return render_report(
+        report_title=spec["report_title"],
+        generation_time=spec["generation_time"],
+        refreshed_time=spec.get("refreshed_at"),
+        data_watermark=spec.get("watermark"),
+        request_summary=sections.get("request_summary", ""),
+        schema_info=sections.get("schema_info", ""),
+        data_result=render_result_tables(spec["queries"]),
+        insights=sections.get("insights", ""),
+    )
+
+
+def _write_text(path: Path, content: str) -> None:
+    # 表示中のレポートが途中まで書かれた状態にならないよう置き換えで更新する
+    write_text_atomic(path, content)
+
+
+def _write_json(path: Path, data: Dict[str, Any]) -> None:
+    _write_text(path, json.dumps(data, ensure_ascii=False, indent=2))
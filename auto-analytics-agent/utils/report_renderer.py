@@ -0,0 +1,64 @@
+import hashlib
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+from jinja2 import Environment, FileSystemLoader, Template, select_autoescape
+
+# fastapi-server と同じテンプレート・静的ファイルを共有する
+_FASTAPI_DIR = Path(__file__).resolve().parents[2] / "fastapi-server"
+
+TEMPLATE_DIR = Path(
+    os.environ.get("REPORT_TEMPLATE_DIR", _FASTAPI_DIR / "templates")
+)
+STATIC_DIR = Path(os.environ.get("REPORT_STATIC_DIR", _FASTAPI_DIR / "static"))
+STATIC_URL = os.environ.get("REPORT_STATIC_URL", "/static")
+
+REPORT_TEMPLATE = "basic_report.html"
+REPORT_STYLESHEET = "styles.css"
+
+# auto_reload=False: 一度コンパイルしたテンプレートはプロセス内で再利用する
+_environment = Environment(
+    loader=FileSystemLoader(str(TEMPLATE_DIR)),
+    autoescape=select_autoescape(["html"]),
+    auto_reload=False,
+    cache_size=50,
+)
+
+
+@lru_cache(maxsize=None)
+def get_template(name: str = REPORT_TEMPLATE) -> Template:
+    """コンパイル済みのJinja2テンプレートを取得する"""
+    return _environment.get_template(name)
+
+
+@lru_cache(maxsize=None)
+def asset_version(name: str = REPORT_STYLESHEET) -> str:
+    """
+    静的ファイルの内容ハッシュを返す
+
+    レポートは `?v=<hash>` 付きのURLで共有CSSを参照するため、
+    サーバー側で immutable キャッシュを指定してもCSS更新が反映される。
+    """
+    try:
+        content = (STATIC_DIR / name).read_bytes()
+    except OSError:
+        return ""
+    return hashlib.sha256(content).hexdigest()[:12]
+
+
+def render_report(template_name: str = REPORT_TEMPLATE, **context: Any) -> str:
+    """
+    共有アセットを参照するHTMLレポートをレンダリングする
+
+    Args:
+        template_name: 使用するテンプレート名
+        **context: テンプレートに渡す変数
+
+    Returns:
+        レンダリングされたHTML文字列
+    """
+    context.setdefault("static_url", STATIC_URL)
+    context.setdefault("asset_version", asset_version())
+    return get_template(template_name).render(**context)
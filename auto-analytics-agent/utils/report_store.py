@@ -0,0 +1,99 @@
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import aiofiles
+import aiofiles.os
+import google.genai.types as types
+
+from .analysis_index import REPORTS_DIR
+
+# 表示サーバーのURL（artifactの参照情報に含める）
+REPORT_BASE_URL = os.environ.get("REPORT_BASE_URL", "http://localhost:9000/reports")
+
+
+def new_report_filename(prefix: str = "analysis_report") -> str:
+    """
+    衝突しないレポートのファイル名を生成する
+
+    同じ秒に複数のセッションがレポートを生成しても重ならないよう、
+    タイムスタンプの後ろにランダムなIDを付ける。
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{prefix}_{timestamp}_{uuid.uuid4().hex[:8]}.html"
+
+
+def _tmp_path(path: Path) -> Path:
+    # 表示サーバーの一覧（*.html）に含まれず、同時書き込みとも重ならない一時ファイル名
+    return path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+
+
+def write_text_atomic(path: Path, content: str) -> None:
+    """一時ファイルに書き込んでから置き換え、途中まで書かれたファイルを見せない"""
+    tmp_path = _tmp_path(path)
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+async def save_report(
+    html_content: str, filename: Optional[str] = None, reports_dir: Path = REPORTS_DIR
+) -> Path:
+    """
+    HTMLレポートをイベントループを止めずに一度だけ書き込み、アトミックに公開する
+
+    Args:
+        html_content: レポートのHTML
+        filename: 保存するファイル名（省略時は new_report_filename で生成）
+        reports_dir: 保存先ディレクトリ
+
+    Returns:
+        保存したレポートのパス
+    """
+    path = Path(reports_dir) / (filename or new_report_filename())
+    tmp_path = _tmp_path(path)
+    try:
+        async with aiofiles.open(tmp_path, "w", encoding="utf-8") as f:
+            await f.write(html_content)
+            await f.flush()
+            await asyncio.to_thread(os.fsync, f.fileno())
+        await aiofiles.os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return path
+
+
+def report_reference(path: Path) -> Dict[str, Any]:
+    """保存済みレポートの参照情報"""
+    stat = path.stat()
+    return {
+        "report_filename": path.name,
+        "path": str(path),
+        "url": f"{REPORT_BASE_URL}/{path.name}",
+        "mime_type": "text/html",
+        "size": stat.st_size,
+        "saved_at": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+    }
+
+
+def report_reference_part(path: Path) -> types.Part:
+    """
+    レポートを参照するartifact用のPart
+
+    HTML本体はレポートファイルとして保存済みのため、artifactには
+    ファイルの場所とURLだけを保存して同じ内容を二重に書き込まない。
+    """
+    return types.Part.from_text(
+        text=json.dumps(report_reference(path), ensure_ascii=False)
+    )
@@ -0,0 +1,416 @@
+"""
+Durable analysis job queue and background worker pool.
+
+Jobs are stored in a local SQLite database so that submissions survive
+server restarts. Workers run inside the FastAPI process and execute each
+job by launching the AI agent's single-job entry point as a subprocess,
+which keeps this server free of any agent dependencies.
+
+Several server processes may share the queue. Each running job records the
+process that claimed it and a heartbeat, and only jobs whose owner is gone
+are requeued.
+"""
+
+import asyncio
+import json
+import os
+import shlex
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+DEFAULT_AGENT_COMMAND = "uv run python -m auto-analytics-agent.job"
+
+# Maximum size of a single progress line from the agent subprocess
+STREAM_LIMIT = 16 * 1024 * 1024
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed")
+
+# Seconds without a heartbeat after which a running job's owner is considered gone
+HEARTBEAT_TIMEOUT = 120.0
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+class JobQueue:
+    """
+    SQLite-backed FIFO queue of analysis jobs.
+
+    Submissions are a single indexed INSERT on a WAL-mode database, so they
+    complete in well under a millisecond and can be done directly from the
+    request handler.
+    """
+
+    def __init__(self, db_path: Path, heartbeat_timeout: float = HEARTBEAT_TIMEOUT):
+        self.db_path = Path(db_path)
+        self.heartbeat_timeout = heartbeat_timeout
+        # Identifies this queue's process as the owner of the jobs it claims
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.db_path), check_same_thread=False, isolation_level=None
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                question TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                stages TEXT NOT NULL DEFAULT '[]',
+                report_filename TEXT,
+                response TEXT,
+                error TEXT,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT,
+                owner TEXT,
+                heartbeat_at REAL
+            )
+            """
+        )
+        # Queues created before running jobs recorded their owner
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)"
+        )
+
+    def enqueue(self, question: str) -> Dict[str, Any]:
+        """Add a new job to the queue and return it."""
+        job_id = uuid.uuid4().hex
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, question, status, created_at) VALUES (?, ?, 'queued', ?)",
+                (job_id, question, now),
+            )
+        return {"id": job_id, "question": question, "status": "queued", "created_at": now}
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a job by ID."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, limit: int = 50, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        """List the most recent jobs, optionally filtered by status."""
+        query = "SELECT * FROM jobs"
+        params: List[Any] = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def claim_next(self) -> Optional[Dict[str, Any]]:
+        """Atomically mark the oldest queued job as running and return it."""
+        now = datetime.now().isoformat()
+        with self._lock:
+            while True:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                # Conditional update so that concurrent server processes never claim the same job
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ?, owner = ?, "
+                    "heartbeat_at = ? WHERE id = ? AND status = 'queued'",
+                    (now, self.owner, time.time(), row["id"]),
+                )
+                if cursor.rowcount == 1:
+                    claimed = self._conn.execute(
+                        "SELECT * FROM jobs WHERE id = ?", (row["id"],)
+                    ).fetchone()
+                    return self._to_dict(claimed)
+
+    def update_stage(self, job_id: str, stage: str) -> None:
+        """Record that a job has entered a pipeline stage."""
+        with self._lock:
+            row = self._conn.execute("SELECT stages FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            stages = json.loads(row["stages"])
+            stages.append({"stage": stage, "started_at": datetime.now().isoformat()})
+            self._conn.execute(
+                "UPDATE jobs SET stage = ?, stages = ? WHERE id = ?",
+                (stage, json.dumps(stages), job_id),
+            )
+
+    def complete(self, job_id: str, report_filename: Optional[str], response: str) -> None:
+        """Mark a job claimed by this queue as succeeded."""
+        with self._lock:
+            self._conn.execute(
+                """
+                UPDATE jobs SET status = 'succeeded', report_filename = ?, response = ?,
+                    finished_at = ?
+                WHERE id = ? AND status = 'running' AND owner = ?
+                """,
+                (report_filename, response, datetime.now().isoformat(), job_id, self.owner),
+            )
+
+    def fail(self, job_id: str, error: str) -> None:
+        """Mark a job claimed by this queue as failed."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? "
+                "WHERE id = ? AND status = 'running' AND owner = ?",
+                (error, datetime.now().isoformat(), job_id, self.owner),
+            )
+
+    def heartbeat(self) -> None:
+        """Record that this queue's process is still running the jobs it claimed."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE status = 'running' AND owner = ?",
+                (time.time(), self.owner),
+            )
+
+    def release(self) -> int:
+        """Put the jobs claimed by this queue back in the queue (on shutdown)."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', stage = NULL, stages = '[]', "
+                "started_at = NULL, owner = NULL, heartbeat_at = NULL "
+                "WHERE status = 'running' AND owner = ?",
+                (self.owner,),
+            )
+        return cursor.rowcount
+
+    def requeue_interrupted(self) -> int:
+        """
+        Put running jobs whose owner is gone back in the queue.
+
+        The owner is gone when its heartbeat is older than ``heartbeat_timeout``
+        or when it was a process on this host that no longer exists. Jobs
+        running in other live server processes are left alone.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, owner, heartbeat_at FROM jobs WHERE status = 'running'"
+            ).fetchall()
+            stale_before = time.time() - self.heartbeat_timeout
+            requeued = 0
+            for row in rows:
+                if row["owner"] == self.owner or not self._owner_gone(
+                    row["owner"], row["heartbeat_at"], stale_before
+                ):
+                    continue
+                # Conditional update so that a job its owner has just finished stays finished
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET status = 'queued', stage = NULL, stages = '[]', "
+                    "started_at = NULL, owner = NULL, heartbeat_at = NULL "
+                    "WHERE id = ? AND status = 'running' AND owner IS ?",
+                    (row["id"], row["owner"]),
+                )
+                requeued += cursor.rowcount
+        return requeued
+
+    @staticmethod
+    def _owner_gone(
+        owner: Optional[str], heartbeat_at: Optional[float], stale_before: float
+    ) -> bool:
+        if owner is None or heartbeat_at is None or heartbeat_at < stale_before:
+            return True
+        host, pid, _ = owner.rsplit(":", 2)
+        if host != socket.gethostname():
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except (PermissionError, ValueError):
+            pass
+        return False
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs per status."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"
+            ).fetchall()
+        counts = {status: 0 for status in JOB_STATUSES}
+        counts.update({row["status"]: row["n"] for row in rows})
+        return counts
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["stages"] = json.loads(job.get("stages") or "[]")
+        return job
+
+
+class JobWorkerPool:
+    """
+    Pool of asyncio workers that execute queued jobs.
+
+    Each job runs the agent command as a subprocess. The subprocess reports
+    progress as JSON lines on stdout (``{"type": "stage", ...}``) and ends with
+    a ``result`` or ``error`` message.
+
+    The agent's Gemini rate limit (``GEMINI_RPM``/``GEMINI_BURST``) and DB
+    concurrency limit (``DB_MAX_CONCURRENCY``) are enforced per process, so the
+    configured values are treated as totals for the pool and each worker's
+    subprocesses get a fixed share. With a DB limit, at most that many workers
+    are started, since every job needs the database.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        workers: int = 2,
+        agent_command: Optional[str] = None,
+        working_dir: Optional[Path] = None,
+        poll_interval: float = 5.0,
+        reports_dir: Optional[Path] = None,
+    ):
+        self.queue = queue
+        self.workers = max(0, workers)
+        self.gemini_rpm = _env_float("GEMINI_RPM")
+        self.gemini_burst = _env_float("GEMINI_BURST")
+        self.db_max_concurrency = int(_env_float("DB_MAX_CONCURRENCY") or 0) or None
+        if self.db_max_concurrency and self.workers > self.db_max_concurrency:
+            print(
+                f"⚠️ Limiting job workers to DB_MAX_CONCURRENCY={self.db_max_concurrency}"
+            )
+            self.workers = self.db_max_concurrency
+        self.reports_dir = Path(reports_dir) if reports_dir else None
+        self.agent_command = shlex.split(
+            agent_command or os.environ.get("AGENT_JOB_COMMAND", DEFAULT_AGENT_COMMAND)
+        )
+        self.working_dir = Path(working_dir) if working_dir else Path(__file__).parent.parent
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        """Start the worker tasks, resuming jobs interrupted by a previous shutdown."""
+        self.queue.requeue_interrupted()
+        self._tasks = [asyncio.create_task(self._worker(slot)) for slot in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+        self.notify()
+
+    async def stop(self) -> None:
+        """Cancel the worker tasks and put their interrupted jobs back in the queue."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.queue.release()
+
+    def notify(self) -> None:
+        """Wake idle workers after a job has been enqueued."""
+        self._wakeup.set()
+
+    def job_env(self, slot: int) -> Dict[str, str]:
+        """Environment for a worker's subprocesses, with its share of the shared limits."""
+        env = dict(os.environ)
+        if self.reports_dir is not None:
+            env["REPORTS_DIR"] = str(self.reports_dir)
+        if self.gemini_rpm:
+            env["GEMINI_RPM"] = repr(self.gemini_rpm / self.workers)
+            if self.gemini_burst:
+                env["GEMINI_BURST"] = str(max(1, int(self.gemini_burst) // self.workers))
+        if self.db_max_concurrency:
+            # Distribute the remainder so that the shares add up to the total
+            share, remainder = divmod(self.db_max_concurrency, self.workers)
+            env["DB_MAX_CONCURRENCY"] = str(share + (1 if slot < remainder else 0))
+        return env
+
+    async def _heartbeat(self) -> None:
+        """Keep this process's jobs alive and pick up jobs of server processes that died."""
+        interval = self.queue.heartbeat_timeout / 4
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.queue.heartbeat()
+                if self.queue.requeue_interrupted():
+                    self.notify()
+            except sqlite3.Error as e:
+                print(f"⚠️ Job heartbeat failed: {e}")
+
+    async def _worker(self, slot: int) -> None:
+        while True:
+            job = self.queue.claim_next()
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run_job(job, self.job_env(slot))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.queue.fail(job["id"], str(e))
+
+    async def _run_job(self, job: Dict[str, Any], env: Dict[str, str]) -> None:
+        process = await asyncio.create_subprocess_exec(
+            *self.agent_command,
+            "--id",
+            job["id"],
+            "--",
+            job["question"],
+            cwd=str(self.working_dir),
+            env=env,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=STREAM_LIMIT,
+        )
+        # Drain stderr concurrently so that verbose agent logs cannot fill the pipe
+        stderr_task = asyncio.create_task(process.stderr.read())
+        result: Optional[Dict[str, Any]] = None
+        error: Optional[str] = None
+        try:
+            assert process.stdout is not None
+            async for raw_line in process.stdout:
+                try:
+                    message = json.loads(raw_line)
+                except ValueError:
+                    # Ignore non-protocol output from the agent and its libraries
+                    continue
+                if not isinstance(message, dict):
+                    continue
+                if message.get("type") == "stage":
+                    self.queue.update_stage(job["id"], message["stage"])
+                elif message.get("type") == "result":
+                    result = message
+                elif message.get("type") == "error":
+                    error = message.get("error")
+            stderr = await stderr_task
+            await process.wait()
+        except asyncio.CancelledError:
+            process.kill()
+            stderr_task.cancel()
+            raise
+
+        if result is not None and process.returncode == 0:
+            self.queue.complete(job["id"], result.get("report_filename"), result.get("response", ""))
+        else:
+            detail = error or stderr.decode("utf-8", errors="replace")[-2000:]
+            self.queue.fail(job["id"], detail or f"Agent exited with code {process.returncode}")
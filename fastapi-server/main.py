@@ -4,22 +4,66 @@ Independent FastAPI Server for Auto Analytics Report Display
 This server is completely decoupled from the AI agent and only serves
 HTML reports generated by the agent. It monitors the reports directory
 and provides a web interface for browsing and viewing reports.
+
+Analyses can also be submitted as asynchronous jobs. Jobs are kept in a
+durable local queue and executed by background workers that launch the
+agent as a subprocess, so the server still does not import the agent.
+Saved reports are refreshed the same way, by launching the agent's refresh
+command, which re-runs only the report's recorded SQL.
+
+Reports older than the retention period are packed into compressed archive
+segments and served from there transparently; recent reports stay as loose
+files in the reports directory.
 """
 
 import os
 import asyncio
+import json
+import shlex
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel, Field
 import aiofiles
 import uvicorn
 
+from job_queue import JobQueue, JobWorkerPool, STREAM_LIMIT
+from report_archive import DEFAULT_RETENTION_DAYS, ReportArchive
+
+
+DEFAULT_REFRESH_COMMAND = "uv run python -m auto-analytics-agent.refresh"
+REPORTS_PAGE_SIZE = 100
+
+
+class JobRequest(BaseModel):
+    """Request body for submitting an analysis job."""
+
+    question: str = Field(..., min_length=1, description="Analysis request in natural language")
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """
+    Static file handler that marks shared report assets as immutable.
+
+    Reports reference shared assets with a content-hash query string
+    (``/static/styles.css?v=<hash>``), so browsers and proxies may cache
+    them for a year without revalidation.
+    """
+
+    cache_control = "public, max-age=31536000, immutable"
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = self.cache_control
+        return response
+
 
 class ReportDisplayServer:
     """
@@ -33,7 +77,10 @@ class ReportDisplayServer:
         self, 
         reports_dir: Optional[str] = None, 
         template_dir: Optional[str] = None,
-        static_dir: Optional[str] = None
+        static_dir: Optional[str] = None,
+        job_workers: Optional[int] = None,
+        agent_command: Optional[str] = None,
+        retention_days: Optional[float] = None
     ):
         """
         Initialize the report display server.
@@ -42,11 +89,17 @@ class ReportDisplayServer:
             reports_dir: Directory containing HTML reports (default: ../reports)
             template_dir: Directory containing Jinja2 templates
             static_dir: Directory containing static files
+            job_workers: Number of background analysis job workers
+                (default: JOB_WORKERS or 2; 0 disables job execution)
+            agent_command: Command used to run a single analysis job
+                (default: AGENT_JOB_COMMAND or ``uv run python -m auto-analytics-agent.job``)
+            retention_days: Age in days after which reports are moved to the archive
+                (default: REPORT_RETENTION_DAYS or 30; 0 disables archiving)
         """
         # Set up directories
         if reports_dir is None:
             # Default to reports directory in workspace root
-            reports_dir = Path(__file__).parent.parent / "reports"
+            reports_dir = os.environ.get("REPORTS_DIR") or Path(__file__).parent.parent / "reports"
         self.reports_dir = Path(reports_dir)
         self.reports_dir.mkdir(exist_ok=True)
         
@@ -59,6 +112,24 @@ class ReportDisplayServer:
         self.static_dir = Path(static_dir)
         self.static_dir.mkdir(exist_ok=True)
         
+        if job_workers is None:
+            job_workers = int(os.environ.get("JOB_WORKERS", "2"))
+        self.job_workers = job_workers
+        self.agent_command = agent_command
+        self.job_queue: Optional[JobQueue] = None
+        self.job_pool: Optional[JobWorkerPool] = None
+        self.refresh_command = shlex.split(
+            os.environ.get("REPORT_REFRESH_COMMAND", DEFAULT_REFRESH_COMMAND)
+        )
+        self.refresh_timeout = float(os.environ.get("REPORT_REFRESH_TIMEOUT", "300"))
+        self._refresh_locks: Dict[str, asyncio.Lock] = {}
+        
+        if retention_days is None:
+            retention_days = float(os.environ.get("REPORT_RETENTION_DAYS", DEFAULT_RETENTION_DAYS))
+        self.retention_days = retention_days
+        self.compaction_interval = float(os.environ.get("REPORT_COMPACTION_INTERVAL", "3600"))
+        self.report_archive: Optional[ReportArchive] = None
+        
         # Initialize FastAPI app
         self.app = self._create_app()
     
@@ -69,7 +140,8 @@ class ReportDisplayServer:
             description="Independent FastAPI server for displaying AI-generated analysis reports",
             version="1.0.0",
             docs_url="/api/docs",
-            redoc_url="/api/redoc"
+            redoc_url="/api/redoc",
+            lifespan=self._lifespan
         )
         
         # Add CORS middleware
@@ -86,27 +158,68 @@ class ReportDisplayServer:
         
         # Mount static files
         if self.static_dir.exists():
-            app.mount("/static", StaticFiles(directory=str(self.static_dir)), name="static")
+            app.mount("/static", ImmutableStaticFiles(directory=str(self.static_dir)), name="static")
         
         # Register routes
         self._register_routes(app, templates)
         
         return app
     
+    @asynccontextmanager
+    async def _lifespan(self, app: FastAPI):
+        """Open the job queue and archive and run the background tasks for the app's lifetime."""
+        self.job_queue = JobQueue(self.reports_dir / ".jobs.sqlite3")
+        self.job_pool = JobWorkerPool(
+            self.job_queue,
+            workers=self.job_workers,
+            agent_command=self.agent_command,
+            reports_dir=self.reports_dir,
+        )
+        self.job_pool.start()
+        self.report_archive = ReportArchive(self.reports_dir / "archive")
+        compaction_task = (
+            asyncio.create_task(self._compaction_loop()) if self.retention_days > 0 else None
+        )
+        try:
+            yield
+        finally:
+            if compaction_task:
+                compaction_task.cancel()
+                await asyncio.gather(compaction_task, return_exceptions=True)
+            await self.job_pool.stop()
+            self.job_queue.close()
+            self.report_archive.close()
+    
+    async def _compaction_loop(self):
+        """Periodically move reports past the retention period into the archive."""
+        while True:
+            try:
+                await asyncio.to_thread(
+                    self.report_archive.compact, self.reports_dir, self.retention_days
+                )
+            except Exception as e:
+                print(f"⚠️ Report compaction failed: {e}")
+            await asyncio.sleep(self.compaction_interval)
+    
     def _register_routes(self, app: FastAPI, templates: Jinja2Templates):
         """Register all API routes."""
         
         @app.get("/", response_class=HTMLResponse)
-        async def root(request: Request):
+        async def root(
+            request: Request,
+            limit: int = Query(REPORTS_PAGE_SIZE, ge=1, le=1000),
+            offset: int = Query(0, ge=0)
+        ):
             """Serve the main reports listing page."""
             try:
-                reports = await self._get_reports_list()
+                reports, total = await self._get_reports_list(limit, offset)
                 return templates.TemplateResponse(
                     "report_list.html", 
                     {
                         "request": request,
                         "reports": reports,
-                        "total_reports": len(reports),
+                        "total_reports": total,
+                        "page": {"limit": limit, "offset": offset, "total": total},
                         "server_info": {
                             "reports_dir": str(self.reports_dir),
                             "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -117,11 +230,20 @@ class ReportDisplayServer:
                 raise HTTPException(status_code=500, detail=f"Failed to load reports: {str(e)}")
         
         @app.get("/api/reports", response_model=List[Dict[str, Any]])
-        async def get_reports_api():
-            """Get list of available reports as JSON."""
+        async def get_reports_api(
+            limit: int = Query(REPORTS_PAGE_SIZE, ge=1, le=1000),
+            offset: int = Query(0, ge=0)
+        ):
+            """Get a page of available reports (newest first) as JSON."""
             try:
-                reports = await self._get_reports_list()
-                return JSONResponse(content={"reports": reports, "count": len(reports)})
+                reports, total = await self._get_reports_list(limit, offset)
+                return JSONResponse(content={
+                    "reports": reports,
+                    "count": len(reports),
+                    "total": total,
+                    "limit": limit,
+                    "offset": offset
+                })
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"Failed to fetch reports: {str(e)}")
         
@@ -135,17 +257,19 @@ class ReportDisplayServer:
                 
                 file_path = self.reports_dir / filename
                 
-                if not file_path.exists():
-                    raise HTTPException(status_code=404, detail="Report not found")
-                
                 if not file_path.suffix.lower() == ".html":
                     raise HTTPException(status_code=400, detail="Only HTML files are supported")
                 
-                # Read HTML content and return as HTMLResponse for browser display
-                async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
-                    html_content = await f.read()
+                if file_path.exists():
+                    # Read HTML content and return as HTMLResponse for browser display
+                    async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
+                        html_content = await f.read()
+                    return HTMLResponse(content=html_content)
                 
-                return HTMLResponse(content=html_content)
+                content = await asyncio.to_thread(self.report_archive.get, filename)
+                if content is None:
+                    raise HTTPException(status_code=404, detail="Report not found")
+                return HTMLResponse(content=content.decode("utf-8"))
             except HTTPException:
                 raise
             except Exception as e:
@@ -161,19 +285,23 @@ class ReportDisplayServer:
                 
                 file_path = self.reports_dir / filename
                 
-                if not file_path.exists():
-                    raise HTTPException(status_code=404, detail="Report not found")
-                
                 if not file_path.suffix.lower() == ".html":
                     raise HTTPException(status_code=400, detail="Only HTML files are supported")
                 
-                # Return as file download
-                return FileResponse(
-                    path=str(file_path),
-                    media_type="text/html",
-                    filename=filename,
-                    headers={"Content-Disposition": f"attachment; filename={filename}"}
-                )
+                headers = {"Content-Disposition": f"attachment; filename={filename}"}
+                if file_path.exists():
+                    # Return as file download
+                    return FileResponse(
+                        path=str(file_path),
+                        media_type="text/html",
+                        filename=filename,
+                        headers=headers
+                    )
+                
+                content = await asyncio.to_thread(self.report_archive.get, filename)
+                if content is None:
+                    raise HTTPException(status_code=404, detail="Report not found")
+                return Response(content=content, media_type="text/html", headers=headers)
             except HTTPException:
                 raise
             except Exception as e:
@@ -188,11 +316,14 @@ class ReportDisplayServer:
                 
                 file_path = self.reports_dir / filename
                 
-                if not file_path.exists():
-                    raise HTTPException(status_code=404, detail="Report not found")
+                if file_path.exists():
+                    info = await self._get_report_info(file_path)
+                    return JSONResponse(content=info)
                 
-                info = await self._get_report_info(file_path)
-                return JSONResponse(content=info)
+                entry = self.report_archive.info(filename)
+                if entry is None:
+                    raise HTTPException(status_code=404, detail="Report not found")
+                return JSONResponse(content=self._get_archived_report_info(entry))
             except HTTPException:
                 raise
             except Exception as e:
@@ -201,15 +332,80 @@ class ReportDisplayServer:
         @app.get("/api/health")
         async def health_check():
             """Health check endpoint."""
+            archive = self.report_archive.stats()
             return JSONResponse(content={
                 "status": "healthy",
                 "service": "report-display-server",
                 "timestamp": datetime.now().isoformat(),
                 "reports_dir": str(self.reports_dir),
-                "total_reports": len(list(self.reports_dir.glob("*.html"))),
+                "total_reports": len(list(self.reports_dir.glob("*.html"))) + archive["reports"],
+                "archive": {**archive, "retention_days": self.retention_days},
+                "job_workers": self.job_pool.workers,
+                "jobs": self.job_queue.counts() if self.job_queue else None,
                 "version": "1.0.0"
             })
         
+        @app.post("/api/jobs", status_code=202)
+        async def submit_job(job_request: JobRequest):
+            """Enqueue an analysis job and return immediately."""
+            try:
+                job = self.job_queue.enqueue(job_request.question)
+                self.job_pool.notify()
+                return JSONResponse(status_code=202, content={
+                    **job,
+                    "status_url": f"/api/jobs/{job['id']}"
+                })
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Failed to submit job: {str(e)}")
+        
+        @app.get("/api/jobs")
+        async def list_jobs(limit: int = 50, status: Optional[str] = None):
+            """List recent analysis jobs."""
+            try:
+                jobs = [self._format_job(job) for job in self.job_queue.list(limit=limit, status=status)]
+                return JSONResponse(content={"jobs": jobs, "count": len(jobs)})
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Failed to list jobs: {str(e)}")
+        
+        @app.get("/api/jobs/{job_id}")
+        async def get_job(job_id: str):
+            """Get status, stage progress and report link of an analysis job."""
+            job = self.job_queue.get(job_id)
+            if job is None:
+                raise HTTPException(status_code=404, detail="Job not found")
+            return JSONResponse(content=self._format_job(job))
+        
+        @app.post("/api/reports/{filename}/refresh")
+        async def refresh_report(filename: str, full: bool = False):
+            """Re-run a report's recorded SQL for newer data and re-render it (no LLM calls)."""
+            if ".." in filename or "/" in filename or "\\" in filename:
+                raise HTTPException(status_code=400, detail="Invalid filename")
+            
+            file_path = self.reports_dir / filename
+            
+            # Archived reports can be refreshed too; the refreshed copy becomes a hot loose file
+            if not file_path.exists() and self.report_archive.info(filename) is None:
+                raise HTTPException(status_code=404, detail="Report not found")
+            
+            # Refreshes of the same report are serialized; different reports run concurrently
+            lock = self._refresh_locks.setdefault(filename, asyncio.Lock())
+            async with lock:
+                # The recorded SQL of an archived report is archived with it
+                has_spec = file_path.with_suffix(".json").exists() or await asyncio.to_thread(
+                    self._restore_archived_spec, filename
+                )
+                if not has_spec:
+                    raise HTTPException(
+                        status_code=404, detail="Report has no recorded SQL to refresh"
+                    )
+                result = await self._run_refresh(filename, full)
+            if result.get("status") != "succeeded":
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Failed to refresh report: {result.get('error', 'unknown error')}"
+                )
+            return JSONResponse(content={**result, "url": f"/reports/{filename}"})
+        
         @app.delete("/api/reports/{filename}")
         async def delete_report(filename: str):
             """Delete a report file."""
@@ -219,10 +415,17 @@ class ReportDisplayServer:
                 
                 file_path = self.reports_dir / filename
                 
-                if not file_path.exists():
+                deleted = file_path.exists()
+                if deleted:
+                    file_path.unlink()
+                # A refreshed report may exist both loose and archived
+                archived = await asyncio.to_thread(self.report_archive.delete, filename)
+                deleted = archived or deleted
+                if not deleted:
                     raise HTTPException(status_code=404, detail="Report not found")
                 
-                file_path.unlink()
+                # Remove the recorded SQL and results used for refreshing
+                file_path.with_suffix(".json").unlink(missing_ok=True)
                 return JSONResponse(content={"message": f"Report {filename} deleted successfully"})
             except HTTPException:
                 raise
@@ -233,17 +436,28 @@ class ReportDisplayServer:
         async def refresh_reports():
             """Refresh the reports list (useful for polling)."""
             try:
-                reports = await self._get_reports_list()
+                _, total = await self._get_reports_list(limit=0)
                 return JSONResponse(content={
                     "message": "Reports refreshed successfully",
-                    "count": len(reports),
+                    "count": total,
                     "timestamp": datetime.now().isoformat()
                 })
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"Failed to refresh reports: {str(e)}")
     
-    async def _get_reports_list(self) -> List[Dict[str, Any]]:
-        """Get list of available HTML reports with metadata."""
+    async def _get_reports_list(
+        self, limit: Optional[int] = None, offset: int = 0
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Get a page of available HTML reports (loose and archived) with metadata.
+        
+        Args:
+            limit: Maximum number of reports to return (None returns all)
+            offset: Number of newest reports to skip
+        
+        Returns:
+            The reports on the page (newest first) and the total number of reports
+        """
         reports = []
         
         for file_path in self.reports_dir.glob("*.html"):
@@ -254,10 +468,18 @@ class ReportDisplayServer:
                 # Skip files that can't be processed
                 continue
         
+        # Archived reports are listed from the archive index alone, reading no more
+        # entries than the page needs; a loose copy (e.g. a refreshed report) takes precedence
+        loose = {report["filename"] for report in reports}
+        end = None if limit is None else offset + limit
+        archived = await asyncio.to_thread(self.report_archive.list, end, 0, loose)
+        reports.extend(self._get_archived_report_info(entry) for entry in archived)
+        total = len(loose) + await asyncio.to_thread(self.report_archive.count, loose)
+        
         # Sort by modification time (newest first)
         reports.sort(key=lambda x: x["modified_timestamp"], reverse=True)
         
-        return reports
+        return reports[offset:end], total
     
     async def _get_report_info(self, file_path: Path) -> Dict[str, Any]:
         """Get metadata for a single report file."""
@@ -275,9 +497,43 @@ class ReportDisplayServer:
             "modified_timestamp": stat.st_mtime,
             "url": f"/reports/{file_path.name}",
             "api_url": f"/api/reports/{file_path.name}/info",
-            "delete_url": f"/api/reports/{file_path.name}"
+            "delete_url": f"/api/reports/{file_path.name}",
+            "refresh_url": (
+                f"/api/reports/{file_path.name}/refresh"
+                if file_path.with_suffix(".json").exists() else None
+            ),
+            "archived": False
+        }
+    
+    def _get_archived_report_info(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Get metadata for an archived report from its index entry."""
+        filename = entry["filename"]
+        return {
+            "filename": filename,
+            "title": entry.get("title") or Path(filename).stem.replace("_", " ").title(),
+            "size": entry["size"],
+            "size_formatted": self._format_file_size(entry["size"]),
+            "modified": datetime.fromtimestamp(entry["mtime"]).strftime("%Y-%m-%d %H:%M:%S"),
+            "modified_timestamp": entry["mtime"],
+            "url": f"/reports/{filename}",
+            "api_url": f"/api/reports/{filename}/info",
+            "delete_url": f"/api/reports/{filename}",
+            "refresh_url": f"/api/reports/{filename}/refresh" if entry.get("refreshable") else None,
+            "archived": True
         }
     
+    def _restore_archived_spec(self, filename: str) -> bool:
+        """Write an archived report's refresh spec back next to the report."""
+        spec_name = Path(filename).with_suffix(".json").name
+        content = self.report_archive.get(spec_name)
+        if content is None:
+            return False
+        spec_path = self.reports_dir / spec_name
+        tmp_path = spec_path.with_name(f".{spec_name}.tmp")
+        tmp_path.write_bytes(content)
+        os.replace(tmp_path, spec_path)
+        return True
+    
     async def _extract_title_from_html(self, file_path: Path) -> Optional[str]:
         """Extract title from HTML file."""
         try:
@@ -302,6 +558,48 @@ class ReportDisplayServer:
         except Exception:
             return None
     
+    async def _run_refresh(self, filename: str, full: bool) -> Dict[str, Any]:
+        """Run the agent's refresh command for one report and return its result."""
+        args = [*self.refresh_command, filename]
+        if full:
+            args.append("--full")
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            cwd=str(Path(__file__).parent.parent),
+            env={**os.environ, "REPORTS_DIR": str(self.reports_dir)},
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=STREAM_LIMIT,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(), timeout=self.refresh_timeout
+            )
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return {"status": "failed", "error": f"Refresh timed out after {self.refresh_timeout:.0f}s"}
+        
+        # The command prints one JSON line per report; ignore any other output
+        for line in reversed(stdout.decode("utf-8", errors="replace").splitlines()):
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(message, dict) and message.get("report_filename") == filename:
+                return message
+        detail = stderr.decode("utf-8", errors="replace")[-2000:]
+        return {"status": "failed", "error": detail or f"Refresh exited with code {process.returncode}"}
+    
+    def _format_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Add report links to a job record."""
+        filename = job.get("report_filename")
+        return {
+            **job,
+            "report_url": f"/reports/{filename}" if filename else None,
+            "status_url": f"/api/jobs/{job['id']}"
+        }
+    
     def _format_file_size(self, size_bytes: int) -> str:
         """Format file size in human-readable format."""
         if size_bytes < 1024:
@@ -326,6 +624,12 @@ def main():
     parser.add_argument("--port", type=int, default=9000, help="Port to bind to")
     parser.add_argument("--reports-dir", help="Directory containing reports")
     parser.add_argument("--reload", action="store_true", help="Enable auto-reload")
+    parser.add_argument("--job-workers", type=int, help="Number of background analysis job workers")
+    parser.add_argument("--agent-command", help="Command used to run a single analysis job")
+    parser.add_argument(
+        "--retention-days", type=float,
+        help="Archive reports older than this many days (0 disables archiving)"
+    )
     
     args = parser.parse_args()
     
@@ -333,6 +637,15 @@ def main():
     if args.reports_dir:
         server.reports_dir = Path(args.reports_dir)
         server.reports_dir.mkdir(exist_ok=True)
+        os.environ["REPORTS_DIR"] = str(server.reports_dir)
+    
+    # uvicorn re-imports "main:app", so pass job settings through the environment
+    if args.job_workers is not None:
+        os.environ["JOB_WORKERS"] = str(args.job_workers)
+    if args.agent_command:
+        os.environ["AGENT_JOB_COMMAND"] = args.agent_command
+    if args.retention_days is not None:
+        os.environ["REPORT_RETENTION_DAYS"] = str(args.retention_days)
     
     print(f"🚀 Starting Report Display Server at http://{args.host}:{args.port}")
     print(f"📁 Serving reports from: {server.reports_dir}")
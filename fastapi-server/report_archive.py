@@ -0,0 +1,414 @@
+"""
+Compacted archive for old HTML reports.
+
+Reports older than the retention period are packed into append-only segment
+files. Each report is stored as an independent zlib stream, so a single
+report is served with one positioned read and one decompression. A SQLite
+offset index maps filenames to (segment, offset, length) and keeps the
+metadata needed for listings, so archived reports never touch the filesystem
+until they are opened. A report's refresh spec (``<name>.json``) is archived
+with it. Recent ("hot") reports stay as loose files.
+"""
+
+import argparse
+import fcntl
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+
+_COLUMNS = (
+    "filename", "segment", "offset", "length", "size", "crc32", "mtime", "title",
+    "archived_at", "refreshable",
+)
+
+_TITLE_RE = re.compile(r"<title>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+_H1_RE = re.compile(r"<h1[^>]*>([^<]+)</h1>", re.IGNORECASE)
+
+
+def extract_title(html: bytes) -> Optional[str]:
+    """Extract the report title from the beginning of an HTML document."""
+    head = html[:2048].decode("utf-8", errors="ignore")
+    match = _TITLE_RE.search(head) or _H1_RE.search(head)
+    return match.group(1).strip() if match else None
+
+
+def _signature(stat: os.stat_result) -> Tuple[int, int, int]:
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def _unchanged(path: Path, signature: Tuple[int, int, int]) -> bool:
+    """Whether a loose file is still the one that was read (not deleted or replaced)."""
+    try:
+        return _signature(path.stat()) == signature
+    except FileNotFoundError:
+        return False
+
+
+class ReportArchive:
+    """
+    Segment files plus a SQLite offset index under ``<reports_dir>/archive``.
+
+    Segments are written to a temporary name and renamed before the index is
+    committed, and loose files are removed only after the commit, so a crash
+    never loses a report (at worst it exists both loose and archived, and the
+    loose copy wins). Compaction holds a file lock on the archive directory,
+    so the server and the command line never compact at the same time.
+
+    A loose file is archived and removed only if it is unchanged since it was
+    read and was not deleted meanwhile: ``delete()`` leaves a tombstone that
+    the commit checks, so a concurrent compaction cannot bring a deleted
+    report back, and a report rewritten by a refresh keeps its new loose copy.
+    """
+
+    def __init__(self, archive_dir: Path, segment_max_bytes: int = DEFAULT_SEGMENT_MAX_BYTES):
+        self.archive_dir = Path(archive_dir)
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        self.segment_max_bytes = segment_max_bytes
+        self._lock = threading.Lock()
+        # Serializes compaction runs (segment writes and removal of unreferenced segments)
+        self._compact_lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.archive_dir / "index.sqlite3"), check_same_thread=False, isolation_level=None
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS archived_reports (
+                filename TEXT PRIMARY KEY,
+                segment TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                crc32 INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                title TEXT,
+                archived_at TEXT NOT NULL,
+                refreshable INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        # Indexes created before refresh specs were archived
+        columns = {
+            row["name"] for row in self._conn.execute("PRAGMA table_info(archived_reports)")
+        }
+        if "refreshable" not in columns:
+            self._conn.execute(
+                "ALTER TABLE archived_reports ADD COLUMN refreshable INTEGER NOT NULL DEFAULT 0"
+            )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS deleted_reports (
+                filename TEXT PRIMARY KEY,
+                deleted_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_archived_reports_mtime ON archived_reports (mtime)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_archived_reports_segment ON archived_reports (segment)"
+        )
+
+    def compact(self, reports_dir: Path, older_than_days: float) -> Dict[str, Any]:
+        """Pack loose ``*.html`` reports (and their refresh specs) older than the given age."""
+        with self._compact_lock, self._process_lock():
+            return self._compact(Path(reports_dir), older_than_days)
+
+    @contextmanager
+    def _process_lock(self):
+        """Exclusive lock on the archive directory, shared with other processes."""
+        with open(self.archive_dir / "compact.lock", "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _compact(self, reports_dir: Path, older_than_days: float) -> Dict[str, Any]:
+        started = time.time()
+        cutoff = started - older_than_days * 86400
+        candidates = []
+        for path in reports_dir.glob("*.html"):
+            try:
+                mtime = path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if mtime < cutoff:
+                candidates.append((mtime, path))
+        candidates.sort()
+        # Specs left loose next to already archived reports (e.g. archives created before
+        # specs were archived) follow their reports into the archive
+        for spec in reports_dir.glob("*.json"):
+            if not spec.with_suffix(".html").exists() and self.info(spec.with_suffix(".html").name):
+                candidates.append((0, spec))
+
+        archived = 0
+        segments = []
+        batch: List[Path] = []
+        batch_bytes = 0
+        for _, path in candidates:
+            spec = path.with_suffix(".json")
+            members = (path, spec) if path.suffix == ".html" and spec.exists() else (path,)
+            for member in members:
+                try:
+                    batch_bytes += member.stat().st_size
+                except FileNotFoundError:
+                    continue
+                batch.append(member)
+            # Sizes are uncompressed, so segments end up well below the limit
+            if batch_bytes >= self.segment_max_bytes:
+                segment, count = self._write_segment(batch)
+                segments.append(segment)
+                archived += count
+                batch, batch_bytes = [], 0
+        if batch:
+            segment, count = self._write_segment(batch)
+            segments.append(segment)
+            archived += count
+        # Also drops segments emptied by deletes or by reports archived again
+        self._remove_unreferenced_segments()
+        # Compaction is exclusive, so later runs read files after this one started
+        with self._lock:
+            self._conn.execute("DELETE FROM deleted_reports WHERE deleted_at < ?", (started,))
+
+        return {
+            "archived": archived,
+            "segments": [s for s in segments if s],
+            "cutoff": datetime.fromtimestamp(cutoff).isoformat(),
+        }
+
+    def _write_segment(self, paths: List[Path]) -> Tuple[Optional[str], int]:
+        """Archive files into a new segment; returns the segment and the number of reports."""
+        name = f"segment-{datetime.now().strftime('%Y%m%d_%H%M%S')}-{uuid.uuid4().hex[:8]}.seg"
+        tmp_path = self.archive_dir / f".{name}.tmp"
+        entries = []
+        sources = []
+        offset = 0
+        with open(tmp_path, "wb") as f:
+            for path in paths:
+                read_at = time.time()
+                try:
+                    with open(path, "rb") as source:
+                        stat = os.fstat(source.fileno())
+                        content = source.read()
+                except FileNotFoundError:
+                    # Deleted while compacting
+                    continue
+                mtime = stat.st_mtime
+                compressed = zlib.compress(content, 6)
+                f.write(compressed)
+                is_report = path.suffix == ".html"
+                entries.append(
+                    (
+                        path.name, name, offset, len(compressed), len(content),
+                        zlib.crc32(content), mtime,
+                        extract_title(content) if is_report else None,
+                        datetime.now().isoformat(),
+                        0,
+                    )
+                )
+                sources.append((path, _signature(stat), read_at))
+                offset += len(compressed)
+            f.flush()
+            os.fsync(f.fileno())
+        if not entries:
+            tmp_path.unlink()
+            return None, 0
+        os.replace(tmp_path, self.archive_dir / name)
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                deleted = dict(
+                    self._conn.execute(
+                        "SELECT filename, deleted_at FROM deleted_reports "
+                        f"WHERE filename IN ({', '.join('?' for _ in entries)})",
+                        [entry[0] for entry in entries],
+                    ).fetchall()
+                )
+                # Skip files deleted or rewritten (e.g. refreshed) since they were read
+                kept = [
+                    (entry, source)
+                    for entry, source in zip(entries, sources)
+                    if deleted.get(entry[0], float("-inf")) < source[2]
+                    and _unchanged(source[0], source[1])
+                ]
+                # A report archived again (e.g. refreshed after archiving) replaces its old entry
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO archived_reports ({', '.join(_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' for _ in _COLUMNS)})",
+                    [entry for entry, _ in kept],
+                )
+                # Reports whose refresh spec is archived can be refreshed
+                self._conn.executemany(
+                    "UPDATE archived_reports SET refreshable = 1 WHERE filename = ?",
+                    [
+                        (str(Path(entry[0]).with_suffix(".html")),)
+                        for entry, _ in kept if entry[0].endswith(".json")
+                    ],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        for _, (path, signature, _) in kept:
+            # A copy written after the commit stays loose and takes precedence
+            if _unchanged(path, signature):
+                path.unlink(missing_ok=True)
+        # A segment with no kept entries is removed with the unreferenced segments
+        reports = sum(1 for entry, _ in kept if entry[0].endswith(".html"))
+        return (name if kept else None), reports
+
+    def get(self, filename: str) -> Optional[bytes]:
+        """Read one archived report with a single positioned read."""
+        entry = self.info(filename)
+        if entry is None:
+            return None
+        fd = os.open(self.archive_dir / entry["segment"], os.O_RDONLY)
+        try:
+            compressed = os.pread(fd, entry["length"], entry["offset"])
+        finally:
+            os.close(fd)
+        content = zlib.decompress(compressed)
+        if zlib.crc32(content) != entry["crc32"]:
+            raise IOError(f"Archived report {filename} is corrupted")
+        return content
+
+    def info(self, filename: str) -> Optional[Dict[str, Any]]:
+        """Get the index entry of an archived report."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM archived_reports WHERE filename = ?", (filename,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def list(
+        self, limit: Optional[int] = None, offset: int = 0, exclude: Iterable[str] = ()
+    ) -> List[Dict[str, Any]]:
+        """Archived reports, newest first, from the index only."""
+        where, params = self._reports_filter(exclude)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT filename, size, mtime, title, refreshable FROM archived_reports "
+                f"WHERE {where} ORDER BY mtime DESC, filename LIMIT ? OFFSET ?",
+                (*params, -1 if limit is None else limit, offset),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete(self, filename: str) -> bool:
+        """Remove a report and its refresh spec from the index; compaction drops old segments.
+
+        Tombstones keep a compaction that already read the files from archiving them again.
+        """
+        names = [filename]
+        if filename.endswith(".html"):
+            names.append(str(Path(filename).with_suffix(".json")))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._conn.execute(
+                    "DELETE FROM archived_reports WHERE filename = ?", (filename,)
+                )
+                deleted = cursor.rowcount > 0
+                self._conn.executemany(
+                    "DELETE FROM archived_reports WHERE filename = ?", [(n,) for n in names[1:]]
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO deleted_reports VALUES (?, ?)",
+                    [(name, time.time()) for name in names],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return deleted
+
+    def count(self, exclude: Iterable[str] = ()) -> int:
+        """Number of archived reports, optionally ignoring some filenames."""
+        where, params = self._reports_filter(exclude)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM archived_reports WHERE {where}", params
+            ).fetchone()[0]
+
+    @staticmethod
+    def _reports_filter(exclude: Iterable[str]):
+        # Refresh specs share the index with the reports but are not listed
+        excluded = list(exclude)
+        where = "filename LIKE '%.html'"
+        if excluded:
+            where += f" AND filename NOT IN ({', '.join('?' for _ in excluded)})"
+        return where, excluded
+
+    def stats(self) -> Dict[str, Any]:
+        """Report and segment counts with stored vs original sizes."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FILTER (WHERE filename LIKE '%.html') AS reports, "
+                "COUNT(DISTINCT segment) AS segments, "
+                "COALESCE(SUM(length), 0) AS stored_bytes, COALESCE(SUM(size), 0) AS original_bytes "
+                "FROM archived_reports"
+            ).fetchone()
+        return dict(row)
+
+    def _remove_unreferenced_segments(self) -> None:
+        # Called while compacting with both locks held, so no segment in this or another
+        # process is between its rename and its index commit
+        with self._lock:
+            referenced = {
+                row["segment"]
+                for row in self._conn.execute("SELECT DISTINCT segment FROM archived_reports")
+            }
+        for path in self.archive_dir.glob("segment-*.seg"):
+            if path.name not in referenced:
+                path.unlink(missing_ok=True)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    """Pack old reports into the archive from the command line."""
+    parser = argparse.ArgumentParser(description="Archive old Auto Analytics reports")
+    parser.add_argument(
+        "--reports-dir",
+        default=os.environ.get("REPORTS_DIR") or Path(__file__).parent.parent / "reports",
+        help="Directory containing reports",
+    )
+    parser.add_argument(
+        "--days",
+        type=float,
+        default=float(os.environ.get("REPORT_RETENTION_DAYS", DEFAULT_RETENTION_DAYS)),
+        help="Archive reports older than this many days",
+    )
+    args = parser.parse_args()
+
+    reports_dir = Path(args.reports_dir)
+    archive = ReportArchive(reports_dir / "archive")
+    try:
+        result = archive.compact(reports_dir, args.days)
+        print(f"📦 Archived {result['archived']} reports into {len(result['segments'])} segment(s)")
+        print(f"📊 Archive: {archive.stats()}")
+    finally:
+        archive.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import asyncio
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+
+from job_queue import JobQueue, JobWorkerPool
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return tmp_path / ".jobs.sqlite3"
+
+
+@pytest.fixture
+def queue(db_path):
+    queue = JobQueue(db_path)
+    yield queue
+    queue.close()
+
+
+@pytest.fixture
+def other(db_path):
+    """A second server process sharing the same queue."""
+    queue = JobQueue(db_path)
+    yield queue
+    queue.close()
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_claim_and_complete(queue):
+    first = queue.enqueue("first question")
+    second = queue.enqueue("second question")
+
+    job = queue.claim_next()
+    assert job["id"] == first["id"]
+    assert job["status"] == "running"
+    assert job["owner"] == queue.owner
+
+    queue.update_stage(job["id"], "data_retrieval")
+    queue.complete(job["id"], "report.html", "done")
+
+    job = queue.get(first["id"])
+    assert job["status"] == "succeeded"
+    assert job["report_filename"] == "report.html"
+    assert [stage["stage"] for stage in job["stages"]] == ["data_retrieval"]
+    assert queue.claim_next()["id"] == second["id"]
+    assert queue.claim_next() is None
+
+
+def test_claim_and_fail(queue):
+    job = queue.enqueue("question")
+    queue.claim_next()
+    queue.fail(job["id"], "boom")
+
+    job = queue.get(job["id"])
+    assert job["status"] == "failed"
+    assert job["error"] == "boom"
+    assert queue.counts() == {"queued": 0, "running": 0, "succeeded": 0, "failed": 1}
+
+
+def test_each_job_is_claimed_once(queue, other):
+    queue.enqueue("question")
+    assert queue.claim_next() is not None
+    assert other.claim_next() is None
+
+
+def test_requeue_leaves_jobs_of_live_processes(queue, other):
+    job = other.enqueue("question")
+    other.claim_next()
+
+    assert queue.requeue_interrupted() == 0
+    assert queue.get(job["id"])["status"] == "running"
+
+
+def test_requeue_jobs_with_stale_heartbeat(db_path, other):
+    job = other.enqueue("question")
+    other.claim_next()
+    queue = JobQueue(db_path, heartbeat_timeout=0.05)
+    try:
+        time.sleep(0.1)
+        assert queue.requeue_interrupted() == 1
+        requeued = queue.get(job["id"])
+        assert requeued["status"] == "queued"
+        assert requeued["owner"] is None
+
+        # The previous owner can no longer finish a job it has lost
+        other.complete(job["id"], "report.html", "done")
+        assert queue.get(job["id"])["status"] == "queued"
+        assert queue.claim_next()["owner"] == queue.owner
+    finally:
+        queue.close()
+
+
+def test_requeue_jobs_of_dead_processes(queue, other):
+    job = other.enqueue("question")
+    other.claim_next()
+    other._conn.execute(
+        "UPDATE jobs SET owner = ? WHERE id = ?",
+        (f"{socket.gethostname()}:{dead_pid()}:restart", job["id"]),
+    )
+
+    assert queue.requeue_interrupted() == 1
+    assert queue.get(job["id"])["status"] == "queued"
+
+
+def test_heartbeat_keeps_jobs_alive(db_path, other):
+    job = other.enqueue("question")
+    other.claim_next()
+    queue = JobQueue(db_path, heartbeat_timeout=0.2)
+    try:
+        time.sleep(0.15)
+        other.heartbeat()
+        time.sleep(0.1)
+        assert queue.requeue_interrupted() == 0
+        assert queue.get(job["id"])["status"] == "running"
+    finally:
+        queue.close()
+
+
+def test_release_requeues_own_jobs_only(queue, other):
+    mine = queue.enqueue("mine")
+    queue.claim_next()
+    theirs = other.enqueue("theirs")
+    other.claim_next()
+
+    assert queue.release() == 1
+    assert queue.get(mine["id"])["status"] == "queued"
+    assert queue.get(theirs["id"])["status"] == "running"
+
+
+def test_opens_queue_without_owner_columns(db_path):
+    conn = sqlite3.connect(str(db_path))
+    conn.execute(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, question TEXT NOT NULL, status TEXT NOT NULL, "
+        "stage TEXT, stages TEXT NOT NULL DEFAULT '[]', report_filename TEXT, response TEXT, "
+        "error TEXT, created_at TEXT NOT NULL, started_at TEXT, finished_at TEXT)"
+    )
+    conn.execute(
+        "INSERT INTO jobs (id, question, status, created_at) "
+        "VALUES ('old', 'question', 'running', '2024-01-01T00:00:00')"
+    )
+    conn.commit()
+    conn.close()
+
+    queue = JobQueue(db_path)
+    try:
+        # Jobs left running before owners were recorded belong to no live process
+        assert queue.requeue_interrupted() == 1
+        assert queue.claim_next()["id"] == "old"
+    finally:
+        queue.close()
+
+
+AGENT = """
+import json, sys
+question = sys.argv[-1]
+print("starting")
+print(json.dumps({"type": "stage", "stage": "data_retrieval"}), flush=True)
+if question == "fail":
+    print(json.dumps({"type": "error", "error": "agent failed"}))
+    sys.exit(1)
+print(json.dumps({"type": "result", "report_filename": "r.html", "response": question}))
+"""
+
+
+def test_worker_pool_runs_jobs(tmp_path, queue):
+    script = tmp_path / "agent.py"
+    script.write_text(AGENT)
+
+    async def run():
+        pool = JobWorkerPool(
+            queue, workers=2, agent_command=f"{sys.executable} {script}", poll_interval=0.05
+        )
+        ok = queue.enqueue("ok")
+        failed = queue.enqueue("fail")
+        pool.start()
+        try:
+            for _ in range(200):
+                if queue.counts()["queued"] == queue.counts()["running"] == 0:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            await pool.stop()
+        return queue.get(ok["id"]), queue.get(failed["id"])
+
+    ok, failed = asyncio.run(run())
+    assert ok["status"] == "succeeded"
+    assert ok["report_filename"] == "r.html"
+    assert ok["response"] == "ok"
+    assert ok["stage"] == "data_retrieval"
+    assert failed["status"] == "failed"
+    assert failed["error"] == "agent failed"
@@ -0,0 +1,192 @@
+import os
+import time
+
+import pytest
+
+import report_archive
+from report_archive import ReportArchive
+
+DAY = 86400
+
+
+def write_report(reports_dir, name, age_days, body="x" * 1000, spec=None):
+    path = reports_dir / name
+    path.write_text(f"<html><head><title>{name} title</title></head><body>{body}</body></html>")
+    mtime = time.time() - age_days * DAY
+    os.utime(path, (mtime, mtime))
+    if spec is not None:
+        spec_path = path.with_suffix(".json")
+        spec_path.write_text(spec)
+        os.utime(spec_path, (mtime, mtime))
+    return path
+
+
+@pytest.fixture
+def reports_dir(tmp_path):
+    return tmp_path
+
+
+@pytest.fixture
+def archive(reports_dir):
+    archive = ReportArchive(reports_dir / "archive")
+    yield archive
+    archive.close()
+
+
+def segments(reports_dir):
+    return sorted(path.name for path in (reports_dir / "archive").glob("segment-*.seg"))
+
+
+def test_compact_archives_only_old_reports(reports_dir, archive):
+    old = write_report(reports_dir, "old.html", 40)
+    content = old.read_bytes()
+    write_report(reports_dir, "new.html", 1)
+
+    result = archive.compact(reports_dir, 30)
+
+    assert result["archived"] == 1
+    assert len(result["segments"]) == 1
+    assert not old.exists()
+    assert (reports_dir / "new.html").exists()
+    assert archive.get("old.html") == content
+    assert archive.get("new.html") is None
+    assert archive.info("old.html")["title"] == "old.html title"
+
+
+def test_compact_archives_refresh_specs(reports_dir, archive):
+    write_report(reports_dir, "a.html", 40, spec='{"queries": []}')
+    write_report(reports_dir, "b.html", 40)
+
+    archive.compact(reports_dir, 30)
+
+    assert not (reports_dir / "a.json").exists()
+    assert archive.get("a.json") == b'{"queries": []}'
+    entries = {entry["filename"]: entry for entry in archive.list()}
+    assert set(entries) == {"a.html", "b.html"}
+    assert entries["a.html"]["refreshable"] == 1
+    assert entries["b.html"]["refreshable"] == 0
+
+
+def test_loose_spec_of_archived_report_is_archived_later(reports_dir, archive):
+    write_report(reports_dir, "a.html", 40)
+    archive.compact(reports_dir, 30)
+    (reports_dir / "a.json").write_text("{}")
+
+    archive.compact(reports_dir, 30)
+
+    assert archive.get("a.json") == b"{}"
+    assert archive.info("a.html")["refreshable"] == 1
+
+
+def test_list_and_count_are_paginated_newest_first(reports_dir, archive):
+    for age in range(40, 45):
+        write_report(reports_dir, f"r{age}.html", age, spec="{}")
+    archive.compact(reports_dir, 30)
+
+    names = [entry["filename"] for entry in archive.list()]
+    assert names == ["r40.html", "r41.html", "r42.html", "r43.html", "r44.html"]
+    assert [e["filename"] for e in archive.list(limit=2, offset=1)] == ["r41.html", "r42.html"]
+    assert [e["filename"] for e in archive.list(exclude=["r40.html"])][0] == "r41.html"
+    assert archive.count() == 5
+    assert archive.count(exclude=["r40.html", "missing.html"]) == 4
+    assert archive.stats()["reports"] == 5
+
+
+def test_delete_removes_report_and_spec(reports_dir, archive):
+    write_report(reports_dir, "a.html", 40, spec="{}")
+    write_report(reports_dir, "b.html", 41)
+    archive.compact(reports_dir, 30)
+    segment = segments(reports_dir)
+
+    assert archive.delete("a.html") is True
+    assert archive.delete("a.html") is False
+    assert archive.get("a.html") is None
+    assert archive.info("a.json") is None
+    assert archive.count() == 1
+    # The segment still holds b.html
+    archive.compact(reports_dir, 30)
+    assert segments(reports_dir) == segment
+
+    archive.delete("b.html")
+    archive.compact(reports_dir, 30)
+    assert segments(reports_dir) == []
+
+
+def test_rearchived_report_replaces_old_entry(reports_dir, archive):
+    write_report(reports_dir, "a.html", 40, body="old")
+    archive.compact(reports_dir, 30)
+    write_report(reports_dir, "a.html", 35, body="refreshed")
+
+    archive.compact(reports_dir, 30)
+
+    assert b"refreshed" in archive.get("a.html")
+    assert archive.count() == 1
+    assert len(segments(reports_dir)) == 1
+
+
+def during_compaction(monkeypatch, action):
+    """Run action after the loose files are read and before the index commit."""
+    fsync = os.fsync
+    done = []
+
+    def hooked(fd):
+        fsync(fd)
+        if not done:
+            done.append(True)
+            action()
+
+    monkeypatch.setattr(report_archive.os, "fsync", hooked)
+
+
+def test_report_deleted_during_compaction_stays_deleted(reports_dir, archive, monkeypatch):
+    path = write_report(reports_dir, "a.html", 40, spec="{}")
+
+    def delete():
+        path.unlink()
+        path.with_suffix(".json").unlink()
+        archive.delete("a.html")
+
+    during_compaction(monkeypatch, delete)
+    result = archive.compact(reports_dir, 30)
+
+    assert result["archived"] == 0
+    assert archive.info("a.html") is None
+    assert archive.info("a.json") is None
+    assert segments(reports_dir) == []
+
+
+def test_report_rewritten_during_compaction_keeps_new_copy(reports_dir, archive, monkeypatch):
+    path = write_report(reports_dir, "a.html", 40, body="old")
+
+    def refresh():
+        tmp_path = reports_dir / ".a.html.tmp"
+        tmp_path.write_text("<title>a</title>refreshed")
+        os.replace(tmp_path, path)
+
+    during_compaction(monkeypatch, refresh)
+    archive.compact(reports_dir, 30)
+
+    assert path.read_text() == "<title>a</title>refreshed"
+    assert archive.info("a.html") is None
+
+
+def test_tombstones_are_pruned_by_later_compactions(reports_dir, archive):
+    archive.delete("a.html")
+    archive.compact(reports_dir, 30)
+
+    write_report(reports_dir, "a.html", 40)
+    archive.compact(reports_dir, 30)
+
+    assert archive.info("a.html") is not None
+
+
+def test_corrupted_segment_is_detected(reports_dir, archive):
+    write_report(reports_dir, "a.html", 40)
+    archive.compact(reports_dir, 30)
+    entry = archive.info("a.html")
+    with open(reports_dir / "archive" / entry["segment"], "r+b") as f:
+        f.seek(entry["offset"])
+        f.write(os.urandom(entry["length"]))
+
+    with pytest.raises(Exception):
+        archive.get("a.html")
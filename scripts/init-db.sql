@@ -2,6 +2,10 @@
 -- POS会員証システム用テストデータ
 
 -- テーブル削除（存在する場合）
+-- ロールアップのビューは元テーブルに依存するため先に削除する（scripts/rollups.sql で再作成）
+DROP VIEW IF EXISTS sales_daily_store_category, sales_daily_member_rank;
+-- 近似クエリ用のサンプルは元テーブルの主キーで差分更新するため作り直す（scripts/samples.sql で再作成）
+DROP TABLE IF EXISTS sample_tables, transaction_items_sample, transactions_sample;
 DROP TABLE IF EXISTS transaction_items;
 DROP TABLE IF EXISTS transactions;
 DROP TABLE IF EXISTS products;
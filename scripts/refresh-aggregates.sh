@@ -0,0 +1,63 @@
+#!/bin/sh
+
+# Auto Analytics Aggregate Refresh
+# Periodically folds new transactions into the rollup and sample tables so that
+# the live (not yet aggregated or sampled) part of their views stays small.
+#
+# Each incremental run also re-aggregates the last ROLLUP_LOOKBACK_DAYS settled
+# days, so refunds and late inserts on recent dates reach the rollups. Older
+# corrections are picked up by a full rebuild every FULL_REFRESH_INTERVAL_SECONDS
+# (0 disables it).
+#
+# Runs as the aggregate-refresh service in .devcontainer/docker-compose.yml, or
+# once from cron:
+#   */15 * * * * PGHOST=... PGUSER=... PGDATABASE=... scripts/refresh-aggregates.sh --once
+#   0 3 * * *    PGHOST=... PGUSER=... PGDATABASE=... scripts/refresh-aggregates.sh --once --full
+#
+# Connection settings come from the standard PGHOST / PGPORT / PGDATABASE /
+# PGUSER / PGPASSWORD environment variables.
+
+set -u
+
+INTERVAL="${REFRESH_INTERVAL_SECONDS:-900}"
+LOOKBACK_DAYS="${ROLLUP_LOOKBACK_DAYS:-7}"
+FULL_INTERVAL="${FULL_REFRESH_INTERVAL_SECONDS:-86400}"
+
+# $1: "full" rebuilds the rollups from scratch
+refresh() {
+    if [ "${1:-}" = "full" ]; then
+        echo "🔄 $(date '+%Y-%m-%d %H:%M:%S') Rebuilding aggregates..."
+        rollups="SELECT * FROM refresh_rollups(TRUE);"
+    else
+        echo "🔄 $(date '+%Y-%m-%d %H:%M:%S') Refreshing aggregates..."
+        rollups="SELECT * FROM refresh_rollups(FALSE, ${LOOKBACK_DAYS});"
+    fi
+    psql -X -q -v ON_ERROR_STOP=1 \
+        -c "$rollups" \
+        -c "SELECT * FROM refresh_samples();"
+}
+
+if [ "${1:-}" = "--once" ]; then
+    if [ "${2:-}" = "--full" ]; then
+        refresh full
+    else
+        refresh
+    fi
+    exit $?
+fi
+
+echo "⏱️ Refreshing aggregates every ${INTERVAL}s (full rebuild every ${FULL_INTERVAL}s)"
+last_full=$(date +%s)
+while true; do
+    now=$(date +%s)
+    if [ "$FULL_INTERVAL" -gt 0 ] && [ $((now - last_full)) -ge "$FULL_INTERVAL" ]; then
+        if refresh full; then
+            last_full=$now
+        else
+            echo "⚠️ Aggregate rebuild failed; retrying in ${INTERVAL}s"
+        fi
+    else
+        refresh || echo "⚠️ Aggregate refresh failed; retrying in ${INTERVAL}s"
+    fi
+    sleep "$INTERVAL"
+done
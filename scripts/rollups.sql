@@ -0,0 +1,194 @@
+-- Auto Analytics Rollup Tables
+-- transactions / transaction_items を日次で事前集計したロールアップテーブル
+--
+-- 既存のデータベースにも繰り返し適用できる:
+--   psql -f scripts/rollups.sql
+-- 定期的な差分更新（集計済みの直近 lookback_days 日も再集計する）:
+--   SELECT * FROM refresh_rollups();
+--   SELECT * FROM refresh_rollups(lookback_days => 30);
+-- それより前の日付のデータ修正（返品・遅延登録など）を反映する全件再集計:
+--   SELECT * FROM refresh_rollups(TRUE);
+
+-- ロールアップごとの集計済み範囲（ウォーターマーク）
+CREATE TABLE IF NOT EXISTS rollup_watermarks (
+    rollup_name VARCHAR(50) PRIMARY KEY,
+    watermark TIMESTAMP,          -- 集計時点の transaction_date の最大値
+    covered_until DATE,           -- この日付より前の日は集計が確定している
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 日次 × 店舗 × 商品カテゴリ × 取引ステータス（明細単位）
+CREATE TABLE IF NOT EXISTS rollup_daily_store_category (
+    sales_date DATE NOT NULL,
+    store_id INTEGER,
+    category VARCHAR(50) NOT NULL,
+    status VARCHAR(20),
+    item_count BIGINT NOT NULL,
+    item_quantity BIGINT NOT NULL,
+    sales_amount DECIMAL(14,2) NOT NULL,
+    discount_amount DECIMAL(14,2)   -- 元の列が NULL 可のため集計値も NULL になりうる
+);
+
+-- 日次 × 店舗 × 会員ランク × 取引ステータス（取引単位）
+-- 非会員の取引は is_member が FALSE（member_rank が NULL の会員と区別する）
+CREATE TABLE IF NOT EXISTS rollup_daily_member_rank (
+    sales_date DATE NOT NULL,
+    store_id INTEGER,
+    member_rank VARCHAR(20),
+    status VARCHAR(20),
+    transaction_count BIGINT NOT NULL,
+    subtotal_amount DECIMAL(14,2) NOT NULL,
+    tax_amount DECIMAL(14,2) NOT NULL,
+    discount_amount DECIMAL(14,2),
+    total_amount DECIMAL(14,2) NOT NULL,
+    points_used BIGINT,
+    points_earned BIGINT,
+    is_member BOOLEAN
+);
+
+-- 既存のテーブルも NULL 可の列の集計値（すべて NULL の場合は NULL）を保存できるようにする
+ALTER TABLE rollup_daily_store_category ALTER COLUMN discount_amount DROP NOT NULL;
+ALTER TABLE rollup_daily_member_rank ALTER COLUMN discount_amount DROP NOT NULL;
+ALTER TABLE rollup_daily_member_rank ALTER COLUMN points_used DROP NOT NULL;
+ALTER TABLE rollup_daily_member_rank ALTER COLUMN points_earned DROP NOT NULL;
+
+-- is_member 追加前に作成したロールアップは全件を再集計する
+ALTER TABLE rollup_daily_member_rank ADD COLUMN IF NOT EXISTS is_member BOOLEAN;
+DELETE FROM rollup_watermarks w
+WHERE w.rollup_name = 'daily_member_rank'
+  AND EXISTS (SELECT 1 FROM rollup_daily_member_rank r WHERE r.is_member IS NULL);
+
+CREATE INDEX IF NOT EXISTS idx_rollup_store_category_date ON rollup_daily_store_category(sales_date);
+CREATE INDEX IF NOT EXISTS idx_rollup_member_rank_date ON rollup_daily_member_rank(sales_date);
+
+-- 差分更新: covered_until の lookback_days 日前以降の日を削除して再集計する
+-- 集計済みの日に後から入った返品や遅延登録も、この期間内であれば反映される
+DROP FUNCTION IF EXISTS refresh_rollups(BOOLEAN);
+CREATE OR REPLACE FUNCTION refresh_rollups(
+    full_refresh BOOLEAN DEFAULT FALSE, lookback_days INTEGER DEFAULT 7)
+RETURNS TABLE (rollup_name VARCHAR, refreshed_from DATE, rows_written BIGINT, watermark TIMESTAMP)
+LANGUAGE plpgsql AS $$
+DECLARE
+    start_day DATE;
+    max_date TIMESTAMP;
+    written BIGINT;
+BEGIN
+    -- 同時実行による二重集計を防ぐ
+    PERFORM pg_advisory_xact_lock(hashtext('refresh_rollups'));
+
+    SELECT MAX(t.transaction_date) INTO max_date FROM transactions t;
+
+    -- daily_store_category
+    SELECT w.covered_until INTO start_day
+    FROM rollup_watermarks w WHERE w.rollup_name = 'daily_store_category';
+    IF full_refresh OR start_day IS NULL THEN
+        start_day := '-infinity';
+    ELSE
+        start_day := start_day - GREATEST(lookback_days, 0);
+    END IF;
+
+    DELETE FROM rollup_daily_store_category r WHERE r.sales_date >= start_day;
+    INSERT INTO rollup_daily_store_category
+    SELECT t.transaction_date::date, t.store_id, p.category, t.status,
+           COUNT(*), SUM(ti.quantity), SUM(ti.subtotal), SUM(ti.discount_amount)
+    FROM transaction_items ti
+    JOIN transactions t ON ti.transaction_id = t.transaction_id
+    JOIN products p ON ti.product_id = p.product_id
+    WHERE t.transaction_date >= start_day
+    GROUP BY 1, 2, 3, 4;
+    GET DIAGNOSTICS written = ROW_COUNT;
+
+    INSERT INTO rollup_watermarks AS w (rollup_name, watermark, covered_until, refreshed_at)
+    VALUES ('daily_store_category', max_date, max_date::date, CURRENT_TIMESTAMP)
+    ON CONFLICT ON CONSTRAINT rollup_watermarks_pkey DO UPDATE
+    SET watermark = EXCLUDED.watermark, covered_until = EXCLUDED.covered_until,
+        refreshed_at = EXCLUDED.refreshed_at;
+
+    rollup_name := 'daily_store_category';
+    refreshed_from := CASE WHEN start_day = '-infinity' THEN NULL ELSE start_day END;
+    rows_written := written;
+    watermark := max_date;
+    RETURN NEXT;
+
+    -- daily_member_rank
+    SELECT w.covered_until INTO start_day
+    FROM rollup_watermarks w WHERE w.rollup_name = 'daily_member_rank';
+    IF full_refresh OR start_day IS NULL THEN
+        start_day := '-infinity';
+    ELSE
+        start_day := start_day - GREATEST(lookback_days, 0);
+    END IF;
+
+    DELETE FROM rollup_daily_member_rank r WHERE r.sales_date >= start_day;
+    INSERT INTO rollup_daily_member_rank (
+        sales_date, store_id, member_rank, status, transaction_count, subtotal_amount,
+        tax_amount, discount_amount, total_amount, points_used, points_earned, is_member)
+    SELECT t.transaction_date::date, t.store_id, m.member_rank, t.status,
+           COUNT(*), SUM(t.subtotal), SUM(t.tax_amount), SUM(t.discount_amount),
+           SUM(t.total_amount), SUM(t.points_used), SUM(t.points_earned),
+           m.member_id IS NOT NULL
+    FROM transactions t
+    LEFT JOIN members m ON t.member_id = m.member_id
+    WHERE t.transaction_date >= start_day
+    GROUP BY 1, 2, 3, 4, 12;
+    GET DIAGNOSTICS written = ROW_COUNT;
+
+    INSERT INTO rollup_watermarks AS w (rollup_name, watermark, covered_until, refreshed_at)
+    VALUES ('daily_member_rank', max_date, max_date::date, CURRENT_TIMESTAMP)
+    ON CONFLICT ON CONSTRAINT rollup_watermarks_pkey DO UPDATE
+    SET watermark = EXCLUDED.watermark, covered_until = EXCLUDED.covered_until,
+        refreshed_at = EXCLUDED.refreshed_at;
+
+    rollup_name := 'daily_member_rank';
+    refreshed_from := CASE WHEN start_day = '-infinity' THEN NULL ELSE start_day END;
+    rows_written := written;
+    watermark := max_date;
+    RETURN NEXT;
+END;
+$$;
+
+-- クエリのルーティング先となるビュー
+-- 集計が確定している日はロールアップを、それ以降の日は元テーブルを集計して結合する。
+-- covered_until 以降の日は常に元テーブルと同じ結果を返すが、それより前の日は最後に
+-- 再集計した時点の値になる（直近 lookback_days 日は差分更新ごとに、それより前は
+-- refresh_rollups(TRUE) で元テーブルに揃う）
+CREATE OR REPLACE VIEW sales_daily_store_category AS
+SELECT r.sales_date, r.store_id, r.category, r.status,
+       r.item_count, r.item_quantity, r.sales_amount, r.discount_amount
+FROM rollup_daily_store_category r
+WHERE r.sales_date < COALESCE(
+    (SELECT w.covered_until FROM rollup_watermarks w WHERE w.rollup_name = 'daily_store_category'),
+    '-infinity'::date)
+UNION ALL
+SELECT t.transaction_date::date, t.store_id, p.category, t.status,
+       COUNT(*), SUM(ti.quantity), SUM(ti.subtotal), SUM(ti.discount_amount)
+FROM transaction_items ti
+JOIN transactions t ON ti.transaction_id = t.transaction_id
+JOIN products p ON ti.product_id = p.product_id
+WHERE t.transaction_date >= COALESCE(
+    (SELECT w.covered_until FROM rollup_watermarks w WHERE w.rollup_name = 'daily_store_category'),
+    '-infinity'::date)
+GROUP BY 1, 2, 3, 4;
+
+CREATE OR REPLACE VIEW sales_daily_member_rank AS
+SELECT r.sales_date, r.store_id, r.member_rank, r.status,
+       r.transaction_count, r.subtotal_amount, r.tax_amount, r.discount_amount,
+       r.total_amount, r.points_used, r.points_earned, r.is_member
+FROM rollup_daily_member_rank r
+WHERE r.sales_date < COALESCE(
+    (SELECT w.covered_until FROM rollup_watermarks w WHERE w.rollup_name = 'daily_member_rank'),
+    '-infinity'::date)
+UNION ALL
+SELECT t.transaction_date::date, t.store_id, m.member_rank, t.status,
+       COUNT(*), SUM(t.subtotal), SUM(t.tax_amount), SUM(t.discount_amount),
+       SUM(t.total_amount), SUM(t.points_used), SUM(t.points_earned),
+       m.member_id IS NOT NULL
+FROM transactions t
+LEFT JOIN members m ON t.member_id = m.member_id
+WHERE t.transaction_date >= COALESCE(
+    (SELECT w.covered_until FROM rollup_watermarks w WHERE w.rollup_name = 'daily_member_rank'),
+    '-infinity'::date)
+GROUP BY 1, 2, 3, 4, 12;
+
+-- 初回集計
+SELECT * FROM refresh_rollups();
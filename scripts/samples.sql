@@ -0,0 +1,118 @@
+-- Auto Analytics Sample Tables
+-- 近似クエリモード（探索的な集計）用にファクトテーブルの一様サンプルを保持する
+--
+-- 各行は主キーのハッシュ値が fraction 未満の場合にサンプルに含まれる（ベルヌーイ抽出）。
+-- 抽出は決定的なので、新しい行だけを追加する差分更新でも同じ抽出率が保たれる。
+--
+-- 既存のデータベースにも繰り返し適用できる:
+--   psql -f scripts/samples.sql
+-- 定期的な差分更新:
+--   SELECT * FROM refresh_samples();
+-- 近似クエリは sampled_* ビューを集計する。取り込み済みの範囲はサンプル行を 1 / fraction 倍、
+-- 前回の更新後に追加された行は元テーブルから 1 倍で数えるため、更新前でも推定は偏らない。
+-- 既存行の更新（ステータス変更など）や抽出率の変更を反映する全件再作成:
+--   UPDATE sample_tables SET fraction = 0.05 WHERE table_name = 'transaction_items';
+--   SELECT * FROM refresh_samples(TRUE);
+
+-- サンプル対象のテーブルと抽出率
+CREATE TABLE IF NOT EXISTS sample_tables (
+    table_name VARCHAR(50) PRIMARY KEY,
+    sample_table VARCHAR(50) NOT NULL,
+    key_column VARCHAR(50) NOT NULL,
+    fraction DOUBLE PRECISION NOT NULL CHECK (fraction > 0 AND fraction <= 1),
+    last_key BIGINT,              -- サンプルに取り込み済みの主キーの最大値
+    sample_rows BIGINT,
+    refreshed_at TIMESTAMP
+);
+
+INSERT INTO sample_tables (table_name, sample_table, key_column, fraction) VALUES
+('transaction_items', 'transaction_items_sample', 'item_id', 0.01),
+('transactions', 'transactions_sample', 'transaction_id', 0.01)
+ON CONFLICT (table_name) DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS transaction_items_sample (LIKE transaction_items);
+CREATE TABLE IF NOT EXISTS transactions_sample (LIKE transactions);
+
+CREATE INDEX IF NOT EXISTS idx_transaction_items_sample_transaction ON transaction_items_sample(transaction_id);
+CREATE INDEX IF NOT EXISTS idx_transaction_items_sample_product ON transaction_items_sample(product_id);
+CREATE INDEX IF NOT EXISTS idx_transactions_sample_date ON transactions_sample(transaction_date);
+
+-- 主キーを [0, 1) の擬似乱数に写像する
+CREATE OR REPLACE FUNCTION sample_hash(key BIGINT)
+RETURNS DOUBLE PRECISION
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT (hashtext('sample:' || key::text)::bigint + 2147483648) / 4294967296.0
+$$;
+
+-- 近似クエリで推定値の補正に使用する抽出率
+CREATE OR REPLACE FUNCTION sample_fraction(source_table VARCHAR)
+RETURNS DOUBLE PRECISION
+LANGUAGE sql STABLE AS $$
+    SELECT s.fraction FROM sample_tables s WHERE s.table_name = source_table
+$$;
+
+-- 差分更新: last_key より新しい行のうち抽出対象の行を追加する
+CREATE OR REPLACE FUNCTION refresh_samples(full_refresh BOOLEAN DEFAULT FALSE)
+RETURNS TABLE (table_name VARCHAR, rows_added BIGINT, sample_rows BIGINT, fraction DOUBLE PRECISION)
+LANGUAGE plpgsql AS $$
+DECLARE
+    spec RECORD;
+    added BIGINT;
+    max_key BIGINT;
+BEGIN
+    -- 同時実行による重複挿入を防ぐ
+    PERFORM pg_advisory_xact_lock(hashtext('refresh_samples'));
+
+    FOR spec IN SELECT * FROM sample_tables s ORDER BY s.table_name LOOP
+        IF full_refresh OR spec.last_key IS NULL THEN
+            EXECUTE format('TRUNCATE %I', spec.sample_table);
+            spec.last_key := NULL;
+        END IF;
+
+        EXECUTE format('SELECT MAX(%I) FROM %I', spec.key_column, spec.table_name) INTO max_key;
+        EXECUTE format(
+            'INSERT INTO %I SELECT * FROM %I WHERE %I > $1 AND %I <= $2 AND sample_hash(%I) < $3',
+            spec.sample_table, spec.table_name, spec.key_column, spec.key_column, spec.key_column
+        ) USING COALESCE(spec.last_key, -1), COALESCE(max_key, -1), spec.fraction;
+        GET DIAGNOSTICS added = ROW_COUNT;
+
+        EXECUTE format('SELECT COUNT(*) FROM %I', spec.sample_table) INTO sample_rows;
+        UPDATE sample_tables s
+        SET last_key = COALESCE(max_key, spec.last_key), sample_rows = refresh_samples.sample_rows,
+            refreshed_at = CURRENT_TIMESTAMP
+        WHERE s.table_name = spec.table_name;
+
+        table_name := spec.table_name;
+        rows_added := added;
+        fraction := spec.fraction;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$;
+
+-- 近似クエリの集計対象
+-- sample_weight は各行の抽出確率の逆数（Horvitz-Thompson 推定の重み）
+CREATE OR REPLACE VIEW sampled_transaction_items AS
+SELECT s.*, (1 / c.fraction)::NUMERIC AS sample_weight
+FROM transaction_items_sample s
+JOIN sample_tables c ON c.table_name = 'transaction_items'
+WHERE s.item_id <= c.last_key
+UNION ALL
+SELECT t.*, 1::NUMERIC
+FROM transaction_items t
+JOIN sample_tables c ON c.table_name = 'transaction_items'
+WHERE t.item_id > COALESCE(c.last_key, -1);
+
+CREATE OR REPLACE VIEW sampled_transactions AS
+SELECT s.*, (1 / c.fraction)::NUMERIC AS sample_weight
+FROM transactions_sample s
+JOIN sample_tables c ON c.table_name = 'transactions'
+WHERE s.transaction_id <= c.last_key
+UNION ALL
+SELECT t.*, 1::NUMERIC
+FROM transactions t
+JOIN sample_tables c ON c.table_name = 'transactions'
+WHERE t.transaction_id > COALESCE(c.last_key, -1);
+
+-- 初回作成
+SELECT * FROM refresh_samples();
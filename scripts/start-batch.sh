@@ -0,0 +1,31 @@
+#!/bin/bash
+
+# Auto Analytics Batch Runner
+# This script runs analyses for a file of questions without the ADK web UI
+#
+# Usage: scripts/start-batch.sh questions.txt [--workers 4] [--gemini-rpm 60] [--db-concurrency 2]
+
+set -e
+
+# Get the workspace root directory
+WORKSPACE_ROOT="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
+cd "$WORKSPACE_ROOT"
+
+if [ $# -lt 1 ]; then
+    echo "Usage: $0 <questions file> [options]"
+    echo "Run '$0 --help' for all options"
+    exit 1
+fi
+
+echo "🤖 Starting Auto Analytics Batch Runner..."
+echo "📁 Workspace: $WORKSPACE_ROOT"
+echo "💡 Reports will be generated to: $WORKSPACE_ROOT/reports/"
+echo ""
+
+if command -v uv &> /dev/null; then
+    uv run python -m auto-analytics-agent.batch "$@"
+else
+    echo "❌ Error: uv is not installed"
+    echo "Please install uv first: https://docs.astral.sh/uv/"
+    exit 1
+fi
@@ -0,0 +1,30 @@
+import importlib
+
+import pytest
+
+
+@pytest.fixture
+def db():
+    """
+    分析用PostgreSQL（scripts/*.sql 適用済み）への接続
+
+    DB_HOST などの環境変数で接続し、接続できない場合はスキップする。
+    テスト中の変更はすべてロールバックする。
+    """
+    report_refresh = importlib.import_module("auto-analytics-agent.utils.report_refresh")
+    try:
+        connection = report_refresh._connect()
+    except Exception as e:
+        pytest.skip(f"database unavailable: {e}")
+    try:
+        yield connection
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def fetch(connection, sql):
+    """(行, 列の型OID) を返す"""
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        return cursor.fetchall(), [column.type_code for column in cursor.description]
@@ -0,0 +1,57 @@
+import importlib
+
+import pytest
+
+analysis_index = importlib.import_module("auto-analytics-agent.utils.analysis_index")
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = analysis_index.AnalysisIndex(tmp_path / ".analysis_index.jsonl")
+    index.add(
+        "2024年1月の店舗別の売上を分析して",
+        sql=["SELECT store_id, SUM(total_amount) FROM transactions GROUP BY store_id"],
+        report_filename="analysis_report_a.html",
+    )
+    index.add(
+        "店舗別の売上推移を分析して",
+        sql=["SELECT store_id, SUM(total_amount) FROM transactions GROUP BY 1"],
+    )
+    return index
+
+
+def test_different_period_is_not_reused(index):
+    question = "2024年3月の店舗別の売上を分析して"
+    assert index.search(question, 1)[0]["question"] == "2024年1月の店舗別の売上を分析して"
+    assert analysis_index.find_reusable_analysis(question, index)["action"] == "none"
+
+
+def test_different_measure_is_not_reused(index):
+    result = analysis_index.find_reusable_analysis("店舗別の在庫推移を分析して", index)
+    assert result["action"] == "none"
+
+
+def test_opposite_direction_is_not_reused(index):
+    index.add(
+        "会員ランク別の売上上位10商品",
+        sql=["SELECT product_id, SUM(subtotal) FROM transaction_items GROUP BY 1 ORDER BY 2 DESC LIMIT 10"],
+    )
+    question = "会員ランク別の売上下位10商品"
+    assert index.search(question, 1)[0]["question"] == "会員ランク別の売上上位10商品"
+    assert analysis_index.find_reusable_analysis(question, index)["action"] == "none"
+    assert analysis_index.find_reusable_analysis(
+        "会員ランク別の売上上位10商品", index
+    )["action"] == "reuse_sql"
+
+
+def test_same_constraints_reuse_sql(index):
+    result = analysis_index.find_reusable_analysis("2024年1月の店舗別売上を分析して", index)
+    # レポートファイルがないためSQLのみを再利用する
+    assert result["action"] == "reuse_sql"
+    assert result["match"]["report_filename"] == "analysis_report_a.html"
+
+
+def test_question_constraints_normalize_width():
+    assert analysis_index.question_constraints("２０２４年１月の売上") == (
+        analysis_index.question_constraints("2024年1月の売上")
+    )
@@ -0,0 +1,116 @@
+import importlib
+
+import pytest
+
+from conftest import fetch
+
+approximate_query = importlib.import_module("auto-analytics-agent.utils.approximate_query")
+
+ITEMS_JOIN = (
+    "FROM transaction_items ti JOIN transactions t ON ti.transaction_id = t.transaction_id "
+    "JOIN products p ON ti.product_id = p.product_id"
+)
+
+APPROXIMATED = [
+    f"SELECT p.category, SUM(ti.subtotal) AS sales, COUNT(*) n, ROUND(AVG(ti.quantity), 2) AS q "
+    f"{ITEMS_JOIN} WHERE t.status = 'Completed' GROUP BY p.category "
+    "HAVING SUM(ti.subtotal) > 0 ORDER BY sales DESC",
+    "SELECT payment_method, SUM(total_amount), AVG(total_amount), COUNT(discount_amount) "
+    "FROM transactions GROUP BY 1 ORDER BY 1",
+    "SELECT SUM(total_amount) AS total FROM transactions WHERE transaction_date >= '2024-12-01'",
+]
+
+NOT_APPROXIMATED = [
+    "SELECT store_id, MAX(total_amount) FROM transactions GROUP BY 1",
+    "SELECT COUNT(DISTINCT member_id) FROM transactions",
+    "SELECT * FROM transaction_items",
+    "SELECT name, COUNT(*) FROM members GROUP BY 1",
+    "SELECT SUM(a.total_amount) FROM transactions a JOIN transactions b ON a.member_id = b.member_id",
+    "SELECT m.member_rank, COUNT(*) FROM members m "
+    "LEFT JOIN transactions t ON t.member_id = m.member_id GROUP BY 1",
+]
+
+
+@pytest.mark.parametrize("sql", APPROXIMATED)
+def test_rewrites_scalable_aggregates(sql):
+    approximated = approximate_query.approximate_query(sql)
+    assert approximated is not None
+    assert "sampled_" in approximated
+    assert "sample_weight" in approximated
+
+
+@pytest.mark.parametrize("sql", NOT_APPROXIMATED)
+def test_leaves_unscalable_queries_unchanged(sql):
+    assert approximate_query.approximate_query(sql) is None
+
+
+def test_adds_confidence_bounds_and_sample_rows():
+    approximated = approximate_query.approximate_query(
+        "SELECT store_id, SUM(total_amount) AS total FROM transactions GROUP BY store_id"
+    )
+    assert "AS total_ci_low" in approximated
+    assert "AS total_ci_high" in approximated
+    assert "COUNT(*) AS sample_rows" in approximated
+    assert "'Completed'" not in approximated
+
+
+@pytest.fixture
+def sample_db(db):
+    rows, _ = fetch(db, "SELECT to_regclass('sampled_transactions') IS NOT NULL")
+    if not rows[0][0]:
+        pytest.skip("scripts/samples.sql is not applied")
+    return db
+
+
+def _estimates(connection, sql):
+    rows, _ = fetch(connection, approximate_query.approximate_query(sql))
+    return rows
+
+
+@pytest.mark.parametrize("sql", APPROXIMATED)
+def test_approximated_queries_run(sample_db, sql):
+    rows, _ = fetch(sample_db, approximate_query.approximate_query(sql))
+    assert rows
+
+
+def test_full_sample_matches_exact_result(sample_db):
+    # 抽出率 1 では推定値が正確な集計と一致し、誤差幅は 0 になる
+    with sample_db.cursor() as cursor:
+        cursor.execute("UPDATE sample_tables SET fraction = 1")
+        cursor.execute("SELECT * FROM refresh_samples(TRUE)")
+    sql = (
+        "SELECT payment_method, SUM(total_amount) AS total, COUNT(*) AS n, "
+        "AVG(total_amount) AS mean FROM transactions GROUP BY 1 ORDER BY 1"
+    )
+    exact, _ = fetch(sample_db, sql)
+    estimates = _estimates(sample_db, sql)
+    assert [row[0] for row in estimates] == [row[0] for row in exact]
+    for (_, total, n, mean), row in zip(exact, estimates):
+        expected = [float(total), n, float(mean)]
+        assert [float(value) for value in row[1:4]] == pytest.approx(expected)
+        # 信頼区間: (total_low, total_high, n_low, n_high, mean_low, mean_high)
+        bounds = [float(total)] * 2 + [n] * 2 + [float(mean)] * 2
+        assert [float(value) for value in row[4:10]] == pytest.approx(bounds)
+
+
+def test_rows_added_after_refresh_are_counted_exactly(sample_db):
+    with sample_db.cursor() as cursor:
+        cursor.execute("SELECT * FROM refresh_samples()")
+        cursor.execute(
+            "INSERT INTO transactions (transaction_code, store_id, transaction_date, subtotal, "
+            "tax_amount, total_amount, payment_method) "
+            "SELECT 'TEST-APPROX-' || i, 1, "
+            "(SELECT MAX(transaction_date) FROM transactions) + interval '1 day', "
+            "100, 10, 110, 'cash' FROM generate_series(1, 3) i"
+        )
+        cursor.execute("SELECT MAX(transaction_date)::date FROM transactions")
+        day = cursor.fetchone()[0]
+    # サンプル更新後の日付だけを対象にした集計も空にならない
+    rows = _estimates(
+        sample_db,
+        "SELECT SUM(total_amount) AS total, COUNT(*) AS n FROM transactions "
+        f"WHERE transaction_date >= '{day}'",
+    )
+    total, n, total_low, total_high, n_low, n_high, sample_rows = rows[0]
+    assert (total, n, sample_rows) == (330, 3, 3)
+    assert [float(v) for v in (total_low, total_high, n_low, n_high)] == [330, 330, 3, 3]
@@ -0,0 +1,119 @@
+import asyncio
+import importlib
+import json
+from types import SimpleNamespace
+
+compaction = importlib.import_module("auto-analytics-agent.utils.context_compaction")
+query_log = importlib.import_module("auto-analytics-agent.utils.query_log")
+
+SQL = (
+    "SELECT p.category, SUM(ti.subtotal) AS sales\n"
+    "FROM transaction_items ti JOIN products p ON ti.product_id = p.product_id\n"
+    "GROUP BY p.category ORDER BY sales DESC"
+)
+
+
+def test_extract_sql_stops_before_markdown_prose():
+    text = f"**1. sql**: {SQL}\n**2. sql_results**: 食品が最も多い"
+    assert compaction.extract_sql(text) == [SQL]
+
+
+def test_extract_sql_stops_before_japanese_line():
+    text = f"sql:\n{SQL}\n売上は食品カテゴリが最大です。"
+    assert compaction.extract_sql(text) == [SQL]
+
+
+def test_extract_sql_reads_dict_fields():
+    output = {"sql": SQL, "sql_results": [{"category": "食品", "sales": 100}]}
+    assert compaction.extract_sql(compaction._to_text(output), output) == [SQL]
+
+
+def test_summary_never_truncates_sql():
+    # 予算（20トークン）を超えるSQLもそのまま残す
+    summary = compaction.summarize_output("data_retrieval", "結果" * 500, 20, sql=[SQL, SQL + " LIMIT 10"])
+    assert summary["sql"] == [SQL, SQL + " LIMIT 10"]
+
+
+class _Context(SimpleNamespace):
+    """artifactをメモリに保存するToolContextの代わり"""
+
+    async def save_artifact(self, filename, part):
+        versions = self.artifacts.setdefault(filename, [])
+        versions.append(part)
+        return len(versions) - 1
+
+    async def load_artifact(self, filename, version=None):
+        versions = self.artifacts.get(filename) or [None]
+        return versions[-1 if version is None else version]
+
+
+def _context(state, artifacts=None):
+    return _Context(
+        state=state, function_call_id="call-1",
+        artifacts={} if artifacts is None else artifacts,
+    )
+
+
+def _tool():
+    return SimpleNamespace(name="execute-query")
+
+
+def test_query_log_records_original_sql_and_rows():
+    state = {}
+    args = {"query": SQL + ";"}
+    query_log.record_query_callback(_tool(), args, _context(state))
+    # ロールアップへの書き換え後も記録するのは元のSQL
+    args["query"] = "SELECT rewritten FROM rollup"
+    response = {
+        "content": [
+            {"type": "text", "text": '{"category": "食品", "sales": "100.00"}'},
+            {"type": "text", "text": '{"category": "飲料", "sales": "50.00"}'},
+        ],
+        "isError": False,
+    }
+    context = _context(state)
+    asyncio.run(query_log.record_result_callback(_tool(), args, context, response))
+    # stateには行を置かず、artifactへの参照と行数のみを残す
+    [query] = query_log.executed_queries(state)
+    assert query["sql"] == SQL + ";"
+    assert query["row_count"] == 2
+    assert "rows" not in json.dumps(state)
+    [query] = asyncio.run(query_log.load_query_results(context, [query]))
+    assert query["columns"] == ["category", "sales"]
+    assert query["rows"] == [["食品", "100.00"], ["飲料", "50.00"]]
+
+
+def test_query_log_without_artifact_service_keeps_no_rows():
+    class NoArtifacts(_Context):
+        async def save_artifact(self, filename, part):
+            raise ValueError("Artifact service is not initialized.")
+
+    state = {}
+    context = NoArtifacts(state=state, function_call_id="call-1", artifacts={})
+    query_log.record_query_callback(_tool(), {"query": SQL}, context)
+    asyncio.run(query_log.record_result_callback(
+        _tool(), {"query": SQL}, context,
+        {"content": [{"type": "text", "text": '{"category": "食品"}'}]},
+    ))
+    [query] = asyncio.run(
+        query_log.load_query_results(context, query_log.executed_queries(state))
+    )
+    assert query["status"] == "ok"
+    assert "rows" not in query
+
+
+def test_query_log_skips_errors_and_approximate_queries():
+    state = {"approximate_queries": [{"original": SQL, "approximate": "SELECT approx FROM s"}]}
+    context = _context(state)
+    query_log.record_query_callback(_tool(), {"query": "SELECT x FROM missing"}, context)
+    asyncio.run(query_log.record_result_callback(
+        _tool(), {"query": "SELECT x FROM missing"}, context,
+        {"content": [{"type": "text", "text": "ERROR: relation does not exist"}]},
+    ))
+    context.function_call_id = "call-2"
+    query_log.record_query_callback(_tool(), {"query": SQL}, context)
+    asyncio.run(query_log.record_result_callback(
+        _tool(), {"query": "SELECT approx FROM s"}, context, {"content": []}
+    ))
+    assert query_log.executed_queries(state) == []
+    assert [q["sql"] for q in query_log.executed_queries(state, include_approximate=True)] == [SQL]
@@ -0,0 +1,161 @@
+import importlib
+
+import pytest
+
+from conftest import fetch
+
+query_router = importlib.import_module("auto-analytics-agent.utils.query_router")
+
+ITEMS_JOIN = (
+    "FROM transaction_items ti JOIN transactions t ON ti.transaction_id = t.transaction_id "
+    "JOIN products p ON ti.product_id = p.product_id"
+)
+
+ROUTED = [
+    f"SELECT p.category, SUM(ti.subtotal) AS sales {ITEMS_JOIN} GROUP BY p.category ORDER BY sales DESC",
+    f"SELECT s.store_name, p.category, SUM(ti.quantity) qty, COUNT(*) AS n {ITEMS_JOIN} "
+    "JOIN stores s ON t.store_id = s.store_id WHERE t.status = 'Completed' "
+    "AND t.transaction_date >= '2024-12-01' AND t.transaction_date < '2024-12-15' "
+    "GROUP BY s.store_name, p.category ORDER BY 1, 2",
+    "SELECT m.member_rank, COUNT(*) AS cnt, SUM(t.total_amount) AS total, "
+    "ROUND(AVG(t.total_amount), 2) AS avg_amount FROM transactions t "
+    "JOIN members m ON t.member_id = m.member_id GROUP BY m.member_rank ORDER BY 1",
+    "SELECT DATE_TRUNC('month', transaction_date) AS month, SUM(total_amount) "
+    "FROM transactions GROUP BY 1 ORDER BY 1",
+    "SELECT TO_CHAR(t.transaction_date, 'YYYY-MM-DD') d, store_id, COUNT(t.transaction_id) "
+    "FROM transactions t GROUP BY 1, 2 ORDER BY 1, 2",
+    "SELECT EXTRACT(DOW FROM t.transaction_date) AS dow, SUM(t.points_earned) FROM transactions t "
+    "WHERE t.transaction_date >= DATE '2024-01-01' GROUP BY dow HAVING SUM(t.points_earned) > 0 "
+    "ORDER BY dow",
+    "SELECT DATE(t.transaction_date) AS day, SUM(t.total_amount) FROM transactions AS t "
+    "INNER JOIN stores AS s ON s.store_id = t.store_id WHERE s.store_name LIKE '%店' "
+    "GROUP BY DATE(t.transaction_date) ORDER BY day LIMIT 5",
+    # 空の範囲の COUNT は 0（NULLではない）
+    "SELECT COUNT(*) FROM transactions WHERE transaction_date >= '2030-01-01'",
+    # bigint 同士の整数除算のまま
+    f"SELECT SUM(ti.quantity) / COUNT(*) AS per_item {ITEMS_JOIN}",
+    # 会員ランクが NULL の会員も内部結合に含まれる
+    "SELECT t.status, COUNT(*), SUM(t.total_amount) FROM transactions t "
+    "JOIN members m ON t.member_id = m.member_id GROUP BY t.status ORDER BY 1",
+    "SELECT store_id, SUM(points_used) FROM transactions GROUP BY 1 ORDER BY 1",
+]
+
+NOT_ROUTED = [
+    # 時刻単位の集計
+    "SELECT EXTRACT(HOUR FROM transaction_date) h, COUNT(*) FROM transactions GROUP BY 1",
+    # ロールアップにないディメンション・集計
+    "SELECT payment_method, SUM(total_amount) FROM transactions GROUP BY 1",
+    "SELECT COUNT(DISTINCT member_id) FROM transactions",
+    "SELECT store_id, MAX(total_amount) FROM transactions GROUP BY 1",
+    f"SELECT p.product_name, SUM(ti.subtotal) {ITEMS_JOIN} GROUP BY 1",
+    # 集計ではない
+    "SELECT * FROM transactions",
+    # 日の途中を含む比較
+    "SELECT SUM(total_amount) FROM transactions WHERE transaction_date <= '2024-12-10'",
+    # 外部結合・結合するテーブルの不一致
+    "SELECT m.member_rank, SUM(t.total_amount) FROM transactions t "
+    "LEFT JOIN members m ON t.member_id = m.member_id GROUP BY 1",
+    "SELECT SUM(ti.subtotal) FROM transaction_items ti "
+    "JOIN transactions t ON ti.transaction_id = t.transaction_id",
+    # members.status と transactions.status が曖昧
+    "SELECT status, COUNT(*) FROM transactions t JOIN members m ON t.member_id = m.member_id "
+    "GROUP BY status",
+    "SELECT store_id, COUNT(*) FROM transactions; DELETE FROM transactions",
+    # 日付リテラルに時刻の演算が続く・前にある比較
+    "SELECT SUM(total_amount) FROM transactions "
+    "WHERE transaction_date >= DATE '2024-01-01' + INTERVAL '12 hours'",
+    "SELECT SUM(total_amount) FROM transactions "
+    "WHERE transaction_date < DATE '2024-01-02' - INTERVAL '6 hours'",
+    "SELECT SUM(total_amount) FROM transactions "
+    "WHERE INTERVAL '6 hours' + transaction_date >= '2024-01-02'",
+]
+
+
+@pytest.mark.parametrize("sql", ROUTED)
+def test_routes_rollup_answerable_queries(sql):
+    routed = query_router.route_query(sql)
+    assert routed is not None
+    assert "sales_daily_" in routed
+
+
+@pytest.mark.parametrize("sql", NOT_ROUTED)
+def test_leaves_other_queries_unchanged(sql):
+    assert query_router.route_query(sql) is None
+
+
+def test_count_keeps_bigint_and_zero():
+    routed = query_router.route_query("SELECT COUNT(*) FROM transactions")
+    assert "COALESCE(SUM(agg.transaction_count), 0)::bigint" in routed
+
+
+def test_inner_join_on_members_filters_on_membership():
+    routed = query_router.route_query(
+        "SELECT m.member_rank, COUNT(*) FROM transactions t "
+        "JOIN members m ON t.member_id = m.member_id GROUP BY 1"
+    )
+    assert "agg.is_member" in routed
+    assert "member_rank IS NOT NULL" not in routed
+
+
+def test_string_literals_are_not_rewritten():
+    routed = query_router.route_query(
+        "SELECT t.status, COUNT(*) FROM transactions t WHERE t.status = 'store_id' GROUP BY 1"
+    )
+    assert "'store_id'" in routed
+
+
+@pytest.fixture
+def rollup_db(db):
+    rows, _ = fetch(db, "SELECT to_regclass('sales_daily_member_rank') IS NOT NULL")
+    if not rows[0][0]:
+        pytest.skip("scripts/rollups.sql is not applied")
+    with db.cursor() as cursor:
+        # 会員ランクが NULL の会員の取引を集計済み・未集計の両方に含める
+        cursor.execute(
+            "INSERT INTO members (member_code, name, member_rank) "
+            "VALUES ('TEST-NULL-RANK', 'test', NULL) RETURNING member_id"
+        )
+        member_id = cursor.fetchone()[0]
+        cursor.execute(
+            "INSERT INTO transactions (transaction_code, store_id, member_id, transaction_date, "
+            "subtotal, tax_amount, total_amount, payment_method) VALUES "
+            "('TEST-TX-1', 1, %s, now() - interval '3 day', 100, 10, 110, 'cash')",
+            (member_id,),
+        )
+        cursor.execute("SELECT * FROM refresh_rollups(TRUE)")
+        # 集計済み範囲より後の日（ビューが元テーブルを集計する側）
+        cursor.execute(
+            "INSERT INTO transactions (transaction_code, store_id, member_id, transaction_date, "
+            "subtotal, tax_amount, total_amount, payment_method) "
+            "SELECT 'TEST-TX-2', 1, %s, MAX(transaction_date) + interval '1 day', 200, 20, 220, "
+            "'cash' FROM transactions",
+            (member_id,),
+        )
+    return db
+
+
+@pytest.mark.parametrize("sql", ROUTED)
+def test_routed_query_returns_same_rows_and_types(rollup_db, sql):
+    expected_rows, expected_types = fetch(rollup_db, sql)
+    rows, types = fetch(rollup_db, query_router.route_query(sql))
+    assert types == expected_types
+    if "ORDER BY" not in sql:
+        rows, expected_rows = sorted(rows, key=repr), sorted(expected_rows, key=repr)
+    assert rows == expected_rows
+
+
+def test_incremental_refresh_picks_up_recent_back_dated_rows(rollup_db):
+    sql = (
+        "SELECT t.transaction_date::date AS day, COUNT(*), SUM(t.total_amount) "
+        "FROM transactions t GROUP BY 1 ORDER BY 1"
+    )
+    with rollup_db.cursor() as cursor:
+        # 集計済みの日（covered_until の2日前）に遅れて登録された取引
+        cursor.execute(
+            "INSERT INTO transactions (transaction_code, store_id, transaction_date, "
+            "subtotal, tax_amount, total_amount, payment_method) "
+            "SELECT 'TEST-TX-LATE', 1, covered_until - 2 + interval '12 hours', 300, 30, 330, "
+            "'cash' FROM rollup_watermarks WHERE rollup_name = 'daily_member_rank'"
+        )
+        cursor.execute("SELECT * FROM refresh_rollups()")
+    assert fetch(rollup_db, query_router.route_query(sql)) == fetch(rollup_db, sql)
@@ -0,0 +1,155 @@
+import importlib
+
+import pytest
+
+report_refresh = importlib.import_module("auto-analytics-agent.utils.report_refresh")
+
+ITEMS_JOIN = (
+    "FROM transaction_items ti JOIN transactions t ON ti.transaction_id = t.transaction_id "
+    "JOIN products p ON ti.product_id = p.product_id"
+)
+
+INCREMENTAL = [
+    f"SELECT p.category, SUM(ti.subtotal) AS sales, COUNT(*) AS n {ITEMS_JOIN} "
+    "WHERE t.status = 'Completed' GROUP BY p.category ORDER BY sales DESC",
+    "SELECT DATE(transaction_date) AS d, SUM(total_amount) total FROM transactions "
+    "GROUP BY 1 ORDER BY 1",
+    "SELECT DATE(t.transaction_date) AS d, t.store_id, COUNT(*) FROM transactions t "
+    "GROUP BY DATE(t.transaction_date), t.store_id",
+    "SELECT store_id AS s, SUM(total_amount) FROM transactions GROUP BY s",
+    "SELECT COUNT(*) FROM transactions;",
+]
+
+FULL = [
+    # 平均は合算できない
+    "SELECT store_id, AVG(total_amount) FROM transactions GROUP BY 1",
+    # GROUP BY の式が出力列にない（行とグループを対応付けられない）
+    "SELECT SUM(total_amount) FROM transactions GROUP BY store_id",
+    "SELECT store_id, SUM(total_amount) FROM transactions GROUP BY store_id, payment_method",
+    "SELECT DATE(transaction_date) AS d, SUM(total_amount) FROM transactions "
+    "GROUP BY transaction_date",
+    # 相対日付・HAVING・LIMIT
+    "SELECT SUM(total_amount) FROM transactions WHERE transaction_date >= now() - interval '7 day'",
+    "SELECT store_id, SUM(total_amount) FROM transactions GROUP BY 1 HAVING SUM(total_amount) > 0",
+    "SELECT store_id, SUM(total_amount) FROM transactions GROUP BY 1 LIMIT 3",
+    # transactions を含まない
+    "SELECT category, COUNT(*) FROM products GROUP BY 1",
+]
+
+
+@pytest.mark.parametrize("sql", INCREMENTAL)
+def test_plans_additive_queries(sql):
+    assert report_refresh.plan_incremental(sql) is not None
+
+
+@pytest.mark.parametrize("sql", FULL)
+def test_other_queries_run_in_full(sql):
+    assert report_refresh.plan_incremental(sql) is None
+
+
+def test_plan_records_measures_and_order():
+    plan = report_refresh.plan_incremental(INCREMENTAL[0])
+    assert plan == {
+        "alias": "t",
+        "measures": [1, 2],
+        "order_by": [{"column": "sales", "descending": True, "nulls": None}],
+    }
+
+
+def test_merge_rows_adds_measures_by_key():
+    rows = [["A", 10, 1], ["B", "2.50", 2]]
+    delta = [["B", "1.25", 1], ["C", 5, None]]
+    merged = report_refresh.merge_rows(rows, delta, [1, 2])
+    assert merged == [["A", 10, 1], ["B", "3.75", 3], ["C", 5, None]]
+
+
+def test_merge_rows_without_group_keys():
+    assert report_refresh.merge_rows([[10, 2]], [[5, 1]], [0, 1]) == [[15, 3]]
+
+
+@pytest.mark.parametrize(
+    "rows, delta",
+    [
+        ([[10], [20], [30]], [[1], [2]]),
+        ([["A", 1], ["A", 2]], []),
+        ([["A", 1]], [["B", 1], ["B", 2]]),
+    ],
+)
+def test_merge_rows_rejects_rows_that_do_not_identify_groups(rows, delta):
+    measures = [len(rows[0]) - 1]
+    with pytest.raises(ValueError):
+        report_refresh.merge_rows(rows, delta, measures)
+
+
+def test_incremental_sql_restricts_to_watermark_window():
+    sql = report_refresh.incremental_sql(
+        "SELECT store_id, SUM(total_amount) FROM transactions t WHERE t.status = 'Completed' "
+        "GROUP BY store_id ORDER BY 2 DESC",
+        "t",
+        "2024-12-01 00:00:00",
+        "2024-12-02 00:00:00",
+    )
+    assert sql == (
+        "SELECT store_id, SUM(total_amount)\n"
+        "FROM transactions t\n"
+        "WHERE (t.status = 'Completed') AND t.transaction_date > TIMESTAMP '2024-12-01 00:00:00' "
+        "AND t.transaction_date <= TIMESTAMP '2024-12-02 00:00:00'\n"
+        "GROUP BY store_id"
+    )
+
+
+@pytest.mark.parametrize("sql", INCREMENTAL)
+def test_incremental_refresh_matches_full_run(db, sql):
+    plan = report_refresh.plan_incremental(sql)
+    with db.cursor() as cursor:
+        previous = report_refresh._current_watermark(cursor)
+        columns, rows = report_refresh._execute(cursor, sql)
+        cursor.execute(
+            "INSERT INTO transactions (transaction_code, store_id, transaction_date, subtotal, "
+            "tax_amount, total_amount, payment_method, status) "
+            "SELECT 'TEST-REFRESH-' || i, i, MAX(transaction_date) + interval '1 hour', "
+            "1000, 100, 1100, 'cash', 'Completed' "
+            "FROM transactions, generate_series(1, 2) i GROUP BY i RETURNING transaction_id"
+        )
+        for (transaction_id,) in cursor.fetchall():
+            cursor.execute(
+                "INSERT INTO transaction_items (transaction_id, product_id, quantity, unit_price, "
+                "subtotal) VALUES (%s, 1, 2, 500, 1000)",
+                (transaction_id,),
+            )
+        watermark = report_refresh._current_watermark(cursor)
+        _, delta = report_refresh._execute(
+            cursor, report_refresh.incremental_sql(sql, plan["alias"], previous, watermark)
+        )
+        _, expected = report_refresh._execute(cursor, sql)
+
+    merged = report_refresh.merge_rows(rows, delta, plan["measures"])
+    if plan["order_by"]:
+        report_refresh._sort_rows(merged, columns, plan["order_by"])
+    else:
+        merged, expected = sorted(merged, key=repr), sorted(expected, key=repr)
+    assert merged == expected
+
+
+def test_save_report_spec_records_retrieved_rows_without_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(report_refresh, "REPORTS_DIR", tmp_path)
+    monkeypatch.setattr(report_refresh, "_connect", lambda: pytest.fail("must not connect"))
+    spec = report_refresh.save_report_spec(
+        "analysis_report_x.html",
+        "title",
+        "now",
+        {"insights": "<p>i</p>"},
+        [
+            {"sql": "SELECT store_id, COUNT(*) FROM transactions GROUP BY 1;",
+             "columns": ["store_id", "count"], "rows": [[1, 3]]},
+            {"sql": "SELECT 1; SELECT 2"},
+        ],
+    )
+    assert spec["watermark"] is None
+    assert spec["queries"] == [
+        {"sql": "SELECT store_id, COUNT(*) FROM transactions GROUP BY 1",
+         "columns": ["store_id", "count"], "rows": [[1, 3]]},
+        {"sql": "SELECT 1"},
+        {"sql": "SELECT 2"},
+    ]
+    assert (tmp_path / "analysis_report_x.json").exists()